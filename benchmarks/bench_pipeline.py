@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(DIRECTORIO, "..", "poller"))
+sys.path.insert(0, os.path.join(DIRECTORIO, "..", "ingestion"))
+import poller
+import bulk_ingest
+from indice_ids import IndiceIds
+from duplicados import IndiceDuplicados
+from descarga_concurrente import extraer_items
+from generador import GeneradorItems, PARAMETROS_DEFECTO, respuesta_api
+
+# Benchmark de extremo a extremo de las etapas del poller y de la ingesta, sobre
+# datos sintéticos y stubs locales (nada sale a la red). Mide throughput y memoria
+# pico por etapa y compara con una línea base guardada.
+
+# --- CONFIGURACIÓN ---
+TAMANOS = [10000, 100000, 1000000]
+TAM_LOTE = 1000                 # items por ciclo del poller (25 páginas x 40)
+ARCHIVO_BASELINE = os.path.join(DIRECTORIO, "baseline.json")
+TOLERANCIA_TIEMPO = 0.25        # regresión si el throughput cae más de un 25%
+TOLERANCIA_MEMORIA = 0.25       # ... o si la memoria pico crece más de un 25% (y más de 1 MB)
+ETAPAS = ["maestro_ids", "indice_ids", "parseo", "dedup_set", "dedup_indice", "duplicados",
+          "scoring", "documento", "ndjson", "bulk", "envio"]
+
+class Medidor:
+    def __init__(self):
+        self.tiempos = defaultdict(float)
+        self.picos = {}
+        self.memoria = False
+
+    @contextmanager
+    def etapa(self, nombre):
+        # En la pasada de memoria solo se anota el pico; en la de tiempos, solo el tiempo
+        if self.memoria:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            yield
+            self.picos[nombre] = max(self.picos.get(nombre, 0), tracemalloc.get_traced_memory()[1] - base)
+        else:
+            inicio = time.perf_counter()
+            yield
+            self.tiempos[nombre] += time.perf_counter() - inicio
+
+class StubElastic(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cuerpo = b'{"took": 1, "errors": false, "items": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args): pass
+
+def preparar_maestro(generador, ruta):
+    # Maestro de partida con tantos documentos como items tiene el lote
+    with open(ruta, "w", encoding="utf-8") as f:
+        for inicio in range(0, generador.num_maestro, TAM_LOTE):
+            for item in generador.maestro(inicio, TAM_LOTE):
+                doc = poller.construir_documento(item, poller.UMBRAL_RIESGO_MINIMO, [], [])
+                f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+
+def procesar_lote(pagina_json, estado, medidor, sesion=None):
+    with medidor.etapa("parseo"):
+        items = extraer_items(json.loads(pagina_json))
+
+    with medidor.etapa("dedup_set"):
+        nuevos_set = [i for i in items if i.get("id") not in estado["ids"]]
+    with medidor.etapa("dedup_indice"):
+        pendientes = set(estado["indice"].filtrar_nuevos([i.get("id") for i in items]))
+        nuevos = [i for i in items if i.get("id") in pendientes]
+    assert len(nuevos) == len(nuevos_set)
+
+    with medidor.etapa("duplicados"):
+        duplicados = [estado["duplicados"].analizar(item) for item in nuevos]
+
+    with medidor.etapa("scoring"):
+        stats_lote = poller.calcular_stats_lote(items)
+        puntuados = []
+        for item, duplicado in zip(nuevos, duplicados):
+            titulo = item.get("title", "").lower()
+            coincidencias, categorias_titulo = poller.DETECTOR.analizar(titulo, item.get("description") or "")
+            if "excluidas" in categorias_titulo: continue
+            risk_score, risk_factors, modelo = poller.calcular_riesgo_inteligente(item, stats_lote, coincidencias, duplicado)
+            if risk_score < poller.UMBRAL_RIESGO_MINIMO: continue
+            found_kw = coincidencias.get("criticas", []) + coincidencias.get("sospechosas", [])
+            puntuados.append((item, risk_score, risk_factors, found_kw, duplicado, None, modelo))
+
+    with medidor.etapa("documento"):
+        docs = [poller.construir_documento(*p) for p in puntuados]
+
+    with medidor.etapa("ndjson"):
+        f = estado["salida"]
+        for doc in docs:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        f.flush()
+
+    with medidor.etapa("bulk"):
+        acciones = ((bulk_ingest.preparar_accion(doc), 0) for doc in docs)
+        lotes = [lote for lote, _ in bulk_ingest.generar_lotes(acciones)]
+        cuerpos = [b"".join(lote) for lote in lotes]
+
+    if sesion is not None:
+        with medidor.etapa("envio"):
+            for lote in lotes:
+                bulk_ingest.enviar_con_reintentos(sesion, lote)
+    return len(docs), sum(len(c) for c in cuerpos)
+
+def ejecutar(n, parametros, memoria=True, envio=True):
+    generador = GeneradorItems(n, **parametros)
+    medidor = Medidor()
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_maestro = os.path.join(tmp, "wallapop_master.json")
+        preparar_maestro(generador, ruta_maestro)
+
+        servidor = sesion = None
+        if envio:
+            servidor = ThreadingHTTPServer(("127.0.0.1", 0), StubElastic)
+            threading.Thread(target=servidor.serve_forever, daemon=True).start()
+            bulk_ingest.ES_URL = f"http://127.0.0.1:{servidor.server_port}"
+            sesion = bulk_ingest.crear_sesion()
+
+        pasadas = [True, False] if memoria else [False]
+        for pasada_memoria in pasadas:
+            # La pasada de memoria solo procesa el primer lote (el pico por lote no depende de n)
+            medidor.memoria = pasada_memoria
+            if pasada_memoria: tracemalloc.start()
+            with medidor.etapa("maestro_ids"):
+                ids = poller.obtener_ids_existentes(ruta_maestro)
+            with medidor.etapa("indice_ids"):
+                indice = IndiceIds(ruta_maestro, os.path.join(tmp, f"ids-{pasada_memoria}.db"))
+            estado = {"ids": ids, "indice": indice,
+                      "duplicados": IndiceDuplicados(os.path.join(tmp, f"dup-{pasada_memoria}.db")),
+                      "salida": open(os.path.join(tmp, f"salida-{pasada_memoria}.json"), "w", encoding="utf-8")}
+
+            docs = bytes_bulk = 0
+            for inicio in range(0, n, TAM_LOTE):
+                pagina = json.dumps(respuesta_api(generador.lote(inicio, TAM_LOTE)), ensure_ascii=False)
+                d, b = procesar_lote(pagina, estado, medidor, sesion)
+                docs += d
+                bytes_bulk += b
+                if pasada_memoria: break
+            estado["salida"].close()
+            indice.cerrar()
+            estado["duplicados"].cerrar()
+            del ids, estado
+            if pasada_memoria: tracemalloc.stop()
+
+        if servidor:
+            sesion.close()
+            servidor.shutdown()
+
+    resultados = {}
+    for etapa in ETAPAS:
+        if etapa not in medidor.tiempos: continue
+        segundos = medidor.tiempos[etapa]
+        resultados[etapa] = {
+            "segundos": round(segundos, 4),
+            "items_s": round(n / segundos, 1) if segundos else None,
+            "pico_mb": round(medidor.picos[etapa] / 2**20, 2) if etapa in medidor.picos else None,
+        }
+    print(f"[*] n={n}: {docs} docs guardados, {bytes_bulk / 2**20:.1f} MB de cuerpo _bulk")
+    return resultados
+
+def imprimir(n, resultados):
+    print(f"\n    {'etapa':<14}{'items/s':>14}{'segundos':>11}{'pico MB':>10}")
+    for etapa, r in resultados.items():
+        pico = f"{r['pico_mb']:.2f}" if r["pico_mb"] is not None else "-"
+        print(f"    {etapa:<14}{r['items_s'] or 0:>14,.0f}{r['segundos']:>11.3f}{pico:>10}")
+    print()
+
+def comparar(actual, baseline):
+    # Devuelve la lista de regresiones (texto) respecto a la línea base
+    regresiones = []
+    for n, etapas in actual.items():
+        for etapa, r in etapas.items():
+            base = baseline.get(n, {}).get(etapa)
+            if not base: continue
+            if base.get("items_s") and r["items_s"] and r["items_s"] < base["items_s"] * (1 - TOLERANCIA_TIEMPO):
+                regresiones.append(f"n={n} {etapa}: {r['items_s']:,.0f} items/s (base {base['items_s']:,.0f})")
+            if base.get("pico_mb") is not None and r["pico_mb"] is not None \
+                    and r["pico_mb"] > base["pico_mb"] * (1 + TOLERANCIA_MEMORIA) and r["pico_mb"] - base["pico_mb"] > 1:
+                regresiones.append(f"n={n} {etapa}: pico {r['pico_mb']:.1f} MB (base {base['pico_mb']:.1f} MB)")
+    return regresiones
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline poller -> maestro -> _bulk")
+    parser.add_argument("--tamanos", default=",".join(map(str, TAMANOS)), help="p.ej. 10000,100000")
+    parser.add_argument("--sin-memoria", action="store_true", help="No medir memoria pico (tracemalloc)")
+    parser.add_argument("--sin-envio", action="store_true", help="No enviar los _bulk al stub local")
+    parser.add_argument("--guardar-baseline", action="store_true", help="Guarda estos resultados como línea base")
+    parser.add_argument("--baseline", default=ARCHIVO_BASELINE)
+    for clave, valor in PARAMETROS_DEFECTO.items():
+        parser.add_argument(f"--{clave.replace('_', '-')}", type=type(valor), default=valor)
+    args = parser.parse_args()
+
+    parametros = {k: getattr(args, k) for k in PARAMETROS_DEFECTO}
+    actual = {}
+    for n in [int(t) for t in args.tamanos.split(",")]:
+        actual[str(n)] = ejecutar(n, parametros, not args.sin_memoria, not args.sin_envio)
+        imprimir(n, actual[str(n)])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.guardar_baseline:
+        baseline.update(actual)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"[*] Línea base guardada en {args.baseline}")
+    elif baseline:
+        regresiones = comparar(actual, baseline)
+        for r in regresiones:
+            print(f"[!] REGRESIÓN {r}")
+        if regresiones: sys.exit(1)
+        print("[*] Sin regresiones respecto a la línea base.")
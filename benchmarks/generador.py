@@ -0,0 +1,127 @@
+import argparse
+import bisect
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+from poller import PRECIOS_REFERENCIA, PALABRAS_EXCLUIDAS, KEYWORDS_CRITICAS, KEYWORDS_SOSPECHOSAS
+
+# Generador de respuestas sintéticas con la forma de la API de búsqueda
+# (data.section.payload.items). Todo es determinista a partir de la semilla:
+# el mismo (semilla, inicio, n) produce siempre los mismos items.
+
+# --- CONFIGURACIÓN ---
+PARAMETROS_DEFECTO = {
+    "tasa_duplicados": 0.3,       # fracción de items que ya están en el maestro
+    "densidad_keywords": 0.15,    # fracción de descripciones con keywords críticas/sospechosas
+    "sesgo_vendedores": 1.1,      # exponente Zipf: cuanto mayor, más anuncios acumulan los vendedores top
+    "vendedores_por_item": 0.2,   # nº de vendedores distintos / nº de items
+    "tasa_accesorios": 0.1,       # títulos de fundas, cargadores... (los descarta el filtro)
+    "tasa_chollos": 0.05,         # precios muy por debajo de la referencia
+    "tasa_telefono": 0.03,        # teléfono en la descripción
+    "semilla": 1234,
+}
+ITEMS_POR_PAGINA = 40
+
+CIUDADES = [("Madrid", 40.4168, -3.7038), ("Barcelona", 41.3874, 2.1686), ("Valencia", 39.4699, -0.3763),
+            ("Sevilla", 37.3891, -5.9845), ("Zaragoza", 41.6488, -0.8891), ("Málaga", 36.7213, -4.4214),
+            ("Bilbao", 43.2630, -2.9350), ("Murcia", 37.9922, -1.1307)]
+COLORES = ["negro", "blanco", "azul", "rojo", "verde", "morado", "grafito", "plata", "oro", "titanio natural"]
+CAPACIDADES = [64, 128, 256, 512]
+FRASES = [
+    "Se vende en perfecto estado, siempre con funda y protector.", "Batería al {bat}%.",
+    "Libre de operador.", "Con caja y cargador original.", "Algún arañazo en el marco, pantalla perfecta.",
+    "Entrega en mano en el centro o envío por Wallapop.", "Factura de compra disponible.",
+    "Lo vendo porque me he cambiado de móvil.", "Face ID funcionando.", "Sin golpes ni reparaciones.",
+]
+
+def id_item(prefijo, n):
+    return hashlib.blake2b(f"{prefijo}{n}".encode(), digest_size=6).hexdigest()
+
+class GeneradorItems:
+    def __init__(self, num_items, **parametros):
+        self.p = dict(PARAMETROS_DEFECTO, **parametros)
+        self.num_items = num_items
+        self.num_maestro = num_items        # el maestro previo tiene tantos docs como el lote
+        self.num_vendedores = max(50, int(num_items * self.p["vendedores_por_item"]))
+        pesos = (1.0 / (k + 1) ** self.p["sesgo_vendedores"] for k in range(self.num_vendedores))
+        self.pesos_acumulados = list(itertools.accumulate(pesos))
+        self.modelos = list(PRECIOS_REFERENCIA.items())
+        self.keywords = KEYWORDS_CRITICAS + KEYWORDS_SOSPECHOSAS
+
+    def _vendedor(self, rng):
+        x = rng.random() * self.pesos_acumulados[-1]
+        return id_item("u", bisect.bisect_left(self.pesos_acumulados, x))
+
+    def _item(self, rng, id_):
+        p = self.p
+        modelo, referencia = rng.choice(self.modelos)
+        titulo = modelo if modelo.startswith("iphone") else f"iphone {modelo}"
+        titulo = f"{titulo} {rng.choice(CAPACIDADES)}GB {rng.choice(COLORES)}"
+        if rng.random() < p["tasa_accesorios"]:
+            titulo = f"{rng.choice(PALABRAS_EXCLUIDAS)} {titulo}"
+        titulo = titulo.upper() if rng.random() < 0.3 else titulo.capitalize()
+
+        factor = rng.uniform(0.2, 0.5) if rng.random() < p["tasa_chollos"] else rng.lognormvariate(0.25, 0.25)
+        precio = round(referencia * factor, 0)
+
+        frases = rng.sample(FRASES, rng.randint(1, 5))
+        if rng.random() < p["densidad_keywords"]:
+            frases += [f"Acepto {k}." for k in rng.sample(self.keywords, rng.randint(1, 3))]
+        if rng.random() < p["tasa_telefono"]:
+            frases.append(f"Llámame al 6{rng.randint(10000000, 99999999)}")
+        rng.shuffle(frases)
+        descripcion = " ".join(frases).format(bat=rng.randint(75, 100))
+
+        ciudad, lat, lon = rng.choice(CIUDADES)
+        return {
+            "id": id_,
+            "title": titulo,
+            "description": descripcion,
+            "price": {"amount": precio, "currency": "EUR"},
+            "category_id": 24200,
+            "user_id": self._vendedor(rng),
+            "images": [{"urls": {"medium": f"https://cdn.wallapop.com/images/10420/{id_}/i{rng.randint(1, 10**9)}.jpg"}}],
+            "location": {"latitude": lat + rng.uniform(-0.1, 0.1), "longitude": lon + rng.uniform(-0.1, 0.1), "city": ciudad},
+            "created_at": int((time.time() - rng.uniform(0, 86400)) * 1000),
+        }
+
+    def lote(self, inicio, n):
+        # Items [inicio, inicio + n) del lote nuevo (una fracción son IDs ya presentes en el maestro)
+        rng = random.Random(f"{self.p['semilla']}-lote-{inicio}")
+        items = []
+        for i in range(inicio, min(inicio + n, self.num_items)):
+            if rng.random() < self.p["tasa_duplicados"]:
+                id_ = id_item("m", rng.randrange(self.num_maestro))
+            else:
+                id_ = id_item("n", i)
+            items.append(self._item(rng, id_))
+        return items
+
+    def maestro(self, inicio, n):
+        # Items que ya estaban guardados antes del lote (para el maestro de partida)
+        rng = random.Random(f"{self.p['semilla']}-maestro-{inicio}")
+        return [self._item(rng, id_item("m", i)) for i in range(inicio, min(inicio + n, self.num_maestro))]
+
+def respuesta_api(items):
+    return {"data": {"section": {"payload": {"items": items}}}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera páginas sintéticas de la API de Wallapop")
+    parser.add_argument("-n", type=int, default=1000, help="Número de items")
+    parser.add_argument("--salida", default="-", help="Archivo NDJSON (una respuesta por página) o '-'")
+    for clave, valor in PARAMETROS_DEFECTO.items():
+        parser.add_argument(f"--{clave.replace('_', '-')}", type=type(valor), default=valor)
+    args = parser.parse_args()
+
+    parametros = {k: getattr(args, k) for k in PARAMETROS_DEFECTO}
+    generador = GeneradorItems(args.n, **parametros)
+    salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8")
+    for inicio in range(0, args.n, ITEMS_POR_PAGINA):
+        salida.write(json.dumps(respuesta_api(generador.lote(inicio, ITEMS_POR_PAGINA)), ensure_ascii=False) + "\n")
+    if salida is not sys.stdout: salida.close()
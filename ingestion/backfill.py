@@ -0,0 +1,507 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+import poller
+import almacenamiento
+import archivo_columnar
+import bulk_ingest
+import metricas
+from estadisticas_precio import EstadisticasPrecios, ARCHIVO_ESTADISTICAS
+from indice_ids import IndiceIds
+
+# Re-scoring masivo: cuando cambian PRECIOS_REFERENCIA, el umbral o las listas de keywords,
+# los documentos ya guardados conservan su enrichment antiguo y los items que no pasaron el
+# umbral ni siquiera están. Este job:
+#  - Fija al crear la versión un plan de tareas sobre rangos crudos: trozos de bytes del maestro
+#    alineados a línea, un segmento del archivo columnar por tarea (opcional) y trozos de las capturas
+#    de items crudos de la API. Cada proceso del pool lee y parsea su rango; el padre solo reparte,
+#    suma y escribe (no parsea ni guarda IDs de todo el histórico).
+#  - Dos pasadas en el pool: contexto (precios y anuncios por vendedor y día) y scoring.
+#  - Escribe una salida versionada en versiones_scoring/<versión>/ (maestro re-puntuado, segmentos
+#    re-puntuados del archivo y manifiesto).
+#  - Envía a Elastic _update parciales con solo los campos de enrichment que cambian (y un
+#    index completo para los items crudos que ahora sí superan el umbral).
+#  - Es reanudable: tras cada tarea escrita y enviada se guarda un checkpoint.
+#  - Al terminar promueve la versión: el maestro re-puntuado (más la cola que el poller haya escrito
+#    mientras tanto) sustituye al vivo y los segmentos re-puntuados a los del archivo. El resto de
+#    destinos (sqlite), el índice de IDs y el visor ven el maestro rotado y se resincronizan.
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_BACKFILL = "versiones_scoring"
+BYTES_TROZO = 2 * 1024 * 1024   # NDJSON por tarea del pool (~2000 documentos)
+TROZOS_EN_VUELO_POR_PROCESO = 2 # acota la memoria: no se lee más input del que se puede procesar
+PATRON_VENDEDOR_MASIVO = re.compile(r"Vendedor masivo \((\d+) items\)")
+
+# ==============================================================================
+# PLAN DE TAREAS
+# ==============================================================================
+
+def _fin_ultima_linea(ruta):
+    # Tamaño hasta el último salto de línea: una línea a medio escribir por el poller queda para la cola
+    with open(ruta, "rb") as f:
+        fin = f.seek(0, os.SEEK_END)
+        while fin > 0:
+            inicio = max(0, fin - 65536)
+            f.seek(inicio)
+            salto = f.read(fin - inicio).rfind(b"\n")
+            if salto >= 0: return inicio + salto + 1
+            fin = inicio
+    return 0
+
+def _rangos(ruta, limite, tam=BYTES_TROZO):
+    # Trozos [inicio, fin) que acaban en fin de línea; solo seek + readline, sin parsear nada
+    rangos = []
+    inicio = 0
+    with open(ruta, "rb") as f:
+        while inicio < limite:
+            f.seek(min(inicio + tam, limite))
+            if f.tell() < limite: f.readline()
+            fin = min(f.tell(), limite)
+            rangos.append((inicio, fin))
+            inicio = fin
+    return rangos
+
+def archivos_crudos(ruta):
+    if os.path.isdir(ruta):
+        patrones = ("**/*.json", "**/*.jsonl", "**/*.ndjson", "**/*.gz")
+        return sorted({a for p in patrones for a in glob.glob(os.path.join(ruta, p), recursive=True)})
+    return [ruta]
+
+def planificar(manifiesto):
+    # Orden determinista (archivo, maestro, crudos); se guarda en el manifiesto para reanudar
+    tareas = []
+    if manifiesto["con_archivo"]:
+        tareas += [["archivo", ruta] for ruta in archivo_columnar.segmentos(manifiesto["directorio_archivo"])]
+    tareas += [["maestro", manifiesto["maestro"], i, f]
+               for i, f in _rangos(manifiesto["maestro"], manifiesto["limite_maestro"])]
+    for ruta in manifiesto["crudos"]:
+        if ruta.endswith(".gz"):
+            tareas.append(["crudos", ruta, 0, None])
+        else:
+            tareas += [["crudos", ruta, i, f] for i, f in _rangos(ruta, os.path.getsize(ruta))]
+    return tareas
+
+# ==============================================================================
+# ENTRADA (procesos del pool)
+# ==============================================================================
+
+_contexto = None
+_indice = None
+
+def _iniciar_trabajador(contexto):
+    global _contexto, _indice
+    _contexto = contexto
+    _indice = IndiceIds(contexto["maestro"], solo_lectura=True)
+
+def _lineas(ruta, inicio, fin):
+    # fin None: captura .gz entera
+    if fin is None:
+        with gzip.open(ruta, "rb") as f:
+            yield from f
+        return
+    with open(ruta, "rb") as f:
+        f.seek(inicio)
+        yield from f.read(fin - inicio).splitlines()
+
+def leer_tarea(tarea):
+    # ("doc", documento) del archivo o del maestro / ("item", item crudo) de una captura: cada
+    # línea es una respuesta de la API (data.section.payload.items) o un item suelto
+    if tarea[0] == "archivo":
+        for doc in archivo_columnar.Segmento(tarea[1]).leer():
+            yield "doc", doc
+        return
+    for linea in _lineas(*tarea[1:]):
+        if not linea.strip(): continue
+        try:
+            objeto = json.loads(linea)
+        except ValueError as e:
+            metricas.registrar_error("backfill", e)
+            continue
+        if tarea[0] == "maestro":
+            yield "doc", objeto
+        elif "data" in objeto:
+            for item in objeto.get("data", {}).get("section", {}).get("payload", {}).get("items", []):
+                yield "item", item
+        else:
+            yield "item", objeto
+
+def entradas(tarea):
+    # Los crudos que ya están como documento (índice de IDs del maestro y el archivo) se saltan.
+    # Los repetidos entre capturas los descarta el padre, que ve las tareas en orden.
+    pares = list(leer_tarea(tarea))
+    if tarea[0] != "crudos": return pares
+    nuevos = set(_indice.filtrar_nuevos([objeto.get("id") for _, objeto in pares]))
+    return [(tipo, objeto) for tipo, objeto in pares if objeto.get("id") in nuevos]
+
+def _item(tipo, objeto):
+    return objeto if tipo == "item" else poller.documento_a_item(objeto)
+
+def _dia(tipo, objeto):
+    # Día de publicación (la actividad de vendedores del poller también cuenta por created_at)
+    if tipo == "doc": return ((objeto.get("timestamps") or {}).get("created_at") or "")[:10]
+    ts = objeto.get("created_at")
+    return datetime.fromtimestamp(ts / 1000.0, timezone.utc).strftime("%Y-%m-%d") if ts else ""
+
+def contar_tarea(tarea):
+    # Primera pasada: precios y anuncios por (vendedor, día) de la tarea (equivale al conteo
+    # lote/24h que usa el poller). Los crudos van por ID para deduplicarlos entre capturas.
+    precios = []
+    conteo = Counter()
+    crudos = {}
+    for tipo, objeto in entradas(tarea):
+        item = _item(tipo, objeto)
+        precio = item.get("price", {}).get("amount") or 0
+        clave = (item.get("user_id"), _dia(tipo, objeto))
+        if tipo == "item":
+            crudos.setdefault(item.get("id"), (clave, precio))
+            continue
+        if precio > 50: precios.append(precio)
+        conteo[clave] += 1
+    return np.array(precios, dtype=np.float64), conteo, crudos
+
+def calcular_contexto(pool, tareas):
+    # El padre solo suma contadores, concatena precios y guarda los crudos nuevos (no el histórico)
+    precios = []
+    conteo = Counter()
+    crudos = {}
+    for precios_tarea, conteo_tarea, crudos_tarea in pool.imap(contar_tarea, tareas):
+        precios.append(precios_tarea)
+        conteo.update(conteo_tarea)
+        for id_item, valor in crudos_tarea.items():
+            crudos.setdefault(id_item, valor)
+    for clave, _ in crudos.values():
+        conteo[clave] += 1
+    precios.append(np.array([p for _, p in crudos.values() if p > 50], dtype=np.float64))
+    precios = np.concatenate(precios)
+    return {"precio_medio": float(np.median(precios)) if len(precios) else 400, "conteo": conteo,
+            "total": sum(conteo.values())}
+
+# ==============================================================================
+# SCORING (procesos del pool)
+# ==============================================================================
+
+def _conteo_guardado(enrichment):
+    # Anuncios del vendedor con los que se puntuó el documento: el poller suma la actividad entre
+    # ciclos (24h móviles), que aquí ya no se puede reconstruir, así que el conteo nunca baja
+    for factor in enrichment.get("risk_factors") or ():
+        encontrado = PATRON_VENDEDOR_MASIVO.fullmatch(factor)
+        if encontrado: return int(encontrado.group(1))
+    return 0
+
+def puntuar(tipo, objeto, contexto, version):
+    # Devuelve (documento nuevo o None, acción _bulk o None)
+    item = _item(tipo, objeto)
+    titulo = (item.get("title") or "").lower()
+    coincidencias, categorias = poller.DETECTOR.analizar(titulo, item.get("description") or "")
+    enrichment = (objeto.get("enrichment") or {}) if tipo == "doc" else {}
+    if "excluidas" in categorias:
+        risk_score, risk_factors, modelo = 0, ["Excluido por palabras clave"], enrichment.get("model")
+    else:
+        usuario = item.get("user_id")
+        anuncios = max(contexto["conteo"].get((usuario, _dia(tipo, objeto)), 0), _conteo_guardado(enrichment))
+        stats = {"precio_medio": contexto["precio_medio"],
+                 "conteo_vendedores": {usuario: anuncios},
+                 "referencia_mercado": contexto["referencia_mercado"]}
+        risk_score, risk_factors, modelo = poller.calcular_riesgo_inteligente(
+            item, stats, coincidencias, enrichment.get("near_duplicate"), enrichment.get("image"))
+    found_kw = coincidencias.get("criticas", []) + coincidencias.get("sospechosas", [])
+
+    if tipo == "item":
+        # Crudo que no llegó a guardarse: solo entra si ahora supera el umbral
+        if risk_score < poller.UMBRAL_RIESGO_MINIMO: return None, None
+        doc = poller.construir_documento(item, risk_score, risk_factors, found_kw, modelo=modelo)
+        doc["enrichment"]["scoring_version"] = version
+        return doc, bulk_ingest.preparar_accion(doc)
+
+    nuevo = {"risk_score": risk_score, "risk_factors": risk_factors, "suspicious_keywords": found_kw,
+             "model": modelo}
+    cambios = {k: v for k, v in nuevo.items() if enrichment.get(k) != v}
+    doc = dict(objeto, enrichment=dict(enrichment, **nuevo, scoring_version=version))
+    if not cambios or not doc.get("id"): return doc, None
+    cambios["scoring_version"] = version
+    meta = {"update": {"_index": bulk_ingest.INDEX_NAME, "_id": doc["id"]}}
+    accion = (json.dumps(meta) + "\n" + json.dumps({"doc": {"enrichment": cambios}}, ensure_ascii=False) + "\n")
+    return doc, accion.encode("utf-8")
+
+def ruta_segmento_version(directorio, directorio_archivo, ruta_segmento):
+    # Misma partición y nombre que el segmento original, dentro de la versión
+    return os.path.join(directorio, archivo_columnar.DIRECTORIO_ARCHIVO, os.path.relpath(ruta_segmento, directorio_archivo))
+
+def puntuar_trozo(args):
+    # Devuelve (número, líneas del maestro, acciones, crudos nuevos [(id, línea, acción)], leídos).
+    # Los segmentos del archivo se reescriben re-puntuados en la versión (mismas filas, mismo orden).
+    numero, tarea, version = args
+    pares = entradas(tarea)
+    lineas = []
+    acciones = []
+    nuevos = []
+    docs = []
+    for tipo, objeto in pares:
+        doc, accion = puntuar(tipo, objeto, _contexto, version)
+        if doc is None: continue
+        linea = json.dumps(doc, ensure_ascii=False) + "\n"
+        if tipo == "item":
+            nuevos.append((doc["id"], linea.encode("utf-8"), accion))
+            continue
+        if tarea[0] == "archivo": docs.append(doc)
+        else: lineas.append(linea)
+        if accion is not None: acciones.append(accion)
+    if tarea[0] == "archivo":
+        ruta = ruta_segmento_version(_contexto["directorio"], _contexto["directorio_archivo"], tarea[1])
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        archivo_columnar.escribir_segmento(ruta, docs)
+    return numero, "".join(lineas).encode("utf-8"), acciones, nuevos, len(pares)
+
+# ==============================================================================
+# VERSIONES Y CHECKPOINT
+# ==============================================================================
+
+def huella_configuracion():
+    # Cambia cuando cambian precios, modelos, umbral o listas de keywords
+    config = {
+        "precios": poller.PRECIOS_REFERENCIA, "umbral": poller.UMBRAL_RIESGO_MINIMO,
+        "excluidas": poller.PALABRAS_EXCLUIDAS, "criticas": poller.KEYWORDS_CRITICAS,
+        "sospechosas": poller.KEYWORDS_SOSPECHOSAS,
+    }
+    if os.path.exists(poller.ARCHIVO_MODELOS):
+        with open(poller.ARCHIVO_MODELOS, "r", encoding="utf-8") as f:
+            config["modelos"] = f.read()
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:8]
+
+def _escribir_json(ruta, datos):
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, ruta)
+
+def nueva_version(ruta_maestro, crudos, con_archivo):
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{huella_configuracion()}"
+    directorio = os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), DIRECTORIO_BACKFILL, version)
+    os.makedirs(directorio)
+    manifiesto = {
+        "version": version, "estado": "en_curso", "creado": datetime.now(timezone.utc).isoformat(),
+        "maestro": os.path.abspath(ruta_maestro), "inode_maestro": os.stat(ruta_maestro).st_ino,
+        "limite_maestro": _fin_ultima_linea(ruta_maestro),
+        # Si Elastic ya tenía todo el maestro leído, tras promover basta con trasladar su checkpoint
+        "checkpoint_elastic": bulk_ingest.cargar_checkpoint(ruta_maestro, "elastic"),
+        "con_archivo": con_archivo, "directorio_archivo": archivo_columnar.directorio_archivo(ruta_maestro),
+        "crudos": [os.path.abspath(a) for r in crudos for a in archivos_crudos(r)],
+        "trozos_hechos": 0, "bytes_salida": 0, "leidos": 0, "actualizados": 0,
+    }
+    manifiesto["tareas"] = planificar(manifiesto)
+    _escribir_json(os.path.join(directorio, "manifiesto.json"), manifiesto)
+    return directorio, manifiesto
+
+def _versiones(ruta_maestro):
+    base = os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), DIRECTORIO_BACKFILL)
+    for directorio in sorted(glob.glob(os.path.join(base, "*")), reverse=True):
+        ruta = os.path.join(directorio, "manifiesto.json")
+        if not os.path.exists(ruta): continue
+        with open(ruta, "r", encoding="utf-8") as f:
+            yield directorio, json.load(f)
+
+def ultima_version_pendiente(ruta_maestro):
+    for directorio, manifiesto in _versiones(ruta_maestro):
+        # Las versiones sin plan de tareas son de antes de repartir por rangos: no se pueden reanudar
+        if manifiesto.get("estado") != "completo" and "tareas" in manifiesto: return directorio, manifiesto
+    return None, None
+
+def ultima_version_sin_promover(ruta_maestro):
+    for directorio, manifiesto in _versiones(ruta_maestro):
+        if manifiesto.get("estado") == "completo" and "tareas" in manifiesto and not manifiesto.get("promovido"):
+            return directorio, manifiesto
+    return None, None
+
+# ==============================================================================
+# JOB
+# ==============================================================================
+
+def backfill(directorio, manifiesto, procesos=None, enviar=True, promover=True):
+    procesos = procesos or os.cpu_count() or 1
+    ruta_manifiesto = os.path.join(directorio, "manifiesto.json")
+    ruta_salida = os.path.join(directorio, poller.ARCHIVO_MAESTRO)
+    version = manifiesto["version"]
+    tareas = manifiesto["tareas"]
+    hechos = manifiesto["trozos_hechos"]
+    if hechos: print(f"[*] Reanudando {version} desde la tarea {hechos} de {len(tareas)}")
+
+    inicio = time.time()
+    # El índice de IDs se pone al día una vez aquí; los procesos lo consultan en solo lectura
+    IndiceIds(manifiesto["maestro"]).cerrar()
+    contexto = {"maestro": manifiesto["maestro"], "directorio": directorio,
+                "directorio_archivo": manifiesto["directorio_archivo"]}
+    with Pool(procesos, initializer=_iniciar_trabajador, initargs=(contexto,)) as pool:
+        contexto = dict(contexto, **calcular_contexto(pool, tareas))
+    ruta_estadisticas = os.path.join(os.path.dirname(manifiesto["maestro"]), ARCHIVO_ESTADISTICAS)
+    # Medianas de mercado como dict plano (el contexto viaja a los procesos del pool)
+    estadisticas = EstadisticasPrecios.cargar(ruta_estadisticas)
+    consulta = estadisticas.consulta()
+    contexto["referencia_mercado"] = {m: consulta.get(m) for m in estadisticas.modelos if consulta.get(m) is not None}
+    print(f"[*] {contexto['total']} documentos/items de entrada en {len(tareas)} tareas | mediana de precios "
+          f"{contexto['precio_medio']:.0f}€ | {procesos} procesos ({time.time() - inicio:.1f}s de preparación)")
+
+    # La salida se trunca al último checkpoint (lo escrito después de él se rehace)
+    with open(ruta_salida, "a+b") as salida:
+        salida.truncate(manifiesto["bytes_salida"])
+    emitidos = _crudos_emitidos(ruta_salida, manifiesto)
+    salida = open(ruta_salida, "ab")
+    sesion = bulk_ingest.crear_sesion() if enviar else None
+    completo = True
+    inicio = time.time()
+
+    pendientes = ((n, t, version) for n, t in enumerate(tareas) if n >= hechos)
+    with Pool(procesos, initializer=_iniciar_trabajador, initargs=(contexto,)) as pool:
+        en_vuelo = deque()
+        for tarea in pendientes:
+            en_vuelo.append(pool.apply_async(puntuar_trozo, (tarea,)))
+            if len(en_vuelo) < procesos * TROZOS_EN_VUELO_POR_PROCESO: continue
+            if not _consumir(en_vuelo.popleft().get(), salida, sesion, emitidos, manifiesto, ruta_manifiesto):
+                completo = False
+                break
+        while completo and en_vuelo:
+            if not _consumir(en_vuelo.popleft().get(), salida, sesion, emitidos, manifiesto, ruta_manifiesto):
+                completo = False
+    salida.close()
+    if sesion: sesion.close()
+
+    duracion = time.time() - inicio
+    if completo:
+        manifiesto["estado"] = "completo"
+        manifiesto["terminado"] = datetime.now(timezone.utc).isoformat()
+        manifiesto["enviado"] = enviar
+        _escribir_json(ruta_manifiesto, manifiesto)
+        print(f"[*] Backfill {version} completo: {manifiesto['leidos']} leídos, {manifiesto['actualizados']} "
+              f"acciones _update/index en {duracion:.1f}s → {ruta_salida}")
+    else:
+        print(f"[!] Backfill {version} interrumpido en la tarea {manifiesto['trozos_hechos']}. "
+              f"Se puede seguir con --reanudar.")
+    metricas.ETAPAS.observar(duracion, etapa="backfill")
+    if completo and promover: return promover_version(directorio, manifiesto)
+    return completo
+
+def _crudos_emitidos(ruta_salida, manifiesto):
+    # Al reanudar: IDs de los crudos ya escritos (solo la parte de la salida que viene de capturas)
+    emitidos = set()
+    if "inicio_crudos" not in manifiesto: return emitidos
+    with open(ruta_salida, "rb") as f:
+        f.seek(manifiesto["inicio_crudos"])
+        for linea in f.read(manifiesto["bytes_salida"] - manifiesto["inicio_crudos"]).splitlines():
+            emitidos.add(json.loads(linea).get("id"))
+    return emitidos
+
+def _consumir(resultado, salida, sesion, emitidos, manifiesto, ruta_manifiesto):
+    # Escribe y envía una tarea (en orden) y avanza el checkpoint. False si Elastic sigue fallando.
+    numero, lineas, acciones, nuevos, leidos = resultado
+    if nuevos:
+        # Un crudo repetido en varias capturas solo entra la primera vez (en orden de tareas)
+        manifiesto.setdefault("inicio_crudos", salida.tell())
+        lineas = [lineas]
+        for id_item, linea, accion in nuevos:
+            if id_item in emitidos: continue
+            emitidos.add(id_item)
+            lineas.append(linea)
+            acciones.append(accion)
+        lineas = b"".join(lineas)
+    if sesion is not None:
+        for lote, _ in bulk_ingest.generar_lotes((a, numero) for a in acciones):
+            _, pendientes, _ = bulk_ingest.enviar_con_reintentos(sesion, lote)
+            if pendientes:
+                print(f"[!] {len(pendientes)} docs siguen fallando en la tarea {numero}.")
+                return False
+    salida.write(lineas)
+    salida.flush()
+    manifiesto["trozos_hechos"] = numero + 1
+    manifiesto["bytes_salida"] = salida.tell()
+    manifiesto["leidos"] += leidos
+    manifiesto["actualizados"] += len(acciones)
+    _escribir_json(ruta_manifiesto, manifiesto)
+    return True
+
+# ==============================================================================
+# PROMOCIÓN
+# ==============================================================================
+
+def promover_version(directorio, manifiesto):
+    # Sustituye el maestro vivo y los segmentos del archivo por los re-puntuados. Solo si el maestro
+    # sigue siendo el archivo que se leyó: si ha rotado (p.ej. bulk_ingest.py --archivar) la versión
+    # ya no cuadra con él y hay que lanzar otra.
+    ruta = manifiesto["maestro"]
+    # Maestro nuevo = salida de la versión + lo que el poller haya añadido después de 'limite_maestro'.
+    # La copia grande va antes; la cola y el os.replace, con el maestro bloqueado (ningún proceso
+    # puede añadir líneas entre la copia de la cola y la sustitución).
+    tmp = ruta + ".backfill"
+    shutil.copyfile(os.path.join(directorio, poller.ARCHIVO_MAESTRO), tmp)
+    with almacenamiento.bloqueo_maestro(ruta):
+        st = os.stat(ruta)
+        if st.st_ino != manifiesto["inode_maestro"] or st.st_size < manifiesto["limite_maestro"]:
+            os.remove(tmp)
+            print(f"[!] El maestro ha rotado desde que empezó {manifiesto['version']}: no se promueve. "
+                  f"Lanza un backfill nuevo.")
+            return False
+        checkpoint = bulk_ingest.cargar_checkpoint(ruta, "elastic")
+
+        for tarea in manifiesto["tareas"]:
+            if tarea[0] != "archivo": continue
+            nuevo = ruta_segmento_version(directorio, manifiesto["directorio_archivo"], tarea[1])
+            if os.path.exists(nuevo): os.replace(nuevo, tarea[1])
+
+        with open(tmp, "ab") as salida, open(ruta, "rb") as f:
+            f.seek(manifiesto["limite_maestro"])
+            shutil.copyfileobj(f, salida)
+        os.replace(tmp, ruta)
+
+        # Elastic ya recibió los _update: si antes de empezar tenía todo lo leído, su checkpoint se
+        # traslada al maestro nuevo. Si no (o con --sin-envio), el inode nuevo fuerza la resincronización.
+        if manifiesto.get("enviado") and checkpoint >= manifiesto["checkpoint_elastic"] >= manifiesto["limite_maestro"]:
+            bulk_ingest.guardar_checkpoint(ruta, manifiesto["bytes_salida"] + checkpoint - manifiesto["limite_maestro"], "elastic")
+    IndiceIds(ruta).cerrar()
+    manifiesto["promovido"] = datetime.now(timezone.utc).isoformat()
+    _escribir_json(os.path.join(directorio, "manifiesto.json"), manifiesto)
+    print(f"[*] Versión {manifiesto['version']} promovida: {ruta} y el archivo llevan los scores nuevos.")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-puntúa el maestro (y crudos), actualiza Elastic y promueve la versión")
+    parser.add_argument("--crudos", action="append", default=[],
+                        help="Archivo o directorio con respuestas/items crudos de la API (.json/.jsonl/.gz)")
+    parser.add_argument("--con-archivo", action="store_true", help="Incluye los días del archivo columnar")
+    parser.add_argument("--procesos", type=int, default=None, help="Por defecto, todos los núcleos")
+    parser.add_argument("--sin-envio", action="store_true", help="No envía nada a Elastic")
+    parser.add_argument("--sin-promover", action="store_true",
+                        help="Deja la versión aparte sin tocar el maestro ni el archivo")
+    parser.add_argument("--reanudar", action="store_true", help="Continúa la última versión sin terminar")
+    parser.add_argument("--promover", action="store_true", help="Promueve la última versión completa sin promover")
+    args = parser.parse_args()
+
+    metricas.iniciar("backfill")
+    ruta_maestro = bulk_ingest.localizar_archivo_maestro()
+    if ruta_maestro is None:
+        print(f"[!] No encuentro {bulk_ingest.ARCHIVO_MAESTRO}.")
+        sys.exit(1)
+    if args.promover:
+        directorio, manifiesto = ultima_version_sin_promover(ruta_maestro)
+        if directorio is None:
+            print("[*] No hay ninguna versión completa pendiente de promover.")
+            sys.exit(0)
+        sys.exit(0 if promover_version(directorio, manifiesto) else 1)
+    directorio = manifiesto = None
+    if args.reanudar:
+        directorio, manifiesto = ultima_version_pendiente(ruta_maestro)
+        if directorio is None: print("[*] No hay ningún backfill pendiente; se empieza uno nuevo.")
+    if directorio is None:
+        directorio, manifiesto = nueva_version(ruta_maestro, args.crudos, args.con_archivo)
+    sys.exit(0 if backfill(directorio, manifiesto, args.procesos, not args.sin_envio, not args.sin_promover) else 1)
@@ -1,27 +1,78 @@
 import json
+import gzip
 import requests
 import glob
 import os
+import sys
+import time
+import random
+import argparse
 import urllib3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+import archivo_columnar
+import almacenamiento
+import capturas
+import metricas
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # --- CONFIGURACIÓN ---
-ES_URL = "https://192.168.153.3:9200" 
+ES_URL = os.environ.get("WALLAPOP_ES_URL", "https://192.168.153.3:9200")
 INDEX_NAME = "wallapop-items"
 AUTH = ('elastic', 'mlJZP3AuDE0pr4q1Rwq8')
 ARCHIVO_MAESTRO = "wallapop_master.json"
 
-def bulk_ingest():
-    # Buscar el archivo maestro
+# --- MODO STREAMING ---
+# Cada petición _bulk se corta por número de documentos o por tamaño (lo que llegue antes)
+MAX_DOCS_LOTE = 1000
+MAX_BYTES_LOTE = 5 * 1024 * 1024
+TIMEOUT_LOTE = 30
+MAX_REINTENTOS = 5
+BACKOFF_BASE = 1.0   # segundos (se duplica en cada reintento)
+BACKOFF_MAX = 30.0
+# Estados por item que merece la pena reintentar (saturación / errores temporales)
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+COMPRIMIR = True            # cuerpos _bulk en gzip (el NDJSON comprime ~10x y la CPU sobra)
+LOTES_EN_VUELO = 2          # peticiones _bulk simultáneas; más solo satura los hilos de escritura de Elastic
+
+# --- DESTINO ---
+# "elastic" o "sqlite" (base embebida junto al maestro, sin clúster). Cada destino lleva su checkpoint.
+# Al reproducir capturas, SQLite salvo que se pida otro: lo reproducido no llega al Elastic real.
+DESTINO = os.environ.get("WALLAPOP_DESTINO") or ("sqlite" if capturas.reproduciendo() else "elastic")
+
+# --- CHECKPOINT INCREMENTAL ---
+# Guarda hasta qué byte del maestro se ha enviado ya (junto a inode/tamaño para detectar rotaciones)
+ARCHIVO_CHECKPOINT = ".bulk_checkpoint.json"
+
+# --- MÉTRICAS ---
+DOCS_LOTE = metricas.histograma("bulk_lote_docs", "Documentos por petición _bulk", buckets=metricas.BUCKETS_LOTE)
+BYTES_LOTE = metricas.histograma("bulk_lote_bytes", "Bytes por petición _bulk",
+                                 buckets=(1e4, 1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7))
+DOCS_BULK = metricas.contador("bulk_docs_total", "Documentos enviados a Elastic por resultado", ("resultado",))
+ERRORES_ITEM = metricas.contador("bulk_errores_item_total", "Errores por item en las respuestas _bulk", ("estado", "tipo"))
+
+def localizar_archivo_maestro():
+    datos = capturas.directorio_datos()
+    if datos:
+        ruta = os.path.join(datos, ARCHIVO_MAESTRO)
+        return ruta if os.path.exists(ruta) else None
     if os.path.exists(ARCHIVO_MAESTRO):
-        ruta_archivo = ARCHIVO_MAESTRO
+        return ARCHIVO_MAESTRO
     elif os.path.exists(f"../ingestion/{ARCHIVO_MAESTRO}"):
-        ruta_archivo = f"../ingestion/{ARCHIVO_MAESTRO}"
+        return f"../ingestion/{ARCHIVO_MAESTRO}"
     elif os.path.exists(f"../poller/{ARCHIVO_MAESTRO}"):
         # Por si acaso se guarda en poller
-        ruta_archivo = f"../poller/{ARCHIVO_MAESTRO}"
-    else:
+        return f"../poller/{ARCHIVO_MAESTRO}"
+    return None
+
+def bulk_ingest():
+    # Buscar el archivo maestro
+    ruta_archivo = localizar_archivo_maestro()
+    if ruta_archivo is None:
         print(f"[!] No encuentro {ARCHIVO_MAESTRO}. Ejecuta el poller primero.")
         return
 
@@ -41,7 +92,9 @@ def bulk_ingest():
                 bulk_data += json.dumps(meta) + "\n"
                 bulk_data += json.dumps(doc) + "\n"
                 count += 1
-            except: continue
+            except ValueError as e:
+                metricas.registrar_error("bulk_ingest", e)
+                continue
 
     if count == 0: 
         print("[!] Archivo vacío.")
@@ -67,5 +120,276 @@ def bulk_ingest():
     except Exception as e:
         print(f"[!] Error de conexión: {e}")
 
+# ==============================================================================
+# MODO STREAMING (lectura perezosa + lotes acotados + reintentos por item)
+# ==============================================================================
+
+def crear_sesion(pool=4):
+    # Una única sesión con keep-alive para todos los lotes
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    sesion.auth = AUTH
+    sesion.verify = False
+    sesion.headers.update({"Content-Type": "application/x-ndjson"})
+    return sesion
+
+def leer_documentos(ruta_archivo, desde=0):
+    # Generador: nunca tiene en memoria más de una línea del maestro.
+    # Devuelve (doc, offset_fin) para poder guardar el checkpoint tras cada lote.
+    with open(ruta_archivo, 'rb') as f:
+        f.seek(desde)
+        offset = desde
+        for linea in f:
+            # Línea a medio escribir por el poller: se deja para el siguiente ciclo
+            if not linea.endswith(b"\n"): break
+            offset += len(linea)
+            if not linea.strip(): continue
+            try:
+                doc = json.loads(linea)
+            except ValueError:
+                continue
+            yield doc, offset
+
+def preparar_accion(doc):
+    meta = {"index": {"_index": INDEX_NAME}}
+    if "id" in doc: meta["index"]["_id"] = doc["id"]
+    return (json.dumps(meta) + "\n" + json.dumps(doc) + "\n").encode('utf-8')
+
+def generar_lotes(acciones, max_docs=MAX_DOCS_LOTE, max_bytes=MAX_BYTES_LOTE):
+    # Agrupa pares (acción serializada, offset_fin) respetando ambos límites.
+    # Devuelve (lote, offset_fin del último doc). Una acción más grande que
+    # max_bytes viaja sola en su propio lote.
+    lote = []
+    tam = 0
+    offset = None
+    for accion, fin in acciones:
+        if lote and (len(lote) >= max_docs or tam + len(accion) > max_bytes):
+            yield lote, offset
+            lote = []
+            tam = 0
+        lote.append(accion)
+        tam += len(accion)
+        offset = fin
+    if lote:
+        yield lote, offset
+
+def ruta_checkpoint(ruta_archivo, destino="elastic"):
+    nombre = ARCHIVO_CHECKPOINT if destino == "elastic" else ARCHIVO_CHECKPOINT.replace(".json", f".{destino}.json")
+    return os.path.join(os.path.dirname(os.path.abspath(ruta_archivo)), nombre)
+
+def cargar_checkpoint(ruta_archivo, destino="elastic"):
+    # Devuelve el offset desde el que hay que seguir (0 si el archivo ha rotado o se ha truncado)
+    ruta = ruta_checkpoint(ruta_archivo, destino)
+    if not os.path.exists(ruta): return 0
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            cp = json.load(f)
+    except (OSError, ValueError):
+        print("[!] Checkpoint ilegible, se hace resincronización completa.")
+        return 0
+
+    st = os.stat(ruta_archivo)
+    if cp.get("inode") != st.st_ino or cp.get("dispositivo") != st.st_dev:
+        print("[*] El archivo maestro ha rotado (inode distinto). Resincronizando desde el principio.")
+        return 0
+    if st.st_size < cp.get("offset", 0):
+        print("[*] El archivo maestro se ha truncado. Resincronizando desde el principio.")
+        return 0
+    return cp.get("offset", 0)
+
+def guardar_checkpoint(ruta_archivo, offset, destino="elastic"):
+    st = os.stat(ruta_archivo)
+    cp = {"inode": st.st_ino, "dispositivo": st.st_dev, "tamano": st.st_size, "offset": offset}
+    ruta = ruta_checkpoint(ruta_archivo, destino)
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cp, f)
+    os.replace(tmp, ruta)
+
+def enviar_lote(sesion, lote):
+    # Devuelve (ok, reintentables, fallidos_definitivos) a partir de la respuesta _bulk.
+    # Si la petición entera falla (conexión, cualquier HTTP != 200: auth, tamaño, 5xx...), todo el
+    # lote queda pendiente y el checkpoint no avanza. Solo los 4xx por item (mapping, etc.) son definitivos.
+    cuerpo = b"".join(lote)
+    DOCS_LOTE.observar(len(lote))
+    BYTES_LOTE.observar(len(cuerpo))
+    cabeceras = None
+    if COMPRIMIR:
+        cuerpo = gzip.compress(cuerpo, compresslevel=1)
+        cabeceras = {"Content-Encoding": "gzip"}
+    try:
+        with metricas.LATENCIA_HTTP.medir(destino="elastic"):
+            r = sesion.post(f"{ES_URL}/_bulk", data=cuerpo, headers=cabeceras, timeout=TIMEOUT_LOTE)
+    except requests.RequestException as e:
+        print(f"[!] Error de conexión en lote de {len(lote)} docs: {e}")
+        metricas.registrar_error("bulk_ingest", e)
+        return 0, list(lote), []
+    metricas.RESPUESTAS_HTTP.inc(destino="elastic", codigo=r.status_code)
+
+    if r.status_code != 200:
+        if r.status_code not in ESTADOS_REINTENTABLES:
+            print(f"[!] Error HTTP {r.status_code}: {r.text[:300]}")
+        return 0, list(lote), []
+
+    try:
+        respuesta = r.json()
+    except ValueError as e:
+        metricas.registrar_error("bulk_ingest", e)
+        return 0, list(lote), []
+    if not respuesta.get("errors"):
+        return len(lote), [], []
+    if len(respuesta.get("items", [])) != len(lote):
+        # Sin un resultado por acción no se puede saber qué llegó: se reenvía todo
+        return 0, list(lote), []
+
+    ok = 0
+    reintentables = []
+    fallidos = []
+    for accion, item in zip(lote, respuesta.get("items", [])):
+        resultado = next(iter(item.values()))
+        estado = resultado.get("status", 500)
+        if estado < 300:
+            ok += 1
+            continue
+        error = resultado.get("error", {})
+        ERRORES_ITEM.inc(estado=estado, tipo=error.get("type", ""))
+        if estado in ESTADOS_REINTENTABLES or estado >= 500:
+            reintentables.append(accion)
+        else:
+            print(f"[!] Doc {resultado.get('_id')} rechazado ({estado}): {error.get('type')} {error.get('reason', '')[:200]}")
+            fallidos.append(accion)
+    return ok, reintentables, fallidos
+
+def enviar_con_reintentos(sesion, lote):
+    # Solo se reenvían los documentos que fallaron, con backoff exponencial + jitter
+    ok_total = 0
+    fallidos_total = []
+    pendientes = lote
+    for intento in range(MAX_REINTENTOS + 1):
+        ok, pendientes, fallidos = enviar_lote(sesion, pendientes)
+        ok_total += ok
+        fallidos_total.extend(fallidos)
+        if not pendientes:
+            break
+        if intento < MAX_REINTENTOS:
+            espera = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** intento)) * random.uniform(0.5, 1.0)
+            print(f"[*] Reintentando {len(pendientes)} docs en {espera:.1f}s (intento {intento + 1}/{MAX_REINTENTOS})")
+            DOCS_BULK.inc(len(pendientes), resultado="reintentado")
+            time.sleep(espera)
+    DOCS_BULK.inc(ok_total, resultado="ok")
+    DOCS_BULK.inc(len(fallidos_total), resultado="rechazado")
+    DOCS_BULK.inc(len(pendientes), resultado="pendiente")
+    return ok_total, pendientes, fallidos_total
+
+class AlmacenElastic:
+    # Destino Elastic con la interfaz de almacenamiento.py: sesión con pool, cuerpos gzip y
+    # reintentos por item. Lo seguro de reenviar (index por _id) permite varios lotes en vuelo.
+    nombre = "elastic"
+    max_en_vuelo = LOTES_EN_VUELO
+
+    def __init__(self, sesion=None):
+        self.sesion_propia = sesion is None
+        self.sesion = sesion or crear_sesion(pool=LOTES_EN_VUELO)
+
+    def preparar(self, doc):
+        return preparar_accion(doc)
+
+    def enviar(self, lote):
+        return enviar_con_reintentos(self.sesion, lote)
+
+    def cerrar(self):
+        if self.sesion_propia: self.sesion.close()
+
+def crear_almacen(destino=None, ruta_maestro=None, sesion=None):
+    destino = destino or DESTINO
+    if destino == "elastic":
+        return AlmacenElastic(sesion)
+    if destino == "sqlite":
+        ruta_maestro = ruta_maestro or localizar_archivo_maestro() or os.path.join(capturas.directorio_datos() or "", ARCHIVO_MAESTRO)
+        return almacenamiento.AlmacenSqlite(almacenamiento.ruta_sqlite(ruta_maestro))
+    raise ValueError(f"Destino desconocido: {destino} (elastic | sqlite)")
+
+def bulk_ingest_streaming(max_docs=MAX_DOCS_LOTE, max_bytes=MAX_BYTES_LOTE, full_resync=False, sesion=None, almacen=None):
+    # 'almacen' (o 'sesion' para Elastic) permite mantener las conexiones entre ciclos (monitor en proceso)
+    ruta_archivo = localizar_archivo_maestro()
+    if ruta_archivo is None:
+        print(f"[!] No encuentro {ARCHIVO_MAESTRO}. Ejecuta el poller primero.")
+        return False
+
+    almacen_propio = almacen is None
+    if almacen_propio: almacen = crear_almacen(ruta_maestro=ruta_archivo, sesion=sesion)
+    desde = 0 if full_resync else cargar_checkpoint(ruta_archivo, almacen.nombre)
+    print(f"[*] Leyendo base de datos (streaming): {ruta_archivo} desde byte {desde} -> {almacen.nombre}")
+
+    inicio = time.perf_counter()
+    total_ok = 0
+    total_perdidos = 0
+    num_lotes = 0
+    completo = True
+    acciones = ((almacen.preparar(doc), fin) for doc, fin in leer_documentos(ruta_archivo, desde))
+    lotes = generar_lotes(acciones, max_docs, max_bytes)
+    # Hasta max_en_vuelo lotes enviándose a la vez; se confirman en orden y el checkpoint
+    # solo avanza hasta el último lote confirmado sin huecos (entrega al menos una vez)
+    en_vuelo = deque()
+    with ThreadPoolExecutor(max_workers=almacen.max_en_vuelo) as pool:
+        while True:
+            while completo and len(en_vuelo) < almacen.max_en_vuelo:
+                siguiente = next(lotes, None)
+                if siguiente is None: break
+                lote, offset_fin = siguiente
+                en_vuelo.append((pool.submit(almacen.enviar, lote), offset_fin))
+                num_lotes += 1
+            if not en_vuelo: break
+            futuro, offset_fin = en_vuelo.popleft()
+            ok, pendientes, fallidos = futuro.result()
+            total_ok += ok
+            total_perdidos += len(pendientes) + len(fallidos)
+            if pendientes:
+                # No avanzamos el checkpoint: el próximo ciclo reintenta desde este lote
+                if completo: print(f"[!] {len(pendientes)} docs siguen fallando. Se reintentará en el próximo ciclo.")
+                completo = False
+            elif completo:
+                # Los rechazos definitivos (mapping, etc.) no se arreglan reenviando: se avanza igualmente
+                guardar_checkpoint(ruta_archivo, offset_fin, almacen.nombre)
+    if almacen_propio: almacen.cerrar()
+    metricas.ETAPAS.observar(time.perf_counter() - inicio, etapa="ingesta")
+
+    if num_lotes == 0:
+        print("[*] Nada nuevo que sincronizar.")
+        return True
+
+    print(f"[*] Sincronizados {total_ok} docs en {num_lotes} lotes | Fallidos: {total_perdidos}")
+    return completo
+
+def archivar_maestro(hasta=None, destino=None):
+    # Enrolla en el archivo columnar los días cerrados, pero solo lo que ya está en el destino
+    # (hasta su checkpoint). El checkpoint se reescribe para el maestro nuevo.
+    destino = destino or DESTINO
+    ruta_archivo = localizar_archivo_maestro()
+    if ruta_archivo is None: return 0
+    limite = cargar_checkpoint(ruta_archivo, destino)
+    archivados, nuevo_limite = archivo_columnar.archivar(ruta_archivo, hasta, limite)
+    if archivados: guardar_checkpoint(ruta_archivo, nuevo_limite, destino)
+    return archivados
+
 if __name__ == "__main__":
-    bulk_ingest()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sube wallapop_master.json a Elasticsearch")
+    parser.add_argument("--clasico", action="store_true", help="Un único _bulk con todo el archivo (modo antiguo)")
+    parser.add_argument("--full-resync", action="store_true", help="Ignora el checkpoint y reenvía todo el maestro")
+    parser.add_argument("--max-docs", type=int, default=MAX_DOCS_LOTE)
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES_LOTE)
+    parser.add_argument("--archivar", action="store_true", help="Pasa los días ya sincronizados al archivo columnar")
+    parser.add_argument("--destino", choices=("elastic", "sqlite"), default=DESTINO,
+                        help="elastic (por defecto) o sqlite: base embebida junto al maestro")
+    args = parser.parse_args()
+    DESTINO = args.destino
+
+    metricas.iniciar("bulk_ingest")
+    if args.clasico:
+        bulk_ingest()
+    elif args.archivar:
+        archivar_maestro()
+    else:
+        sys.exit(0 if bulk_ingest_streaming(args.max_docs, args.max_bytes, args.full_resync) else 1)
@@ -0,0 +1,263 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Carga de imágenes fuera del hilo de pintado:
+#  - Un pool de hilos descarga y decodifica (la función de decodificado la pone el visor).
+#  - Los bytes descargados se guardan en una caché en disco por hash de la URL, así que
+#    con la caché llena (o con file:// / un servidor local) funciona sin red. La caché está
+#    acotada por bytes y expulsa lo menos usado (la fecha de modificación hace de orden LRU).
+#  - Las imágenes ya decodificadas viven en un LRU acotado por bytes.
+#  - Los fallos se recuerdan solo TTL_ERRORES segundos: un corte de red no deja la imagen
+#    marcada como rota para toda la sesión.
+#  - Al moverse el cursor se cancelan las descargas pendientes que ya no interesan.
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_CACHE = os.environ.get("VISOR_CACHE_IMAGENES",
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_imagenes"))
+SIN_RED = os.environ.get("VISOR_SIN_RED", "0") == "1"   # solo caché en disco / file://
+NUM_HILOS = 4
+TIMEOUT = 5
+MAX_BYTES_DECODIFICADAS = 96 * 1024 * 1024
+MAX_BYTES_DISCO = int(os.environ.get("VISOR_CACHE_MAX_MB", "512")) * 1024 * 1024
+TTL_ERRORES = 30
+
+CARGANDO = "cargando"
+LISTA = "lista"
+ERROR = "error"
+
+class CacheDisco:
+    def __init__(self, directorio=DIRECTORIO_CACHE, max_bytes=MAX_BYTES_DISCO):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.archivos = OrderedDict()   # ruta -> bytes, de menos a más recientemente usado
+        self.bytes = 0
+        self._inventariar()
+
+    def _inventariar(self):
+        # Lo que dejaron sesiones anteriores, ordenado por fecha de modificación (leer() la actualiza)
+        encontrados = []
+        if os.path.isdir(self.directorio):
+            for carpeta in os.scandir(self.directorio):
+                if not carpeta.is_dir(): continue
+                for entrada in os.scandir(carpeta.path):
+                    if entrada.name.endswith(".tmp"): continue
+                    st = entrada.stat()
+                    encontrados.append((st.st_mtime, entrada.path, st.st_size))
+        for _, ruta, tamano in sorted(encontrados):
+            self.archivos[ruta] = tamano
+            self.bytes += tamano
+        self._expulsar()
+
+    def _expulsar(self):
+        while self.bytes > self.max_bytes and len(self.archivos) > 1:
+            ruta, tamano = self.archivos.popitem(last=False)
+            self.bytes -= tamano
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+    def ruta(self, url):
+        clave = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    def leer(self, url):
+        ruta = self.ruta(url)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+            os.utime(ruta)
+        except OSError:
+            return None
+        with self.lock:
+            if ruta in self.archivos: self.archivos.move_to_end(ruta)
+        return datos
+
+    def guardar(self, url, datos):
+        ruta = self.ruta(url)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+        with self.lock:
+            self.bytes += len(datos) - self.archivos.pop(ruta, 0)
+            self.archivos[ruta] = len(datos)
+            self._expulsar()
+
+class CargadorImagenes:
+    def __init__(self, decodificar=lambda datos: datos, tamano=len, cache_disco=None,
+                 hilos=NUM_HILOS, max_bytes=MAX_BYTES_DECODIFICADAS, sin_red=SIN_RED, ttl_errores=TTL_ERRORES):
+        # decodificar(bytes) -> objeto listo para pintar | tamano(objeto) -> bytes que ocupa en memoria
+        self.decodificar = decodificar
+        self.tamano = tamano
+        self.disco = cache_disco or CacheDisco()
+        self.max_bytes = max_bytes
+        self.sin_red = sin_red
+        self.ttl_errores = ttl_errores
+        self.pool = ThreadPoolExecutor(max_workers=hilos)
+        self.sesion = requests.Session()
+        self.lock = threading.Lock()
+        self.lru = OrderedDict()    # url -> objeto decodificado
+        self.bytes_lru = 0
+        self.pendientes = {}        # url -> futuro
+        self.errores = {}           # url -> instante del fallo
+
+    # --- Hilo principal (no bloquea nunca) ---
+    def obtener(self, url):
+        # (estado, imagen). Si no está en memoria la encola con prioridad y devuelve CARGANDO.
+        with self.lock:
+            if url in self.lru:
+                self.lru.move_to_end(url)
+                return LISTA, self.lru[url]
+            if self._error_vigente(url): return ERROR, None
+        self._encolar(url)
+        return CARGANDO, None
+
+    def precargar(self, urls):
+        # 'urls' ordenadas por cercanía al cursor. Se cancela lo pendiente que ya no está en la ventana.
+        deseadas = [u for u in dict.fromkeys(urls) if u]
+        with self.lock:
+            for url in [u for u in self.pendientes if u not in deseadas]:
+                if self.pendientes[url].cancel(): del self.pendientes[url]
+        for url in deseadas:
+            self._encolar(url)
+
+    def _encolar(self, url):
+        with self.lock:
+            if url in self.lru or url in self.pendientes or self._error_vigente(url): return
+            self.pendientes[url] = self.pool.submit(self._cargar, url)
+
+    def _error_vigente(self, url):
+        # Con el lock tomado. Pasado el TTL el fallo se olvida y la imagen se vuelve a pedir.
+        fallo = self.errores.get(url)
+        if fallo is None: return False
+        if time.monotonic() - fallo < self.ttl_errores: return True
+        del self.errores[url]
+        return False
+
+    # --- Hilos del pool ---
+    def _descargar(self, url):
+        datos = self.disco.leer(url)
+        if datos is not None: return datos
+        if url.startswith("file://"):
+            with open(url[len("file://"):], "rb") as f:
+                return f.read()
+        if self.sin_red: raise OSError("sin red y sin copia en caché")
+        r = self.sesion.get(url, timeout=TIMEOUT)
+        r.raise_for_status()
+        self.disco.guardar(url, r.content)
+        return r.content
+
+    def _cargar(self, url):
+        try:
+            imagen = self.decodificar(self._descargar(url))
+        except Exception as e:
+            print(f"Error imagen: {e}")
+            with self.lock:
+                self.errores[url] = time.monotonic()
+                self.pendientes.pop(url, None)
+            return
+        with self.lock:
+            self.pendientes.pop(url, None)
+            self.lru[url] = imagen
+            self.bytes_lru += self.tamano(imagen)
+            while self.bytes_lru > self.max_bytes and len(self.lru) > 1:
+                _, vieja = self.lru.popitem(last=False)
+                self.bytes_lru -= self.tamano(vieja)
+
+    def reintentar_errores(self):
+        with self.lock:
+            self.errores.clear()
+
+    def cerrar(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.sesion.close()
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    parser = argparse.ArgumentParser(description="Cargador de imágenes del visor")
+    parser.add_argument("--precargar", metavar="MAESTRO", help="Descarga a la caché en disco las imágenes del maestro")
+    parser.add_argument("--verificar", action="store_true", help="Prueba offline contra un servidor HTTP local")
+    args = parser.parse_args()
+
+    if args.precargar:
+        # Llena la caché para poder usar el visor sin red (VISOR_SIN_RED=1)
+        urls = []
+        with open(args.precargar, "r", encoding="utf-8") as f:
+            for linea in f:
+                if linea.strip(): urls.append(json.loads(linea).get("image_url"))
+        cargador = CargadorImagenes(tamano=lambda datos: 0)
+        cargador.precargar(urls)
+        while cargador.pendientes: time.sleep(0.2)
+        print(f"[*] {len(set(u for u in urls if u))} imágenes en {cargador.disco.directorio} ({len(cargador.errores)} errores)")
+        cargador.cerrar()
+
+    if args.verificar:
+        import tempfile
+        peticiones = []
+
+        class Stub(BaseHTTPRequestHandler):
+            def do_GET(self):
+                peticiones.append(self.path)
+                time.sleep(0.2)   # red lenta: el hilo principal no debe notarlo
+                if self.path == "/caida.jpg" and peticiones.count(self.path) == 1:
+                    self.send_error(503)    # fallo transitorio: solo la primera vez
+                    return
+                cuerpo = (self.path * 1000).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+            def log_message(self, *a): pass
+
+        servidor = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{servidor.server_port}"
+        urls = [f"{base}/img{i}.jpg" for i in range(20)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cargador = CargadorImagenes(cache_disco=CacheDisco(tmp), max_bytes=10 * 9000)
+            inicio = time.monotonic()
+            estado, _ = cargador.obtener(urls[0])
+            cargador.precargar(urls[1:6])
+            bloqueo = time.monotonic() - inicio
+            while cargador.pendientes: time.sleep(0.05)
+            cargador.precargar(urls)
+            while cargador.pendientes: time.sleep(0.05)
+            print(f"[*] obtener() no bloquea: {bloqueo * 1000:.1f} ms (estado inicial: {estado})")
+            print(f"[*] LRU acotado: {len(cargador.lru)} imágenes, {cargador.bytes_lru} bytes (máx {cargador.max_bytes})")
+            cargador.cerrar()
+
+            antes = len(peticiones)
+            offline = CargadorImagenes(cache_disco=CacheDisco(tmp), sin_red=True)
+            offline.precargar(urls)
+            while offline.pendientes: time.sleep(0.05)
+            print(f"[*] Segunda pasada sin red desde disco: {len(offline.lru)} imágenes, "
+                  f"{len(peticiones) - antes} peticiones HTTP, {len(offline.errores)} errores")
+            offline.cerrar()
+
+            transitorio = CargadorImagenes(cache_disco=CacheDisco(tmp), ttl_errores=0.5)
+            url = f"{base}/caida.jpg"
+            transitorio.obtener(url)
+            while transitorio.pendientes: time.sleep(0.05)
+            primero = transitorio.obtener(url)[0]
+            time.sleep(0.5)
+            transitorio.obtener(url)
+            while transitorio.pendientes: time.sleep(0.05)
+            print(f"[*] Fallo transitorio: {primero} y, pasado el TTL, {transitorio.obtener(url)[0]}")
+            transitorio.cerrar()
+
+            acotada = CacheDisco(tmp, max_bytes=5 * 9000)
+            print(f"[*] Caché en disco acotada: {len(acotada.archivos)} archivos, {acotada.bytes} bytes (máx {acotada.max_bytes})")
+        servidor.shutdown()
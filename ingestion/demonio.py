@@ -0,0 +1,105 @@
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+import poller
+import bulk_ingest
+import metricas
+from descarga_concurrente import LimitadorTokens, crear_sesion_wallapop
+
+# Monitor de larga duración: el poller y la ingesta se llaman como funciones en un único
+# proceso, en vez de lanzar dos intérpretes por ciclo con os.system.
+#  - Estado caliente entre ciclos: índice de IDs, estadísticas, motor de alertas, IDs del
+#    ciclo anterior, la sesión HTTP (keep-alive) con Wallapop y el destino de la ingesta.
+#  - La ingesta del ciclo N corre en un hilo propio mientras el ciclo N+1 ya descarga.
+#  - SIGTERM / Ctrl+C: se acaba el ciclo en curso, se espera a la ingesta pendiente,
+#    se sincroniza lo que quede y se persiste el estado antes de salir.
+
+# --- CONFIGURACIÓN ---
+INTERVALO = 300     # segundos entre inicios de ciclo
+
+class Demonio:
+    def __init__(self, intervalo=INTERVALO):
+        self.intervalo = intervalo
+        self.parar = threading.Event()
+        self.contexto = poller.ContextoPoller()
+        self.sesion_wallapop = crear_sesion_wallapop(poller.HEADERS)
+        self.limitador = LimitadorTokens()
+        # Destino de la ingesta (Elastic con su pool de conexiones, o SQLite local)
+        self.almacen = bulk_ingest.crear_almacen()
+        self.ids_previos = poller.cargar_ids_ultimo_ciclo()
+        # Un solo hilo de ingesta: los lotes llegan a Elastic en el orden del maestro
+        self.ingestor = ThreadPoolExecutor(max_workers=1)
+        self.ingesta = None
+        # guardar (añade al maestro) y archivar (lo reescribe) no pueden solaparse
+        self.lock_maestro = threading.Lock()
+        self.ultimo_archivado = None
+
+    def instalar_senales(self):
+        for senal in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(senal, lambda *_: self.parar.set())
+
+    def ciclo(self):
+        items = poller.buscar_items_paginados(self.ids_previos, self.sesion_wallapop, self.limitador)
+        with self.lock_maestro:
+            nuevos = poller.guardar_datos_incrementales(items, self.contexto)
+        if items:
+            self.ids_previos = {i.get("id") for i in items}
+            poller.guardar_ids_ultimo_ciclo(items)
+        self.lanzar_ingesta()
+        return len(items), nuevos
+
+    def lanzar_ingesta(self):
+        # Si la del ciclo anterior sigue en marcha no se encola otra: la siguiente
+        # parte del checkpoint y recoge también lo guardado en este ciclo.
+        if self.ingesta is not None:
+            if not self.ingesta.done():
+                print("[*] La ingesta anterior sigue en curso; este ciclo se sincronizará con el siguiente.")
+                return
+            try:
+                self.ingesta.result()
+            except Exception as e:
+                print(f"[!] Falló la ingesta: {e}")
+                metricas.registrar_error("monitor", e)
+        self.ingesta = self.ingestor.submit(self.ingestar)
+
+    def ingestar(self):
+        with metricas.cronometro("ciclo_ingesta"):
+            completo = bulk_ingest.bulk_ingest_streaming(almacen=self.almacen)
+        if completo and self.ultimo_archivado != datetime.date.today():
+            # Una vez al día: los días cerrados pasan al archivo columnar
+            with self.lock_maestro, metricas.cronometro("archivado"):
+                bulk_ingest.archivar_maestro(destino=self.almacen.nombre)
+            self.ultimo_archivado = datetime.date.today()
+        metricas.volcar()
+        return completo
+
+    def ejecutar(self):
+        while not self.parar.is_set():
+            inicio = time.monotonic()
+            print(f"┌── [ {datetime.datetime.now().strftime('%H:%M:%S')} ] Iniciando ciclo...")
+            try:
+                with metricas.cronometro("ciclo_poller"):
+                    descargados, nuevos = self.ciclo()
+                print(f"└── {descargados} items, {nuevos} nuevos en {time.monotonic() - inicio:.1f}s\n")
+            except Exception as e:
+                print(f"└── [!] Falló el ciclo: {e}\n")
+                metricas.registrar_error("monitor", e)
+            self.parar.wait(max(0.0, self.intervalo - (time.monotonic() - inicio)))
+        self.cerrar()
+
+    def cerrar(self):
+        print("[*] Parando: esperando a la ingesta en curso...")
+        self.ingestor.shutdown(wait=True)
+        # Lo guardado después de la última ingesta lanzada
+        bulk_ingest.bulk_ingest_streaming(almacen=self.almacen)
+        self.contexto.cerrar()
+        self.sesion_wallapop.close()
+        self.almacen.cerrar()
+        metricas.volcar()
+        print("[*] Monitor detenido.")
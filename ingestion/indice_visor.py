@@ -0,0 +1,261 @@
+import json
+import os
+import sys
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+import archivo_columnar
+
+# Backend perezoso del visor: en vez de cargar todo el maestro en una lista de dicts,
+# se mantiene un índice lateral (.visor_indice.npz) con el offset en bytes de cada línea
+# y las columnas necesarias para ordenar y filtrar (riesgo, precio, fecha, vendedor).
+# El índice se amplía solo con la cola nueva del maestro y se rehace si éste rota.
+# También cubre el archivo columnar (archivo/fecha=*/*.wcol): cada segmento nuevo se indexa
+# una vez leyendo solo las columnas de ordenación, y sus filas van delante de las del maestro.
+# 'origen' dice de dónde sale cada fila (-1 = maestro, k = segmento k) y 'offsets' guarda el
+# offset en bytes (maestro) o el número de fila (segmento).
+# Las ordenaciones son permutaciones NumPy calculadas una vez, y solo se parsean
+# los anuncios cercanos al cursor (caché LRU pequeña de documentos). De un segmento se decodifican
+# solo las filas pedidas, así que la memoria del visor no crece con el tamaño de un día.
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_INDICE_VISOR = ".visor_indice.npz"
+MAX_DOCS_CACHE = 64
+COLUMNAS_INDICE = ["enrichment.risk_score", "price", "timestamps.crawled_at", "user_id"]
+PRECIO_SIN_DATO = 999999    # mismo valor que usaba la ordenación original por precio
+RIESGO_ALTO = 80
+
+CRITERIOS = {
+    "defecto": "Defecto",
+    "riesgo": "Mayor Riesgo",
+    "precio": "Menor Precio",
+    "fecha": "Más Recientes",
+}
+
+def _epoch(iso):
+    try:
+        return datetime.fromisoformat(iso).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+class IndiceVisor:
+    def __init__(self, ruta_maestro, ruta_indice=None):
+        self.ruta_maestro = ruta_maestro
+        if ruta_indice is None:
+            ruta_indice = os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), ARCHIVO_INDICE_VISOR)
+        self.ruta_indice = ruta_indice
+        self.directorio_archivo = archivo_columnar.directorio_archivo(ruta_maestro)
+        self.cache = OrderedDict()      # (origen, offset o fila) -> doc parseado
+        self.permutaciones = {}         # criterio -> np.array de posiciones
+        self.criterio = "defecto"
+        self.riesgo_min = None
+        self.vendedor = None
+        self._vaciar()
+        self.actualizar()
+
+    def _vaciar(self):
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.origen = np.zeros(0, dtype=np.int32)
+        self.segmentos = []
+        self.riesgo = np.zeros(0, dtype=np.float32)
+        self.precio = np.zeros(0, dtype=np.float64)
+        self.fecha = np.zeros(0, dtype=np.float64)
+        self.cod_vendedor = np.zeros(0, dtype=np.uint32)
+        self.vendedores = []
+        self.cod_por_vendedor = {}
+        self.fin = 0
+        self.inode = None
+
+    # --- Índice lateral ---
+    def _cargar_indice(self):
+        if not os.path.exists(self.ruta_indice): return False
+        try:
+            with np.load(self.ruta_indice, allow_pickle=False) as d:
+                self.offsets, self.riesgo, self.precio = d["offsets"], d["riesgo"], d["precio"]
+                self.fecha, self.cod_vendedor = d["fecha"], d["cod_vendedor"]
+                self.origen, self.segmentos = d["origen"], d["segmentos"].tolist()
+                self.vendedores = d["vendedores"].tolist()
+                self.fin, self.inode = int(d["fin"]), int(d["inode"])
+        except (OSError, ValueError, KeyError):
+            self._vaciar()
+            return False
+        self.cod_por_vendedor = {v: i for i, v in enumerate(self.vendedores)}
+        return True
+
+    def _guardar_indice(self):
+        tmp = self.ruta_indice + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, offsets=self.offsets, riesgo=self.riesgo, precio=self.precio, fecha=self.fecha,
+                     cod_vendedor=self.cod_vendedor, vendedores=np.array(self.vendedores, dtype=str),
+                     origen=self.origen, segmentos=np.array(self.segmentos, dtype=str),
+                     fin=self.fin, inode=self.inode)
+        os.replace(tmp, self.ruta_indice)
+
+    def actualizar(self):
+        # Pone el índice al día (archivo columnar + cola del maestro). Devuelve cuántos anuncios nuevos se han indexado.
+        if self.inode is None: self._cargar_indice()
+        cambios = False
+        segmentos = archivo_columnar.segmentos(self.directorio_archivo)
+        if not set(self.segmentos) <= set(segmentos):
+            # Han desaparecido segmentos ya indexados: se reindexa todo
+            self._vaciar()
+            self.cache.clear()
+            cambios = True
+        st = os.stat(self.ruta_maestro) if os.path.exists(self.ruta_maestro) else None
+        inode = st.st_ino if st else 0
+        if self.inode != inode or (st and st.st_size < self.fin):
+            # Maestro rotado (p.ej. archivado), truncado o ausente: se reindexa su parte desde cero
+            self._quedarse(self.origen >= 0)
+            self.fin = 0
+            self.cache.clear()
+            cambios = True
+        self.inode = inode
+
+        nuevos = 0
+        conocidos = set(self.segmentos)
+        for ruta in segmentos:
+            if ruta not in conocidos: nuevos += self._indexar_segmento(ruta)
+        if st and st.st_size > self.fin: nuevos += self._indexar_maestro()
+        if nuevos or cambios:
+            self.permutaciones.clear()
+            self._guardar_indice()
+        return nuevos
+
+    def _indexar_segmento(self, ruta):
+        # Solo se descomprimen las columnas de ordenación; 'offsets' guarda el número de fila
+        filas = [self._columnas(doc) for doc in archivo_columnar.Segmento(ruta).leer(COLUMNAS_INDICE)]
+        self._anadir(np.arange(len(filas), dtype=np.int64), len(self.segmentos), filas)
+        self.segmentos.append(ruta)
+        return len(filas)
+
+    def _indexar_maestro(self):
+        offsets, filas = [], []
+        offset = self.fin
+        with open(self.ruta_maestro, "rb") as f:
+            f.seek(self.fin)
+            for linea in f:
+                if not linea.endswith(b"\n"): break
+                inicio = offset
+                offset += len(linea)
+                if not linea.strip(): continue
+                try:
+                    doc = json.loads(linea)
+                except ValueError:
+                    continue
+                offsets.append(inicio)
+                filas.append(self._columnas(doc))
+        self.fin = offset
+        self._anadir(np.array(offsets, dtype=np.int64), -1, filas)
+        return len(offsets)
+
+    def _columnas(self, doc):
+        # (riesgo, precio, fecha, código de vendedor) de un anuncio
+        p = doc.get("price")
+        u = doc.get("user_id") or ""
+        if u not in self.cod_por_vendedor:
+            self.cod_por_vendedor[u] = len(self.vendedores)
+            self.vendedores.append(u)
+        return ((doc.get("enrichment") or {}).get("risk_score") or 0, PRECIO_SIN_DATO if p is None else p,
+                _epoch((doc.get("timestamps") or {}).get("crawled_at")), self.cod_por_vendedor[u])
+
+    def _anadir(self, offsets, origen, filas):
+        riesgo, precio, fecha, vendedores = zip(*filas) if filas else ((), (), (), ())
+        self.offsets = np.concatenate([self.offsets, offsets])
+        self.origen = np.concatenate([self.origen, np.full(len(offsets), origen, dtype=np.int32)])
+        self.riesgo = np.concatenate([self.riesgo, np.array(riesgo, dtype=np.float32)])
+        self.precio = np.concatenate([self.precio, np.array(precio, dtype=np.float64)])
+        self.fecha = np.concatenate([self.fecha, np.array(fecha, dtype=np.float64)])
+        self.cod_vendedor = np.concatenate([self.cod_vendedor, np.array(vendedores, dtype=np.uint32)])
+
+    def _quedarse(self, mascara):
+        self.offsets, self.origen = self.offsets[mascara], self.origen[mascara]
+        self.riesgo, self.precio, self.fecha = self.riesgo[mascara], self.precio[mascara], self.fecha[mascara]
+        self.cod_vendedor = self.cod_vendedor[mascara]
+
+    # --- Ordenación y filtros ---
+    def permutacion(self, criterio):
+        if criterio not in self.permutaciones:
+            if criterio == "riesgo":
+                perm = np.argsort(-self.riesgo, kind="stable")
+            elif criterio == "precio":
+                perm = np.argsort(self.precio, kind="stable")
+            elif criterio == "fecha":
+                perm = np.argsort(-self.fecha, kind="stable")
+            else:
+                perm = np.arange(len(self.offsets))
+            self.permutaciones[criterio] = perm
+        return self.permutaciones[criterio]
+
+    def vista(self):
+        # Posiciones (en el índice) visibles con el orden y filtros actuales
+        perm = self.permutacion(self.criterio)
+        mascara = None
+        if self.riesgo_min is not None:
+            mascara = self.riesgo >= self.riesgo_min
+        if self.vendedor is not None:
+            cod = self.cod_por_vendedor.get(self.vendedor)
+            m = self.cod_vendedor == cod if cod is not None else np.zeros(len(self.offsets), dtype=bool)
+            mascara = m if mascara is None else mascara & m
+        return perm if mascara is None else perm[mascara[perm]]
+
+    def ordenar(self, criterio):
+        self.criterio = criterio
+        return self.vista()
+
+    def filtrar(self, riesgo_min=None, vendedor=None):
+        self.riesgo_min = riesgo_min
+        self.vendedor = vendedor
+        return self.vista()
+
+    # --- Acceso a documentos ---
+    def documento(self, posicion):
+        return self.documentos([posicion])[0]
+
+    def documentos(self, posiciones):
+        # Varios anuncios a la vez (p.ej. los vecinos del cursor): cada segmento se abre una vez
+        # y de él solo se decodifican las filas que faltan en la caché
+        claves = [(int(self.origen[p]), int(self.offsets[p])) for p in posiciones]
+        faltan = {}
+        for clave in claves:
+            if clave in self.cache: self.cache.move_to_end(clave)
+            else: faltan.setdefault(clave[0], set()).add(clave[1])
+        for origen, offsets in faltan.items():
+            offsets = sorted(offsets)
+            if origen >= 0:
+                docs = archivo_columnar.Segmento(self.segmentos[origen]).leer_filas(offsets)
+            else:
+                docs = []
+                with open(self.ruta_maestro, "rb") as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        docs.append(json.loads(f.readline()))
+            for offset, doc in zip(offsets, docs):
+                self.cache[(origen, offset)] = doc
+        resultado = [self.cache[clave] for clave in claves]
+        while len(self.cache) > MAX_DOCS_CACHE:
+            self.cache.popitem(last=False)
+        return resultado
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Índice lateral del visor de fraude")
+    parser.add_argument("--maestro", default="wallapop_master.json")
+    parser.add_argument("--orden", default="riesgo", choices=list(CRITERIOS))
+    parser.add_argument("--riesgo-min", type=float, default=None)
+    parser.add_argument("--vendedor", default=None)
+    parser.add_argument("-n", type=int, default=10, help="Anuncios a mostrar")
+    args = parser.parse_args()
+
+    inicio = time.time()
+    indice = IndiceVisor(args.maestro)
+    indice.filtrar(args.riesgo_min, args.vendedor)
+    vista = indice.ordenar(args.orden)
+    print(f"[*] {len(indice.offsets)} anuncios indexados, {len(vista)} visibles ({time.time() - inicio:.2f}s)")
+    for pos in vista[:args.n]:
+        doc = indice.documento(pos)
+        print(f"    {doc['enrichment']['risk_score']:>3} | {doc.get('price')} | {doc.get('user_id')} | {doc.get('title')}")
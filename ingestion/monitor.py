@@ -1,13 +1,101 @@
 import time
 import os
+import sys
 import datetime
+import argparse
+import signal
+import threading
 
 INTERVALO = 300 
 
+parser = argparse.ArgumentParser(description="Monitor de estafas Wallapop")
+parser.add_argument("--planificador", action="store_true",
+                    help="Ejecuta todas las búsquedas de poller/busquedas.json en este proceso")
+parser.add_argument("--subprocesos", action="store_true",
+                    help="Modo antiguo: lanza poller.py y bulk_ingest.py como procesos en cada ciclo")
+parser.add_argument("--intervalo", type=float, default=INTERVALO, help="Segundos entre ciclos")
+parser.add_argument("--metricas-dir", help="Directorio de textfiles Prometheus (*.prom) de todo el pipeline")
+parser.add_argument("--metricas-puerto", type=int, help="Sirve /metrics en 127.0.0.1:PUERTO")
+parser.add_argument("--perfilar", action="store_true", help="Activa el profiler de muestreo en todos los procesos")
+parser.add_argument("--capturar", metavar="DIR", help="Guarda las respuestas crudas de la API de búsqueda en DIR")
+parser.add_argument("--reproducir", metavar="DIR", help="Sirve las búsquedas desde las capturas de DIR (sin red)")
+parser.add_argument("--velocidad", type=float, help="Factor de aceleración al reproducir (0 = sin esperas)")
+parser.add_argument("--datos", metavar="DIR",
+                    help="Directorio del maestro y su estado (al reproducir, por defecto uno temporal)")
+parser.add_argument("--destino", choices=("elastic", "sqlite"),
+                    help="Dónde se ingesta el maestro: Elastic (por defecto) o SQLite local sin clúster")
+args = parser.parse_args()
+INTERVALO = args.intervalo
+
+# Se pasan por entorno para que los hereden poller.py y bulk_ingest.py (modo clásico)
+if args.metricas_dir: os.environ["WALLAPOP_METRICAS_DIR"] = os.path.abspath(args.metricas_dir)
+if args.metricas_puerto: os.environ["WALLAPOP_METRICAS_PUERTO"] = str(args.metricas_puerto)
+if args.perfilar: os.environ["WALLAPOP_PERFIL"] = "1"
+if args.capturar: os.environ["WALLAPOP_CAPTURA"] = os.path.abspath(args.capturar)
+if args.reproducir: os.environ["WALLAPOP_REPRODUCIR"] = os.path.abspath(args.reproducir)
+if args.velocidad is not None: os.environ["WALLAPOP_VELOCIDAD"] = str(args.velocidad)
+if args.datos: os.environ["WALLAPOP_DATOS"] = os.path.abspath(args.datos)
+if args.destino: os.environ["WALLAPOP_DESTINO"] = args.destino
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "poller"))
+import metricas
+import capturas
+metricas.iniciar("monitor", http=True)
+# El directorio de datos se decide aquí una vez (si es temporal, lo heredan los procesos hijos)
+if args.datos: os.makedirs(os.environ["WALLAPOP_DATOS"], exist_ok=True)
+capturas.directorio_datos()
+
+if args.planificador:
+    # Modo en proceso: el planificador lanza cada búsqueda a su ritmo en un hilo
+    # y aquí solo se sincroniza Elastic cada INTERVALO segundos.
+    import planificador
+    import bulk_ingest
+
+    trabajos = planificador.cargar_trabajos()
+    print(f"[*] --- MONITOR DE ESTAFAS WALLAPOP (planificador) ---")
+    print(f"[*] {len(trabajos)} búsquedas | Sincronización Elastic cada {INTERVALO}s")
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    plan = planificador.Planificador(trabajos)
+    hilo = threading.Thread(target=plan.ejecutar, args=(parar,))
+    hilo.start()
+    almacen = bulk_ingest.crear_almacen()
+    try:
+        ultimo_archivado = None
+        while not parar.wait(INTERVALO):
+            print(f"[*] [{datetime.datetime.now().strftime('%H:%M:%S')}] Sincronizando Elastic...")
+            if bulk_ingest.bulk_ingest_streaming(almacen=almacen) and ultimo_archivado != datetime.date.today():
+                # Una vez al día: los días cerrados pasan al archivo columnar (sin escrituras en curso)
+                with plan.lock_guardado, metricas.cronometro("archivado"):
+                    bulk_ingest.archivar_maestro(destino=almacen.nombre)
+                ultimo_archivado = datetime.date.today()
+            metricas.volcar()
+    except KeyboardInterrupt:
+        parar.set()
+    print("\n[!] Monitor detenido.")
+    hilo.join()
+    plan.contexto.cerrar()
+    bulk_ingest.bulk_ingest_streaming(almacen=almacen)
+    almacen.cerrar()
+    sys.exit(0)
+
+if not args.subprocesos:
+    # Modo por defecto: un único proceso de larga duración con el estado caliente entre ciclos
+    import demonio
+
+    print(f"[*] --- MONITOR DE ESTAFAS WALLAPOP ---")
+    print(f"[*] Ciclo: {INTERVALO}s | Archivo: wallapop_master.json")
+    print("[*] Ctrl+C o SIGTERM para salir.\n")
+    monitor = demonio.Demonio(INTERVALO)
+    monitor.instalar_senales()
+    monitor.ejecutar()
+    sys.exit(0)
+
 print(f"[*] --- MONITOR DE ESTAFAS WALLAPOP ---")
 print(f"[*] Ciclo: {INTERVALO}s | Archivo: wallapop_master.json")
 print("[*] Ctrl+C para salir.\n")
 
+ultimo_archivado = None
 try:
     while True:
         ahora = datetime.datetime.now().strftime("%H:%M:%S")
@@ -16,14 +104,26 @@ try:
         # 1. EJECUTAR POLLER
         # Usa python3 para Linux
         print("│ >> 1. Buscando nuevos anuncios sospechosos...")
-        if os.system("python3 ../poller/poller.py") != 0:
+        with metricas.cronometro("ciclo_poller"):
+            codigo_poller = os.system("python3 ../poller/poller.py")
+        if codigo_poller != 0:
             print("│ [!] Alerta: El poller falló o no encontró el archivo.")
+            metricas.ERRORES.inc(componente="monitor", tipo="poller_fallido")
         
         else:
             # 2. EJECUTAR INGESTIÓN
             print("│ >> 2. Sincronizando Elastic...")
-            os.system("python3 bulk_ingest.py")
+            with metricas.cronometro("ciclo_ingesta"):
+                codigo_ingesta = os.system("python3 bulk_ingest.py")
+            if codigo_ingesta != 0:
+                metricas.ERRORES.inc(componente="monitor", tipo="ingesta_fallida")
+            elif ultimo_archivado != datetime.date.today():
+                print("│ >> 3. Archivando días cerrados...")
+                with metricas.cronometro("archivado"):
+                    os.system("python3 bulk_ingest.py --archivar")
+                ultimo_archivado = datetime.date.today()
             
+        metricas.volcar()
         print(f"└── Ciclo finalizado. Esperando {INTERVALO}s...\n")
         time.sleep(INTERVALO)
 
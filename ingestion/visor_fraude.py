@@ -1,14 +1,15 @@
 import pygame
-import json
 import os
-import requests
 import io
 import sys
+from indice_visor import IndiceVisor, CRITERIOS, RIESGO_ALTO
+from cargador_imagenes import CargadorImagenes, LISTA, CARGANDO
 
 # --- CONFIGURACIÓN DEL VISOR ---
 ANCHO_VENTANA = 1000
 ALTO_VENTANA = 700
-ARCHIVO_DATOS = "../ingestion/wallapop_master.json" 
+ARCHIVO_DATOS = os.path.join(os.environ.get("WALLAPOP_DATOS") or "../ingestion", "wallapop_master.json")
+VECINOS_PRECARGA = 5     # anuncios por delante y por detrás cuyas imágenes se precargan
 
 # Colores
 BLANCO = (255, 255, 255)
@@ -29,61 +30,58 @@ class VisorWallapop:
         self.fuente_texto = pygame.font.SysFont("Arial", 20)
         self.fuente_mini = pygame.font.SysFont("Arial", 16)
         
-        self.items = []
+        self.datos = None
+        self.vista = []          # posiciones del índice con el orden/filtro actual
         self.indice_actual = 0
-        self.cache_imagenes = {}
+        # Descarga y decodifica en segundo plano; el bucle de pintado nunca espera a la red
+        self.imagenes = CargadorImagenes(decodificar=self.decodificar_imagen,
+                                         tamano=lambda img: img.get_bytesize() * img.get_width() * img.get_height())
+        self.ultimo_precargado = None
         self.orden_actual = "Defecto"
+        self.filtro_actual = "Todos"
         
         self.cargar_datos()
 
     def cargar_datos(self):
-        print("[*] Cargando datos del JSON...")
-        self.items = []
-        if os.path.exists(ARCHIVO_DATOS):
-            with open(ARCHIVO_DATOS, 'r', encoding='utf-8') as f:
-                for linea in f:
-                    if linea.strip():
-                        try:
-                            self.items.append(json.loads(linea))
-                        except: pass
-        else:
+        print("[*] Cargando índice del JSON...")
+        if not os.path.exists(ARCHIVO_DATOS):
             print(f"[!] No se encuentra {ARCHIVO_DATOS}")
+        # Solo offsets y columnas de orden/filtro; los anuncios se leen al mostrarlos
+        self.datos = IndiceVisor(ARCHIVO_DATOS)
+        self.vista = self.datos.vista()
         
-        print(f"[*] {len(self.items)} items cargados.")
+        print(f"[*] {len(self.vista)} items indexados.")
 
-    def descargar_imagen(self, url):
-        if not url: return None
-        if url in self.cache_imagenes:
-            return self.cache_imagenes[url]
-        
-        try:
-            print(f"Descargando imagen: {url}")
-            r = requests.get(url, timeout=5)
-            img_bytes = io.BytesIO(r.content)
-            img = pygame.image.load(img_bytes)
-            # Escalar imagen para que quepa en la mitad izquierda
-            img = pygame.transform.scale(img, (400, 400))
-            self.cache_imagenes[url] = img
-            return img
-        except Exception as e:
-            print(f"Error imagen: {e}")
-            return None
+    def decodificar_imagen(self, datos):
+        # Se ejecuta en los hilos del cargador
+        img = pygame.image.load(io.BytesIO(datos))
+        # Escalar imagen para que quepa en la mitad izquierda
+        return pygame.transform.scale(img, (400, 400))
+
+    def precargar_vecinas(self):
+        # Solo cuando cambia el cursor o la vista: encola las imágenes de los anuncios cercanos
+        clave = (self.indice_actual, id(self.vista))
+        if clave == self.ultimo_precargado: return
+        self.ultimo_precargado = clave
+        orden = [self.indice_actual]
+        for d in range(1, VECINOS_PRECARGA + 1):
+            orden += [self.indice_actual + d, self.indice_actual - d]
+        docs = self.datos.documentos([self.vista[i] for i in orden if 0 <= i < len(self.vista)])
+        urls = [doc.get("image_url") for doc in docs]
+        self.imagenes.precargar(urls)
 
     def ordenar(self, criterio):
-        if not self.items: return
-        
-        if criterio == "riesgo":
-            self.items.sort(key=lambda x: x['enrichment']['risk_score'], reverse=True)
-            self.orden_actual = "Mayor Riesgo"
-        elif criterio == "precio":
-            self.items.sort(key=lambda x: x.get('price', 999999))
-            self.orden_actual = "Menor Precio"
-        elif criterio == "fecha":
-            self.items.sort(key=lambda x: x['timestamps']['crawled_at'], reverse=True)
-            self.orden_actual = "Más Recientes"
-            
+        # Permutaciones precalculadas: reordenar no relee ni reparsea nada
+        self.vista = self.datos.ordenar(criterio)
+        self.orden_actual = CRITERIOS[criterio]
+        self.indice_actual = 0
+
+    def filtrar(self, riesgo_min=None, vendedor=None):
+        self.vista = self.datos.filtrar(riesgo_min, vendedor)
+        if vendedor: self.filtro_actual = f"Vendedor {vendedor}"
+        elif riesgo_min is not None: self.filtro_actual = f"Riesgo >= {riesgo_min}"
+        else: self.filtro_actual = "Todos"
         self.indice_actual = 0
-        self.cache_imagenes.clear() # Limpiar cache al reordenar para no consumir mucha RAM
 
     def dibujar_texto_multilinea(self, texto, x, y, ancho_max, color=NEGRO, fuente=None):
         if fuente is None: fuente = self.fuente_texto
@@ -116,7 +114,7 @@ class VisorWallapop:
                     
                     # Navegación
                     if evento.key == pygame.K_RIGHT:
-                        if self.indice_actual < len(self.items) - 1:
+                        if self.indice_actual < len(self.vista) - 1:
                             self.indice_actual += 1
                     if evento.key == pygame.K_LEFT:
                         if self.indice_actual > 0:
@@ -127,16 +125,23 @@ class VisorWallapop:
                     if evento.key == pygame.K_p: self.ordenar("precio")
                     if evento.key == pygame.K_f: self.ordenar("fecha")
 
+                    # Filtros: alto riesgo, solo el vendedor del anuncio actual, todos
+                    if evento.key == pygame.K_a: self.filtrar(riesgo_min=RIESGO_ALTO)
+                    if evento.key == pygame.K_v and len(self.vista):
+                        self.filtrar(vendedor=self.datos.documento(self.vista[self.indice_actual]).get("user_id"))
+                    if evento.key == pygame.K_t: self.filtrar()
+
             # --- DIBUJAR ---
             self.pantalla.fill(BLANCO)
             
-            if not self.items:
+            if not len(self.vista):
                 texto = self.fuente_titulo.render("No hay datos. Ejecuta el poller primero.", True, NEGRO)
                 self.pantalla.blit(texto, (50, 50))
                 pygame.display.flip()
                 continue
 
-            item = self.items[self.indice_actual]
+            self.precargar_vecinas()
+            item = self.datos.documento(self.vista[self.indice_actual])
             riesgo = item['enrichment']['risk_score']
             
             # Panel izquierdo (Imagen)
@@ -144,9 +149,12 @@ class VisorWallapop:
             img_url = item.get("image_url")
             
             if img_url:
-                img = self.descargar_imagen(img_url)
-                if img:
+                estado, img = self.imagenes.obtener(img_url)
+                if estado == LISTA:
                     self.pantalla.blit(img, (30, 90))
+                elif estado == CARGANDO:
+                    txt = self.fuente_texto.render("Cargando imagen...", True, GRIS_OSCURO)
+                    self.pantalla.blit(txt, (150, 250))
                 else:
                     txt = self.fuente_texto.render("Sin Imagen / Error", True, NEGRO)
                     self.pantalla.blit(txt, (150, 250))
@@ -194,8 +202,8 @@ class VisorWallapop:
 
             # Barra Inferior (Controles)
             pygame.draw.rect(self.pantalla, GRIS_OSCURO, (0, ALTO_VENTANA - 60, ANCHO_VENTANA, 60))
-            info_nav = f"Item {self.indice_actual + 1} de {len(self.items)} | Orden: {self.orden_actual}"
-            ayuda = "[Flechas] Navegar | [R] Ordenar Riesgo | [P] Ordenar Precio | [F] Ordenar Fecha"
+            info_nav = f"Item {self.indice_actual + 1} de {len(self.vista)} | Orden: {self.orden_actual} | Filtro: {self.filtro_actual}"
+            ayuda = "[Flechas] Navegar | [R/P/F] Ordenar Riesgo/Precio/Fecha | [A] Riesgo>=80 | [V] Vendedor | [T] Todos"
             
             self.pantalla.blit(self.fuente_texto.render(info_nav, True, BLANCO), (20, ALTO_VENTANA - 50))
             self.pantalla.blit(self.fuente_mini.render(ayuda, True, GRIS), (20, ALTO_VENTANA - 25))
@@ -203,6 +211,7 @@ class VisorWallapop:
             pygame.display.flip()
             self.reloj.tick(30)
 
+        self.imagenes.cerrar()
         pygame.quit()
         sys.exit()
 
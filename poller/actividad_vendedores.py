@@ -0,0 +1,132 @@
+import base64
+import json
+import os
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+
+# Actividad de vendedores entre ciclos (anuncios nuevos por user_id en 1h / 24h / 7d).
+#  - Vendedores activos: contadores exactos por hora (dict disperso), en un LRU acotado.
+#    Los que llevan más de 7 días sin publicar se expulsan.
+#  - Cola larga: count-min sketches por bucket de tiempo (memoria fija, sin importar
+#    cuántos vendedores distintos haya). Se usan para los vendedores expulsados del LRU.
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_ACTIVIDAD = "actividad_vendedores.json"
+MAX_VENDEDORES_EXACTOS = 200000
+HORA = 3600
+DIA = 24 * HORA
+VENTANAS = {"1h": HORA, "24h": DIA, "7d": 7 * DIA}
+ANCHO_CMS = 4096
+PROFUNDIDAD_CMS = 4
+
+def _bucket(ts, duracion):
+    return int(ts // duracion * duracion)
+
+class CountMinSketch:
+    def __init__(self, tabla=None):
+        self.tabla = tabla if tabla is not None else array("I", bytes(4 * ANCHO_CMS * PROFUNDIDAD_CMS))
+
+    def _posiciones(self, clave):
+        datos = clave.encode("utf-8")
+        # crc32 con semillas distintas: estable entre ejecuciones (hash() de Python no lo es)
+        return [fila * ANCHO_CMS + zlib.crc32(datos, fila * 0x9E3779B1 & 0xFFFFFFFF) % ANCHO_CMS
+                for fila in range(PROFUNDIDAD_CMS)]
+
+    def anadir(self, clave, n=1):
+        for p in self._posiciones(clave):
+            self.tabla[p] += n
+
+    def estimar(self, clave):
+        return min(self.tabla[p] for p in self._posiciones(clave))
+
+class ActividadVendedores:
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.exactos = OrderedDict()   # user_id -> {inicio_hora: n}, ordenado por última actividad
+        self.ultima_actividad = {}     # user_id -> ts
+        self.cms_horas = {}            # inicio_hora -> CountMinSketch (últimas 24h)
+        self.cms_dias = {}             # inicio_dia -> CountMinSketch (últimos 7d)
+        self.lock = threading.Lock()
+
+    def registrar(self, user_id, ts=None):
+        if not user_id: return
+        ts = ts or time.time()
+        hora = _bucket(ts, HORA)
+        with self.lock:
+            buckets = self.exactos.pop(user_id, None) or {}
+            buckets[hora] = buckets.get(hora, 0) + 1
+            limite = ts - VENTANAS["7d"]
+            for h in [h for h in buckets if h + HORA <= limite]:
+                del buckets[h]
+            self.exactos[user_id] = buckets
+            self.ultima_actividad[user_id] = max(ts, self.ultima_actividad.get(user_id, 0))
+
+            self.cms_horas.setdefault(hora, CountMinSketch()).anadir(user_id)
+            self.cms_dias.setdefault(_bucket(ts, DIA), CountMinSketch()).anadir(user_id)
+            self._expulsar(time.time())
+
+    def _expulsar(self, ahora):
+        # Vendedores inactivos (> 7d) y exceso sobre MAX_VENDEDORES_EXACTOS, por orden de antigüedad
+        while self.exactos:
+            user_id = next(iter(self.exactos))
+            inactivo = self.ultima_actividad.get(user_id, 0) < ahora - VENTANAS["7d"]
+            if not inactivo and len(self.exactos) <= MAX_VENDEDORES_EXACTOS: break
+            del self.exactos[user_id]
+            self.ultima_actividad.pop(user_id, None)
+        for h in [h for h in self.cms_horas if h + HORA <= ahora - DIA]:
+            del self.cms_horas[h]
+        for d in [d for d in self.cms_dias if d + DIA <= ahora - VENTANAS["7d"]]:
+            del self.cms_dias[d]
+
+    def contar(self, user_id, ventana="24h", ahora=None):
+        # Anuncios nuevos del vendedor en la ventana. Exacto si está en el LRU; si no, estimación CMS.
+        if not user_id: return 0
+        ahora = ahora or time.time()
+        desde = ahora - VENTANAS[ventana]
+        with self.lock:
+            buckets = self.exactos.get(user_id)
+            if buckets is not None:
+                return sum(n for h, n in buckets.items() if h + HORA > desde)
+            sketches = self.cms_horas if ventana != "7d" else self.cms_dias
+            duracion = HORA if ventana != "7d" else DIA
+            return sum(s.estimar(user_id) for inicio, s in sketches.items() if inicio + duracion > desde)
+
+    # --- Persistencia ---
+    def guardar(self, ruta=None):
+        ruta = ruta or self.ruta
+        with self.lock:
+            datos = {
+                "exactos": [[u, self.ultima_actividad.get(u, 0), b] for u, b in self.exactos.items()],
+                "cms_horas": {str(h): base64.b64encode(s.tabla.tobytes()).decode() for h, s in self.cms_horas.items()},
+                "cms_dias": {str(d): base64.b64encode(s.tabla.tobytes()).decode() for d, s in self.cms_dias.items()},
+            }
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        actividad = cls(ruta)
+        if not os.path.exists(ruta): return actividad
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            print(f"[!] No se pudo leer {ruta}. Se empieza sin histórico de vendedores.")
+            return actividad
+
+        def sketch(b64):
+            tabla = array("I")
+            tabla.frombytes(base64.b64decode(b64))
+            return CountMinSketch(tabla)
+
+        for user_id, ultima, buckets in datos.get("exactos", []):
+            actividad.exactos[user_id] = {int(h): n for h, n in buckets.items()}
+            actividad.ultima_actividad[user_id] = ultima
+        actividad.cms_horas = {int(h): sketch(v) for h, v in datos.get("cms_horas", {}).items()}
+        actividad.cms_dias = {int(d): sketch(v) for d, v in datos.get("cms_dias", {}).items()}
+        return actividad
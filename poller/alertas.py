@@ -0,0 +1,283 @@
+import fnmatch
+import glob
+import json
+import os
+import queue
+import re
+import smtplib
+import threading
+import time
+from datetime import datetime, timezone
+from email.message import EmailMessage
+
+import yaml
+
+# Motor de alertas en proceso: carga las mismas reglas YAML de ElastAlert
+# (elastalert/rules/*.yaml), evalúa sus filtros sobre cada documento en cuanto se
+# guarda y respeta las ventanas 'realert'. Las notificaciones van a sinks enchufables y
+# se entregan desde un hilo propio: un SMTP lento no frena el guardado.
+# Soporta el subconjunto de filtros que usan nuestras reglas: range, term, terms y
+# query_string del tipo "campo: (a OR b OR *comodin*)".
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_REGLAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "elastalert", "rules")
+ARCHIVO_ESTADO_ALERTAS = "alertas_estado.json"
+ARCHIVO_ALERTAS = "alertas.jsonl"
+SMTP_HOST = "localhost"          # Stand-in local (p.ej. python3 -m aiosmtpd -n -l localhost:1025)
+SMTP_PUERTO = 1025
+SMTP_REMITENTE = "wallapop-fraud-lab@localhost"
+REALERT_POR_DEFECTO = 60         # segundos (mismo valor por defecto que ElastAlert: 1 minuto)
+
+_UNIDADES = {"seconds": 1, "minutes": 60, "hours": 3600, "days": 86400, "weeks": 604800}
+
+def a_segundos(periodo):
+    # {"minutes": 5} -> 300
+    if not periodo: return None
+    return sum(_UNIDADES[k] * v for k, v in periodo.items() if k in _UNIDADES)
+
+def valor_campo(doc, ruta):
+    # "enrichment.risk_score" -> doc["enrichment"]["risk_score"]
+    valor = doc
+    for parte in ruta.split("."):
+        if not isinstance(valor, dict): return None
+        valor = valor.get(parte)
+    return valor
+
+def _como_lista(valor):
+    if valor is None: return []
+    return valor if isinstance(valor, list) else [valor]
+
+# ==============================================================================
+# FILTROS
+# ==============================================================================
+
+def _filtro_range(campo, limites):
+    def coincide(doc):
+        for v in _como_lista(valor_campo(doc, campo)):
+            try:
+                ok = all([
+                    "gte" not in limites or v >= limites["gte"],
+                    "gt" not in limites or v > limites["gt"],
+                    "lte" not in limites or v <= limites["lte"],
+                    "lt" not in limites or v < limites["lt"],
+                ])
+            except TypeError:
+                continue
+            if ok: return True
+        return False
+    return coincide
+
+def _filtro_terms(campo, valores):
+    buscados = {str(v).lower() for v in valores}
+    return lambda doc: any(str(v).lower() in buscados for v in _como_lista(valor_campo(doc, campo)))
+
+def _termino_coincide(termino, valor):
+    # Aproximación a un campo de texto analizado: sin mayúsculas, comodines sobre el valor
+    # completo o sobre cada palabra, y términos simples contra el valor o sus palabras.
+    valor = str(valor).lower()
+    if "*" in termino or "?" in termino:
+        return fnmatch.fnmatchcase(valor, termino) or any(fnmatch.fnmatchcase(p, termino) for p in valor.split())
+    return termino == valor or termino in re.findall(r"\w+", valor) or (" " in termino and termino in valor)
+
+_CLAUSULA = re.compile(r"([\w.]+)\s*:\s*(\([^)]*\)|\"[^\"]*\"|'[^']*'|\S+)")
+
+def _filtro_query_string(query):
+    # "campo: (a OR b OR 'c d')" [AND|OR "otro: x" ...]
+    clausulas = []
+    for campo, expresion in _CLAUSULA.findall(query):
+        expresion = expresion.strip("()")
+        terminos = [t.strip().strip("'\"").lower() for t in re.split(r"\s+OR\s+", expresion) if t.strip()]
+        clausulas.append((campo, terminos))
+    conector_or = re.search(r"\)\s+OR\s+[\w.]+\s*:", query) is not None
+
+    def coincide_clausula(doc, campo, terminos):
+        valores = _como_lista(valor_campo(doc, campo))
+        return any(_termino_coincide(t, v) for t in terminos for v in valores)
+
+    def coincide(doc):
+        resultados = (coincide_clausula(doc, c, t) for c, t in clausulas)
+        return any(resultados) if conector_or else all(resultados)
+    return coincide
+
+def compilar_filtro(filtro):
+    if "query" in filtro and "query_string" in filtro["query"]:
+        filtro = filtro["query"]
+    if "range" in filtro:
+        campo, limites = next(iter(filtro["range"].items()))
+        return _filtro_range(campo, limites)
+    if "term" in filtro:
+        campo, valor = next(iter(filtro["term"].items()))
+        return _filtro_terms(campo, [valor])
+    if "terms" in filtro:
+        campo, valores = next(iter(filtro["terms"].items()))
+        return _filtro_terms(campo, valores)
+    if "query_string" in filtro:
+        return _filtro_query_string(filtro["query_string"]["query"])
+    raise ValueError(f"Filtro no soportado: {list(filtro)}")
+
+# ==============================================================================
+# REGLAS
+# ==============================================================================
+
+class Regla:
+    def __init__(self, config, ruta=None):
+        self.ruta = ruta
+        self.nombre = config["name"]
+        self.filtros = [compilar_filtro(f) for f in config.get("filter", [])]
+        self.realert = a_segundos(config.get("realert"))
+        if self.realert is None: self.realert = REALERT_POR_DEFECTO
+        self.timeframe = a_segundos(config.get("timeframe"))
+        self.campo_tiempo = config.get("timestamp_field")
+        self.query_key = config.get("query_key")
+        self.tipos_alerta = _como_lista(config.get("alert", ["debug"]))
+        self.email = _como_lista(config.get("email"))
+        self.asunto = config.get("alert_subject", self.nombre)
+        self.asunto_args = config.get("alert_subject_args", [])
+        self.texto = config.get("alert_text", "")
+        self.texto_args = config.get("alert_text_args", [])
+
+    def coincide(self, doc, ahora=None):
+        if self.timeframe and self.campo_tiempo:
+            # Igual que la consulta de ElastAlert: solo documentos dentro de la ventana
+            marca = valor_campo(doc, self.campo_tiempo)
+            try:
+                ts = datetime.fromisoformat(marca).timestamp()
+                if ts < (ahora or time.time()) - self.timeframe: return False
+            except (TypeError, ValueError):
+                pass
+        return all(f(doc) for f in self.filtros)
+
+    def clave_realert(self, doc):
+        return self.nombre if not self.query_key else f"{self.nombre}|{valor_campo(doc, self.query_key)}"
+
+    def formatear(self, doc):
+        def args(campos):
+            return [valor_campo(doc, c) if valor_campo(doc, c) is not None else "<MISSING VALUE>" for c in campos]
+        asunto = self.asunto.format(*args(self.asunto_args)) if self.asunto_args else self.asunto
+        texto = self.texto.format(*args(self.texto_args)) if self.texto_args else self.texto
+        return asunto, texto
+
+def cargar_reglas(directorio=DIRECTORIO_REGLAS):
+    reglas = []
+    for ruta in sorted(glob.glob(os.path.join(directorio, "*.yaml"))):
+        with open(ruta, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+        try:
+            reglas.append(Regla(config, ruta))
+        except (KeyError, ValueError) as e:
+            print(f"[!] Regla {os.path.basename(ruta)} ignorada: {e}")
+    return reglas
+
+# ==============================================================================
+# SINKS
+# ==============================================================================
+
+class SinkConsola:
+    def enviar(self, regla, asunto, texto, doc):
+        print(f"[ALERTA] {asunto}\n{texto}")
+
+class SinkArchivo:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+
+    def enviar(self, regla, asunto, texto, doc):
+        linea = {"ts": datetime.now(timezone.utc).isoformat(), "regla": regla.nombre,
+                 "asunto": asunto, "texto": texto, "id": doc.get("id")}
+        with self.lock, open(self.ruta, "a", encoding="utf-8") as f:
+            f.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+class SinkSMTP:
+    def __init__(self, host=SMTP_HOST, puerto=SMTP_PUERTO, remitente=SMTP_REMITENTE):
+        self.host = host
+        self.puerto = puerto
+        self.remitente = remitente
+
+    def enviar(self, regla, asunto, texto, doc):
+        if not regla.email: return
+        msg = EmailMessage()
+        msg["Subject"] = asunto
+        msg["From"] = self.remitente
+        msg["To"] = ", ".join(regla.email)
+        msg.set_content(texto)
+        try:
+            with smtplib.SMTP(self.host, self.puerto, timeout=5) as smtp:
+                smtp.send_message(msg)
+        except (OSError, smtplib.SMTPException) as e:
+            print(f"[!] No se pudo enviar el email de '{regla.nombre}': {e}")
+
+# ==============================================================================
+# MOTOR
+# ==============================================================================
+
+class MotorAlertas:
+    def __init__(self, reglas, sinks, ruta_estado=None):
+        # sinks: {"debug": [SinkConsola()], "email": [SinkSMTP()], "*": [SinkArchivo(...)]}
+        # "*" recibe todas las alertas, sea cual sea el tipo declarado en la regla.
+        self.reglas = reglas
+        self.sinks = sinks
+        self.ruta_estado = ruta_estado
+        self.ultima_alerta = {}   # clave realert -> ts
+        self.lock = threading.Lock()
+        self.cola = queue.Queue()
+        self.hilo = threading.Thread(target=self._entregar, name="alertas", daemon=True)
+        self.hilo.start()
+        if ruta_estado and os.path.exists(ruta_estado):
+            try:
+                with open(ruta_estado, "r", encoding="utf-8") as f:
+                    self.ultima_alerta = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def evaluar(self, doc, ahora=None):
+        # Devuelve los nombres de las reglas que han disparado alerta para este documento
+        ahora = ahora or time.time()
+        disparadas = []
+        for regla in self.reglas:
+            if not regla.coincide(doc, ahora): continue
+            clave = regla.clave_realert(doc)
+            with self.lock:
+                ultima = self.ultima_alerta.get(clave)
+                if regla.realert and ultima is not None and ahora - ultima < regla.realert: continue
+                self.ultima_alerta[clave] = ahora
+            asunto, texto = regla.formatear(doc)
+            destinos = [s for tipo in regla.tipos_alerta for s in self.sinks.get(tipo, [])] + self.sinks.get("*", [])
+            self.cola.put((destinos, regla, asunto, texto, doc))
+            disparadas.append(regla.nombre)
+        return disparadas
+
+    def _entregar(self):
+        while True:
+            elemento = self.cola.get()
+            if elemento is None: return
+            destinos, regla, asunto, texto, doc = elemento
+            for sink in destinos:
+                try:
+                    sink.enviar(regla, asunto, texto, doc)
+                except Exception as e:
+                    print(f"[!] Falló el envío de la alerta '{regla.nombre}': {e}")
+
+    def cerrar(self):
+        # Entrega lo que quede en cola antes de salir
+        if not self.hilo.is_alive(): return
+        self.cola.put(None)
+        self.hilo.join()
+        self.guardar_estado()
+
+    def guardar_estado(self):
+        if not self.ruta_estado: return
+        with self.lock:
+            datos = dict(self.ultima_alerta)
+        tmp = self.ruta_estado + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(tmp, self.ruta_estado)
+
+def crear_motor(directorio_datos, directorio_reglas=DIRECTORIO_REGLAS):
+    # Motor con los sinks por defecto: consola (debug), SMTP local (email) y archivo JSONL (todas)
+    sinks = {
+        "debug": [SinkConsola()],
+        "email": [SinkSMTP()],
+        "*": [SinkArchivo(os.path.join(directorio_datos, ARCHIVO_ALERTAS))],
+    }
+    return MotorAlertas(cargar_reglas(directorio_reglas), sinks, os.path.join(directorio_datos, ARCHIVO_ESTADO_ALERTAS))
@@ -0,0 +1,168 @@
+import argparse
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import metricas
+
+# Almacenes de documentos del pipeline. Todos comparten la misma interfaz por lotes:
+#  - preparar(doc) -> acción serializada (lo que se acumula en cada lote)
+#  - enviar(lote) -> (ok, pendientes, rechazados): 'pendientes' son las acciones que no se
+#    pudieron confirmar y hay que reintentar; 'rechazados', las que no se arreglan reenviando.
+#  - max_en_vuelo: lotes que se pueden enviar a la vez; nombre: identifica el checkpoint.
+#  - cerrar()
+# El maestro NDJSON es el registro del que parten todos: la ingesta (bulk_ingest.py) lo lee
+# desde un checkpoint por destino que solo avanza con lotes confirmados (entrega al menos
+# una vez; Elastic y SQLite escriben por id, así que reenviar no duplica).
+#  - AlmacenNdjson: el maestro (append por lotes, lo usa el poller). Cada append toma el bloqueo
+#    del maestro, igual que las reescrituras (archivado, promoción del backfill).
+#  - AlmacenSqlite: base embebida en WAL con índices por id, vendedor, modelo, riesgo y fecha,
+#    para deduplicar, contar actividad de vendedores o alimentar el visor sin clúster.
+#  - AlmacenElastic: en bulk_ingest.py (sesión con pool, cuerpos gzip, lotes en vuelo acotados).
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_SQLITE = "wallapop.db"
+CACHE_SQLITE_MB = 64
+
+ESCRITOS = metricas.contador("almacen_docs_total", "Documentos escritos por almacén", ("almacen",))
+
+@contextmanager
+def bloqueo_maestro(ruta_maestro):
+    # Exclusión entre procesos (poller, monitor, planificador, bulk_ingest.py --archivar, backfill.py):
+    # un append que cayera entre la copia y el os.replace de una reescritura se perdería. flock sobre
+    # <maestro>.lock, que no cambia de inode cuando se reescribe el maestro.
+    with open(ruta_maestro + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class AlmacenNdjson:
+    nombre = "ndjson"
+    max_en_vuelo = 1
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.posicion = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+
+    def preparar(self, doc):
+        return (json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def enviar(self, lote):
+        # Una sola escritura por lote; 'posicion' queda al final de lo escrito (para el índice de IDs)
+        with bloqueo_maestro(self.ruta), open(self.ruta, "ab") as f:
+            f.write(b"".join(lote))
+            f.flush()
+            self.posicion = f.tell()
+        ESCRITOS.inc(len(lote), almacen=self.nombre)
+        return len(lote), [], []
+
+    def cerrar(self):
+        pass
+
+class AlmacenSqlite:
+    nombre = "sqlite"
+    max_en_vuelo = 1        # un único escritor; WAL deja leer mientras se escribe
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(ruta, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(f"PRAGMA cache_size=-{CACHE_SQLITE_MB * 1024}")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS anuncios (
+            id TEXT PRIMARY KEY, user_id TEXT, model TEXT, risk_score INTEGER,
+            price REAL, created_at TEXT, doc TEXT) WITHOUT ROWID""")
+        self.con.execute("CREATE INDEX IF NOT EXISTS anuncios_vendedor ON anuncios (user_id, created_at)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS anuncios_modelo ON anuncios (model)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS anuncios_riesgo ON anuncios (risk_score)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS anuncios_fecha ON anuncios (created_at)")
+        self.con.commit()
+
+    def preparar(self, doc):
+        # Columnas indexadas + el documento entero. Las fechas ISO en UTC ordenan como texto.
+        enrichment = doc.get("enrichment") or {}
+        creado = (doc.get("timestamps") or {}).get("created_at")
+        return (doc.get("id"), doc.get("user_id"), enrichment.get("model"), enrichment.get("risk_score"),
+                doc.get("price"), creado, json.dumps(doc, ensure_ascii=False))
+
+    def enviar(self, lote):
+        # Un lote = una transacción; INSERT OR REPLACE hace idempotente el reenvío
+        try:
+            with self.lock, self.con:
+                self.con.executemany("INSERT OR REPLACE INTO anuncios VALUES (?, ?, ?, ?, ?, ?, ?)", lote)
+        except sqlite3.Error as e:
+            print(f"[!] Error escribiendo {len(lote)} docs en {self.ruta}: {e}")
+            metricas.registrar_error("almacen_sqlite", e)
+            return 0, list(lote), []
+        ESCRITOS.inc(len(lote), almacen=self.nombre)
+        return len(lote), [], []
+
+    # --- Consultas locales ---
+
+    def existentes(self, ids):
+        ids = [i for i in ids if i is not None]
+        encontrados = set()
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                trozo = ids[i:i + 500]
+                marcas = ",".join("?" * len(trozo))
+                encontrados.update(f for (f,) in self.con.execute(
+                    f"SELECT id FROM anuncios WHERE id IN ({marcas})", trozo))
+        return encontrados
+
+    def actividad_vendedor(self, user_id, horas=24):
+        desde = (datetime.now(timezone.utc) - timedelta(hours=horas)).isoformat()
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM anuncios WHERE user_id = ? AND created_at >= ?",
+                                    (user_id, desde)).fetchone()[0]
+
+    def consultar(self, riesgo_min=None, modelo=None, vendedor=None, desde=None, orden="risk_score", limite=50):
+        condiciones, valores = [], []
+        for columna, operador, valor in (("risk_score", ">=", riesgo_min), ("model", "=", modelo),
+                                         ("user_id", "=", vendedor), ("created_at", ">=", desde)):
+            if valor is not None:
+                condiciones.append(f"{columna} {operador} ?")
+                valores.append(valor)
+        if orden not in ("risk_score", "created_at", "price"): orden = "risk_score"
+        sentido = "ASC" if orden == "price" else "DESC"
+        donde = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        with self.lock:
+            filas = self.con.execute(f"SELECT doc FROM anuncios {donde} ORDER BY {orden} {sentido} LIMIT ?",
+                                     valores + [limite]).fetchall()
+        return [json.loads(doc) for (doc,) in filas]
+
+    def cerrar(self):
+        with self.lock:
+            self.con.close()
+
+def ruta_sqlite(ruta_maestro):
+    return os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), ARCHIVO_SQLITE)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultas sobre la base SQLite local (bulk_ingest.py --destino sqlite)")
+    parser.add_argument("--base", default=os.path.join("..", "ingestion", ARCHIVO_SQLITE))
+    parser.add_argument("--riesgo-min", type=int)
+    parser.add_argument("--modelo")
+    parser.add_argument("--vendedor")
+    parser.add_argument("--orden", default="risk_score", choices=("risk_score", "created_at", "price"))
+    parser.add_argument("-n", type=int, default=20)
+    args = parser.parse_args()
+
+    almacen = AlmacenSqlite(args.base)
+    inicio = time.perf_counter()
+    docs = almacen.consultar(args.riesgo_min, args.modelo, args.vendedor, orden=args.orden, limite=args.n)
+    print(f"[*] {len(docs)} anuncios en {(time.perf_counter() - inicio) * 1000:.1f} ms")
+    for doc in docs:
+        riesgo = (doc.get("enrichment") or {}).get("risk_score")
+        print(f"    {riesgo:>3} | {doc.get('price')!s:>8} € | {doc.get('user_id')} | {(doc.get('title') or '')[:60]}")
+    if args.vendedor:
+        print(f"[*] Anuncios del vendedor en las últimas 24h: {almacen.actividad_vendedor(args.vendedor)}")
+    almacen.cerrar()
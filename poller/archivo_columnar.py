@@ -0,0 +1,429 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+import almacenamiento
+
+# Archivo histórico columnar del maestro. Los días cerrados se enrollan en segmentos
+# comprimidos por fecha de rastreo (archivo/fecha=AAAA-MM-DD/*.wcol) y el NDJSON se queda
+# solo con la cola caliente (hoy). Formato de cada segmento:
+#   MAGIA | uint32 longitud cabecera | cabecera JSON | bloques de columna (zlib)
+# La cabecera lleva, por columna, tipo, offset, longitud y min/max, así que un lector
+# solo lee las columnas que pide y descarta segmentos enteros con el min/max.
+# Tipos de columna: "i8"/"f8" (arrays numéricos), "dict" (diccionario + códigos uint32)
+# y "str" (longitudes uint32 + texto UTF-8).
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_ARCHIVO = "archivo"
+MAGIA = b"WCOL1\n"
+NIVEL_ZLIB = 6
+# Columnas que siempre van con diccionario (muy repetidas)
+COLUMNAS_DICCIONARIO = {"user_id", "location.city", "currency", "category_id",
+                        "enrichment.risk_factors", "enrichment.suspicious_keywords"}
+# Columnas de texto con min/max en la cabecera (para descartar segmentos por fecha)
+COLUMNAS_ESTADISTICAS_TEXTO = {"timestamps.crawled_at", "timestamps.created_at"}
+CAMPO_FECHA = "timestamps.crawled_at"
+OPERADORES = {">=": np.greater_equal, ">": np.greater, "<=": np.less_equal,
+              "<": np.less, "==": np.equal, "!=": np.not_equal}
+
+# ==============================================================================
+# APLANADO DE DOCUMENTOS
+# ==============================================================================
+
+def aplanar(doc, prefijo="", destino=None):
+    destino = {} if destino is None else destino
+    for clave, valor in doc.items():
+        ruta = prefijo + clave
+        if isinstance(valor, dict) and valor:
+            aplanar(valor, ruta + ".", destino)
+        else:
+            destino[ruta] = valor
+    return destino
+
+def anidar(plano, orden):
+    doc = {}
+    for ruta in orden:
+        if ruta not in plano: continue
+        nodo = doc
+        partes = ruta.split(".")
+        for parte in partes[:-1]:
+            nodo = nodo.setdefault(parte, {})
+        nodo[partes[-1]] = plano[ruta]
+    return doc
+
+# ==============================================================================
+# ESCRITURA
+# ==============================================================================
+
+def _es_entero(v):
+    return isinstance(v, int) and not isinstance(v, bool)
+
+def _elegir_tipo(nombre, valores):
+    presentes = [v for v in valores if v is not None]
+    if nombre not in COLUMNAS_DICCIONARIO and presentes:
+        if len(presentes) == len(valores) and all(_es_entero(v) for v in presentes):
+            return "i8"
+        if all(_es_entero(v) or isinstance(v, float) for v in presentes) and any(isinstance(v, float) for v in presentes):
+            return "f8"
+        if all(isinstance(v, str) for v in presentes):
+            distintos = len(set(presentes))
+            return "dict" if distintos <= max(1, len(valores) // 4) else "str"
+    return "dict"
+
+def _codificar(tipo, valores):
+    if tipo == "i8":
+        return np.array(valores, dtype="<i8").tobytes()
+    if tipo == "f8":
+        return np.array([np.nan if v is None else v for v in valores], dtype="<f8").tobytes()
+    if tipo == "str":
+        textos = [None if v is None else v.encode("utf-8") for v in valores]
+        longitudes = np.array([0xFFFFFFFF if t is None else len(t) for t in textos], dtype="<u4")
+        return longitudes.tobytes() + b"".join(t for t in textos if t)
+    # dict: la clave es el JSON del valor (admite listas, números y None)
+    codigos, diccionario, claves = [], [], {}
+    for v in valores:
+        k = json.dumps(v, ensure_ascii=False, sort_keys=True)
+        if k not in claves:
+            claves[k] = len(diccionario)
+            diccionario.append(v)
+        codigos.append(claves[k])
+    cabecera = json.dumps(diccionario, ensure_ascii=False).encode("utf-8")
+    return struct.pack("<I", len(cabecera)) + cabecera + np.array(codigos, dtype="<u4").tobytes()
+
+def escribir_segmento(ruta, docs):
+    # docs: lista de documentos del maestro (dicts anidados)
+    planos = [aplanar(d) for d in docs]
+    orden = list(dict.fromkeys(c for p in planos for c in p))
+    columnas = {}
+    bloques = []
+    offset = 0
+    for nombre in orden:
+        valores = [p.get(nombre) for p in planos]
+        tipo = _elegir_tipo(nombre, valores)
+        bloque = zlib.compress(_codificar(tipo, valores), NIVEL_ZLIB)
+        meta = {"tipo": tipo, "offset": offset, "longitud": len(bloque)}
+        ausentes = [i for i, p in enumerate(planos) if nombre not in p]
+        if ausentes: meta["ausentes"] = ausentes
+        if tipo in ("i8", "f8") or nombre in COLUMNAS_ESTADISTICAS_TEXTO:
+            comparables = [v for v in valores if v is not None and v == v]
+            if comparables: meta["min"], meta["max"] = min(comparables), max(comparables)
+        columnas[nombre] = meta
+        bloques.append(bloque)
+        offset += len(bloque)
+
+    cabecera = json.dumps({"filas": len(docs), "orden": orden, "columnas": columnas},
+                          ensure_ascii=False).encode("utf-8")
+    tmp = ruta + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIA + struct.pack("<I", len(cabecera)) + cabecera)
+        for bloque in bloques:
+            f.write(bloque)
+    os.replace(tmp, ruta)
+
+# ==============================================================================
+# LECTURA
+# ==============================================================================
+
+def _cumple_rango(meta, op, valor):
+    # False si el min/max de la columna garantiza que ninguna fila cumple el predicado
+    if "min" not in meta: return True
+    minimo, maximo = meta["min"], meta["max"]
+    try:
+        if op == ">=": return maximo >= valor
+        if op == ">": return maximo > valor
+        if op == "<=": return minimo <= valor
+        if op == "<": return minimo < valor
+        if op == "==": return minimo <= valor <= maximo
+    except TypeError:
+        pass
+    return True
+
+class Segmento:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(ruta, "rb") as f:
+            if f.read(len(MAGIA)) != MAGIA:
+                raise ValueError(f"{ruta} no es un segmento columnar")
+            longitud = struct.unpack("<I", f.read(4))[0]
+            cabecera = json.loads(f.read(longitud))
+        self.inicio_datos = len(MAGIA) + 4 + longitud
+        self.filas = cabecera["filas"]
+        self.orden = cabecera["orden"]
+        self.columnas = cabecera["columnas"]
+
+    def puede_contener(self, filtros):
+        for campo, op, valor in filtros:
+            meta = self.columnas.get(campo)
+            if meta is None or not _cumple_rango(meta, op, valor): return False
+        return True
+
+    def _bloque(self, f, meta):
+        f.seek(self.inicio_datos + meta["offset"])
+        return zlib.decompress(f.read(meta["longitud"]))
+
+    def leer_columna(self, f, nombre):
+        # Devuelve (tipo, datos): array NumPy para i8/f8, (diccionario, códigos) para dict, lista para str
+        meta = self.columnas[nombre]
+        datos = self._bloque(f, meta)
+        tipo = meta["tipo"]
+        if tipo in ("i8", "f8"):
+            return tipo, np.frombuffer(datos, dtype="<" + tipo)
+        if tipo == "dict":
+            n = struct.unpack_from("<I", datos)[0]
+            diccionario = json.loads(datos[4:4 + n])
+            return tipo, (diccionario, np.frombuffer(datos, dtype="<u4", offset=4 + n))
+        longitudes = np.frombuffer(datos, dtype="<u4", count=self.filas)
+        valores, pos = [], 4 * self.filas
+        for lon in longitudes.tolist():
+            if lon == 0xFFFFFFFF:
+                valores.append(None)
+                continue
+            valores.append(datos[pos:pos + lon].decode("utf-8"))
+            pos += lon
+        return tipo, valores
+
+    def _mascara(self, f, campo, op, valor):
+        tipo, datos = self.leer_columna(f, campo)
+        if tipo in ("i8", "f8"):
+            with np.errstate(invalid="ignore"):
+                return OPERADORES[op](datos, valor)
+        comparar = lambda v: v is not None and _comparar(v, op, valor)
+        if tipo == "dict":
+            # El predicado se evalúa una vez por valor distinto y se expande con los códigos
+            diccionario, codigos = datos
+            return np.array([comparar(v) for v in diccionario], dtype=bool)[codigos]
+        return np.array([comparar(v) for v in datos], dtype=bool)
+
+    def _valores(self, meta, datos, filas):
+        # Valores de 'filas' de una columna ya descomprimida. En texto solo se decodifican esas filas:
+        # su posición sale de la tabla de longitudes del bloque.
+        tipo = meta["tipo"]
+        if tipo in ("i8", "f8"):
+            valores = np.frombuffer(datos, dtype="<" + tipo)[filas].tolist()
+            return [None if v != v else v for v in valores] if tipo == "f8" else valores
+        if tipo == "dict":
+            n = struct.unpack_from("<I", datos)[0]
+            diccionario = json.loads(datos[4:4 + n])
+            return [diccionario[c] for c in np.frombuffer(datos, dtype="<u4", offset=4 + n)[filas].tolist()]
+        longitudes = np.frombuffer(datos, dtype="<u4", count=self.filas)
+        tamanos = np.where(longitudes == 0xFFFFFFFF, 0, longitudes).astype(np.int64)
+        inicios = 4 * self.filas + np.cumsum(tamanos) - tamanos
+        return [None if longitudes[i] == 0xFFFFFFFF else datos[inicios[i]:inicios[i] + tamanos[i]].decode("utf-8")
+                for i in filas.tolist()]
+
+    def _leer_valores(self, f, pedidas, filas):
+        return {n: self._valores(self.columnas[n], self._bloque(f, self.columnas[n]), filas) for n in pedidas}
+
+    def _documentos(self, pedidas, filas, valores):
+        ausentes = {n: set(self.columnas[n].get("ausentes", ())) for n in pedidas}
+        for j, fila in enumerate(filas.tolist()):
+            plano = {n: valores[n][j] for n in pedidas if fila not in ausentes[n]}
+            yield anidar(plano, pedidas)
+
+    def leer(self, columnas=None, filtros=()):
+        # Genera documentos anidados con solo 'columnas' (prefijos con punto: "enrichment" trae todo su bloque)
+        if not self.puede_contener(filtros): return
+        if columnas is None:
+            pedidas = self.orden
+        else:
+            pedidas = [c for c in self.orden if any(c == p or c.startswith(p + ".") for p in columnas)]
+        with open(self.ruta, "rb") as f:
+            mascara = np.ones(self.filas, dtype=bool)
+            for campo, op, valor in filtros:
+                mascara &= self._mascara(f, campo, op, valor)
+            filas = np.flatnonzero(mascara)
+            if not len(filas): return
+            valores = self._leer_valores(f, pedidas, filas)
+        yield from self._documentos(pedidas, filas, valores)
+
+    def leer_filas(self, filas):
+        # Documentos completos de unas pocas filas (en el orden pedido), sin construir el resto del segmento
+        filas = np.asarray(filas, dtype=np.int64)
+        with open(self.ruta, "rb") as f:
+            valores = self._leer_valores(f, self.orden, filas)
+        return list(self._documentos(self.orden, filas, valores))
+
+def _comparar(a, op, b):
+    try:
+        if op == ">=": return a >= b
+        if op == ">": return a > b
+        if op == "<=": return a <= b
+        if op == "<": return a < b
+        if op == "==": return a == b
+        if op == "!=": return a != b
+    except TypeError:
+        return False
+    raise ValueError(f"Operador no soportado: {op}")
+
+def _fecha_particion(nombre):
+    return nombre.split("=", 1)[1] if nombre.startswith("fecha=") else None
+
+def _descarta_particion(fecha, op, valor):
+    # La partición es un día completo: se compara con la parte de fecha del predicado
+    if not isinstance(valor, str): return False
+    dia = valor[:10]
+    if op in (">", ">="): return fecha < dia
+    if op in ("<", "<="): return fecha > dia
+    if op == "==": return fecha != dia
+    return False
+
+def segmentos(directorio, filtros=()):
+    # Segmentos del archivo en orden cronológico, descartando particiones por fecha de rastreo
+    if not os.path.isdir(directorio): return []
+    rutas = []
+    for particion in sorted(os.listdir(directorio)):
+        fecha = _fecha_particion(particion)
+        if fecha is None: continue
+        if any(_descarta_particion(fecha, op, valor) for campo, op, valor in filtros if campo == CAMPO_FECHA):
+            continue
+        carpeta = os.path.join(directorio, particion)
+        rutas.extend(os.path.join(carpeta, n) for n in sorted(os.listdir(carpeta)) if n.endswith(".wcol"))
+    return rutas
+
+def _valor_documento(doc, ruta):
+    for parte in ruta.split("."):
+        if not isinstance(doc, dict): return None
+        doc = doc.get(parte)
+    return doc
+
+def _cumple(doc, filtros):
+    for campo, op, valor in filtros:
+        v = _valor_documento(doc, campo)
+        if v is None or not _comparar(v, op, valor): return False
+    return True
+
+def _leer_cola(ruta_maestro, columnas, filtros):
+    # La cola caliente en NDJSON, con la misma proyección y filtros que el archivo
+    if not ruta_maestro or not os.path.exists(ruta_maestro): return
+    with open(ruta_maestro, "r", encoding="utf-8") as f:
+        for linea in f:
+            if not linea.strip(): continue
+            try:
+                doc = json.loads(linea)
+            except ValueError:
+                continue
+            if not _cumple(doc, filtros): continue
+            if columnas is not None:
+                plano = aplanar(doc)
+                doc = anidar(plano, [c for c in plano if any(c == p or c.startswith(p + ".") for p in columnas)])
+            yield doc
+
+def escanear(directorio, columnas=None, filtros=(), ruta_maestro=None):
+    # Archivo (solo columnas pedidas, con pushdown) + cola caliente del maestro
+    for ruta in segmentos(directorio, filtros):
+        yield from Segmento(ruta).leer(columnas, filtros)
+    yield from _leer_cola(ruta_maestro, columnas, filtros)
+
+def parsear_filtro(texto):
+    # "enrichment.risk_score>=80" -> ("enrichment.risk_score", ">=", 80)
+    for op in (">=", "<=", "!=", "==", ">", "<"):
+        if op in texto:
+            campo, valor = texto.split(op, 1)
+            try:
+                valor = json.loads(valor)
+            except ValueError:
+                pass
+            return campo.strip(), op, valor
+    raise ValueError(f"Filtro no válido: {texto}")
+
+# ==============================================================================
+# ROLLING DEL MAESTRO
+# ==============================================================================
+
+def directorio_archivo(ruta_maestro):
+    return os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), DIRECTORIO_ARCHIVO)
+
+def archivar(ruta_maestro, hasta=None, limite_offset=None):
+    # Pasa al archivo columnar los documentos rastreados antes de 'hasta' (AAAA-MM-DD, por defecto hoy
+    # en UTC). Solo se tocan líneas anteriores a 'limite_offset' (p.ej. lo ya enviado a Elastic).
+    # El resto se reescribe en un maestro nuevo (os.replace => cambia el inode, y tanto el índice de IDs
+    # como el checkpoint de bulk_ingest lo detectan). Devuelve (archivados, nuevo_limite_offset).
+    # Con el maestro bloqueado de la lectura al os.replace: ningún append puede quedarse fuera.
+    hasta = hasta or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if not os.path.exists(ruta_maestro): return 0, limite_offset
+    with almacenamiento.bloqueo_maestro(ruta_maestro):
+        return _archivar(ruta_maestro, hasta, limite_offset)
+
+def _archivar(ruta_maestro, hasta, limite_offset):
+    st = os.stat(ruta_maestro)
+    limite = st.st_size if limite_offset is None else min(limite_offset, st.st_size)
+
+    por_fecha = defaultdict(list)
+    primer_offset = {}
+    tmp = ruta_maestro + ".rolling"
+    nuevo_limite = 0
+    offset = 0
+    with open(ruta_maestro, "rb") as f, open(tmp, "wb") as salida:
+        for linea in f:
+            inicio = offset
+            offset += len(linea)
+            fecha = None
+            if offset <= limite and linea.endswith(b"\n") and linea.strip():
+                try:
+                    doc = json.loads(linea)
+                    fecha = (_valor_documento(doc, CAMPO_FECHA) or "")[:10] or None
+                except ValueError:
+                    pass
+            if fecha and fecha < hasta:
+                por_fecha[fecha].append(doc)
+                primer_offset.setdefault(fecha, inicio)
+                continue
+            salida.write(linea)
+            if inicio < limite: nuevo_limite += len(linea)
+
+    archivados = sum(len(d) for d in por_fecha.values())
+    if not archivados:
+        os.remove(tmp)
+        return 0, limite_offset
+
+    # Nombre determinista (inode + offset): si se corta antes del os.replace, repetir sobrescribe
+    directorio = directorio_archivo(ruta_maestro)
+    for fecha, docs in sorted(por_fecha.items()):
+        carpeta = os.path.join(directorio, f"fecha={fecha}")
+        os.makedirs(carpeta, exist_ok=True)
+        escribir_segmento(os.path.join(carpeta, f"seg-{st.st_ino}-{primer_offset[fecha]:012d}.wcol"), docs)
+    os.replace(tmp, ruta_maestro)
+    print(f"[*] Archivados {archivados} docs en {len(por_fecha)} particiones. Quedan en el maestro los de {hasta} en adelante.")
+    return archivados, (nuevo_limite if limite_offset is not None else None)
+
+def verificar(ruta_maestro):
+    # Codifica el maestro en un segmento temporal y comprueba que se lee igual que el NDJSON
+    docs = list(_leer_cola(ruta_maestro, None, ()))
+    tmp = ruta_maestro + ".verificar.wcol"
+    escribir_segmento(tmp, docs)
+    tamano = os.path.getsize(tmp)
+    leidos = list(Segmento(tmp).leer())
+    os.remove(tmp)
+    distintos = sum(1 for a, b in zip(docs, leidos) if a != b) + abs(len(docs) - len(leidos))
+    return len(docs), distintos, os.path.getsize(ruta_maestro), tamano
+
+if __name__ == "__main__":
+    from poller import ruta_archivo_maestro
+
+    parser = argparse.ArgumentParser(description="Archivo columnar del maestro de Wallapop")
+    parser.add_argument("--maestro", default=None, help="Ruta del archivo maestro")
+    parser.add_argument("--archivar", action="store_true", help="Enrolla en el archivo los días anteriores a --hasta")
+    parser.add_argument("--hasta", default=None, help="Fecha AAAA-MM-DD (por defecto, hoy)")
+    parser.add_argument("--verificar", action="store_true", help="Comprueba la ida y vuelta NDJSON -> columnar")
+    parser.add_argument("--columnas", default=None, help="Columnas a leer, separadas por comas")
+    parser.add_argument("--filtro", action="append", default=[], help='p.ej. "enrichment.risk_score>=80"')
+    args = parser.parse_args()
+
+    ruta = args.maestro or ruta_archivo_maestro()
+    if args.verificar:
+        n, distintos, original, comprimido = verificar(ruta)
+        print(f"[*] {n} docs | {distintos} distintos | NDJSON {original / 1e6:.2f} MB -> "
+              f"columnar {comprimido / 1e6:.2f} MB ({original / max(comprimido, 1):.1f}x)")
+    elif args.archivar:
+        archivar(ruta, args.hasta)
+    else:
+        columnas = args.columnas.split(",") if args.columnas else None
+        filtros = [parsear_filtro(f) for f in args.filtro]
+        for doc in escanear(directorio_archivo(ruta), columnas, filtros, ruta):
+            print(json.dumps(doc, ensure_ascii=False))
@@ -0,0 +1,286 @@
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl
+
+import metricas
+
+# Captura y reproducción de las respuestas crudas de /api/v3/search.
+#  - Captura (WALLAPOP_CAPTURA=<dir>): un hook de la sesión HTTP encola el cuerpo de cada
+#    respuesta 200 tal cual llega (sin volver a serializarlo) y un hilo en segundo plano lo
+#    escribe en <dir>/<AAAA-MM-DD>/<HH>.jsonl.gz (UTC). Cada volcado es un miembro gzip completo
+#    añadido con O_APPEND: varios procesos pueden escribir la misma hora y un corte no deja
+#    el archivo ilegible. Si el disco no da abasto se descartan capturas, nunca se frena la descarga.
+#  - Cada línea es la respuesta de la API con un campo extra "_captura" (ts, keywords, start):
+#    backfill.py --crudos las lee directamente.
+#  - Reproducción (WALLAPOP_REPRODUCIR=<dir>): la sesión de Wallapop se sustituye por una que
+#    sirve las páginas capturadas, ciclo a ciclo y por keywords, respetando los tiempos originales
+#    divididos por WALLAPOP_VELOCIDAD (0 = sin esperas). El resto del pipeline no cambia.
+#  - Directorio de datos (WALLAPOP_DATOS=<dir>): maestro, índice de IDs, estadísticas, actividad de
+#    vendedores, checkpoints y SQLite cuelgan de él. Al reproducir sin elegirlo se usa uno nuevo
+#    y vacío, y la ingesta va a SQLite: una reproducción nunca toca los datos reales ni Elastic.
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO_CAPTURA = os.environ.get("WALLAPOP_CAPTURA")
+DIRECTORIO_REPRODUCCION = os.environ.get("WALLAPOP_REPRODUCIR")
+VELOCIDAD = float(os.environ.get("WALLAPOP_VELOCIDAD", "1") or 1)
+NIVEL_GZIP = 3                  # el hilo de escritura comprime; más nivel apenas reduce tamaño
+INTERVALO_VOLCADO = 5.0         # segundos máximos que una captura espera en memoria
+MAX_BYTES_VOLCADO = 4 * 1024 * 1024
+MAX_COLA = 1000                 # páginas pendientes de escribir antes de empezar a descartar
+PAGINA_VACIA = b'{"data": {"section": {"payload": {"items": []}}}}'
+PREFIJO_LINEA = b'{"_captura": '
+
+CAPTURAS = metricas.contador("capturas_total", "Respuestas de la API capturadas", ("resultado",))
+BYTES_CAPTURA = metricas.contador("captura_bytes_total", "Bytes comprimidos escritos en capturas")
+REPRODUCIDAS = metricas.contador("reproduccion_paginas_total", "Páginas servidas desde capturas", ("resultado",))
+
+def ruta_hora(directorio, ts):
+    fecha = datetime.fromtimestamp(ts, timezone.utc)
+    return os.path.join(directorio, fecha.strftime("%Y-%m-%d"), fecha.strftime("%H") + ".jsonl.gz")
+
+def archivos_captura(directorio):
+    return sorted(glob.glob(os.path.join(directorio, "*", "*.jsonl.gz")))
+
+# ==============================================================================
+# CAPTURA
+# ==============================================================================
+
+class Capturador:
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.cola = queue.Queue(maxsize=MAX_COLA)
+        self.hilo = threading.Thread(target=self._escribir, name="capturas", daemon=True)
+        self.hilo.start()
+        atexit.register(self.cerrar)
+
+    def registrar(self, r, *args, **kwargs):
+        # Hook 'response' de requests: corre en el hilo de descarga, así que solo encola
+        if r.status_code != 200: return
+        params = dict(parse_qsl(urlsplit(r.url).query))
+        cuerpo = r.content.strip()
+        if not cuerpo.startswith(b"{"): return
+        if b"\n" in cuerpo:
+            cuerpo = json.dumps(json.loads(cuerpo), ensure_ascii=False).encode("utf-8")
+        ts = time.time()
+        meta = json.dumps({"ts": round(ts, 3), "keywords": params.get("keywords"),
+                           "start": int(params.get("start") or 0)}, ensure_ascii=False)
+        separador = b"," if cuerpo[1:].strip() != b"}" else b""
+        linea = PREFIJO_LINEA + meta.encode("utf-8") + separador + cuerpo[1:] + b"\n"
+        try:
+            self.cola.put_nowait((ts, linea))
+        except queue.Full:
+            CAPTURAS.inc(resultado="descartada")
+
+    def _volcar(self, pendientes):
+        por_hora = {}
+        for ts, linea in pendientes:
+            por_hora.setdefault(ruta_hora(self.directorio, ts), []).append(linea)
+        for ruta, lineas in por_hora.items():
+            datos = gzip.compress(b"".join(lineas), compresslevel=NIVEL_GZIP)
+            try:
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                fd = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, datos)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print(f"[!] No se pudo escribir la captura {ruta}: {e}")
+                metricas.registrar_error("capturas", e)
+                CAPTURAS.inc(len(lineas), resultado="descartada")
+                continue
+            CAPTURAS.inc(len(lineas), resultado="escrita")
+            BYTES_CAPTURA.inc(len(datos))
+
+    def _escribir(self):
+        pendientes, tam, limite = [], 0, None
+        while True:
+            try:
+                elemento = self.cola.get(timeout=max(0.0, limite - time.monotonic()) if limite else None)
+            except queue.Empty:
+                elemento = False
+            if elemento:
+                pendientes.append(elemento)
+                tam += len(elemento[1])
+                if limite is None: limite = time.monotonic() + INTERVALO_VOLCADO
+            if pendientes and (elemento is None or elemento is False or tam >= MAX_BYTES_VOLCADO):
+                self._volcar(pendientes)
+                pendientes, tam, limite = [], 0, None
+            if elemento is None: return
+
+    def cerrar(self):
+        if not self.hilo.is_alive(): return
+        self.cola.put(None)
+        self.hilo.join()
+
+# ==============================================================================
+# REPRODUCCIÓN
+# ==============================================================================
+
+_decodificador = json.JSONDecoder()
+
+def _meta(linea):
+    # Solo el campo _captura del principio: parsear la página entera aquí sería trabajo doble
+    if linea.startswith(PREFIJO_LINEA):
+        cabeza = linea[len(PREFIJO_LINEA):len(PREFIJO_LINEA) + 1024].decode("utf-8", "ignore")
+        return _decodificador.raw_decode(cabeza)[0]
+    return json.loads(linea).get("_captura") or {}
+
+class RespuestaReproducida:
+    # Lo que usan descargar_pagina y el modo secuencial de una requests.Response
+    def __init__(self, url, contenido):
+        self.url = url
+        self.status_code = 200
+        self.content = contenido
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+class SesionReproduccion:
+    # Sustituye a la requests.Session de Wallapop. Un ciclo capturado de unas keywords son sus
+    # páginas hasta que se repite un 'start'; al reproducir se pasa al siguiente ciclo cuando se
+    # pide un 'start' ya servido (con descarga concurrente las páginas llegan desordenadas).
+    def __init__(self, directorio, velocidad=VELOCIDAD):
+        self.velocidad = velocidad
+        self.headers = {}
+        self.hooks = {"response": []}
+        self.lock = threading.Lock()
+        self.lineas = self._leer(archivos_captura(directorio))
+        self.abiertos = {}          # keywords -> {start: (ts, cuerpo)} del ciclo que se está leyendo
+        self.completos = {}         # keywords -> deque de ciclos ya leídos
+        self.actuales = {}          # keywords -> (páginas, starts servidos)
+        self.agotado = False
+        self.ts_inicial = None
+        self.inicio = None
+        if not archivos_captura(directorio):
+            print(f"[!] No hay capturas en {directorio}")
+
+    def _leer(self, rutas):
+        for ruta in rutas:
+            try:
+                with gzip.open(ruta, "rb") as f:
+                    for linea in f:
+                        try:
+                            yield _meta(linea), linea
+                        except ValueError as e:
+                            metricas.registrar_error("reproduccion", e)
+            except (OSError, EOFError) as e:
+                print(f"[!] Captura {ruta} truncada o ilegible: {e}")
+                metricas.registrar_error("reproduccion", e)
+
+    def _siguiente_ciclo(self, keywords):
+        # Lee capturas hasta cerrar un ciclo de estas keywords (guardando los de otras)
+        while not self.completos.get(keywords) and not self.agotado:
+            meta, linea = next(self.lineas, (None, None))
+            if meta is None:
+                self.agotado = True
+                for k, paginas in self.abiertos.items():
+                    self.completos.setdefault(k, deque()).append(paginas)
+                self.abiertos = {}
+                break
+            k, start = meta.get("keywords"), meta.get("start", 0)
+            if start in self.abiertos.get(k, {}):
+                self.completos.setdefault(k, deque()).append(self.abiertos.pop(k))
+            self.abiertos.setdefault(k, {})[start] = (meta.get("ts"), linea)
+        pendientes = self.completos.get(keywords)
+        return pendientes.popleft() if pendientes else None
+
+    def get(self, url, params=None, **kwargs):
+        params = params or {}
+        keywords, start = params.get("keywords"), int(params.get("start") or 0)
+        with self.lock:
+            actual = self.actuales.get(keywords)
+            if actual is None or start in actual[1]:
+                paginas = self._siguiente_ciclo(keywords)
+                actual = self.actuales[keywords] = (paginas or {}, set())
+                if paginas is None: print(f"[*] Reproducción: no quedan ciclos capturados de '{keywords}'")
+            actual[1].add(start)
+            ts, cuerpo = actual[0].get(start, (None, None))
+            if ts is not None and self.ts_inicial is None:
+                self.ts_inicial, self.inicio = ts, time.monotonic()
+        if cuerpo is None:
+            REPRODUCIDAS.inc(resultado="vacia")
+            return RespuestaReproducida(url, PAGINA_VACIA)
+        if self.velocidad > 0:
+            # Mismo desfase respecto a la primera página que en la captura, acelerado
+            espera = self.inicio + (ts - self.ts_inicial) / self.velocidad - time.monotonic()
+            if espera > 0: time.sleep(espera)
+        REPRODUCIDAS.inc(resultado="ok")
+        return RespuestaReproducida(url, cuerpo)
+
+    def close(self): pass
+
+# ==============================================================================
+# ACTIVACIÓN
+# ==============================================================================
+
+_capturador = None
+
+def reproduciendo():
+    return bool(DIRECTORIO_REPRODUCCION)
+
+def directorio_datos():
+    # None = los datos de siempre (../ingestion). Se exporta para que lo hereden los procesos hijos.
+    if DIRECTORIO_REPRODUCCION and not os.environ.get("WALLAPOP_DATOS"):
+        os.environ["WALLAPOP_DATOS"] = tempfile.mkdtemp(prefix="wallapop-reproduccion-")
+        print(f"[*] Reproducción: datos en {os.environ['WALLAPOP_DATOS']} (--datos para elegir otro directorio)")
+    return os.environ.get("WALLAPOP_DATOS") or None
+
+def configurar(captura=None, reproducir=None, velocidad=None, datos=None):
+    # Equivale a las variables de entorno (y las exporta para los procesos hijos)
+    global DIRECTORIO_CAPTURA, DIRECTORIO_REPRODUCCION, VELOCIDAD
+    if datos:
+        os.environ["WALLAPOP_DATOS"] = os.path.abspath(datos)
+        os.makedirs(os.environ["WALLAPOP_DATOS"], exist_ok=True)
+    if captura: DIRECTORIO_CAPTURA = os.environ["WALLAPOP_CAPTURA"] = os.path.abspath(captura)
+    if reproducir: DIRECTORIO_REPRODUCCION = os.environ["WALLAPOP_REPRODUCIR"] = os.path.abspath(reproducir)
+    if velocidad is not None:
+        VELOCIDAD = velocidad
+        os.environ["WALLAPOP_VELOCIDAD"] = str(velocidad)
+
+def preparar_sesion(sesion):
+    # Llamado por crear_sesion_wallapop: añade el hook de captura o devuelve la sesión de reproducción
+    global _capturador
+    if DIRECTORIO_REPRODUCCION:
+        sesion.close()
+        return SesionReproduccion(DIRECTORIO_REPRODUCCION, VELOCIDAD)
+    if DIRECTORIO_CAPTURA:
+        if _capturador is None: _capturador = Capturador(DIRECTORIO_CAPTURA)
+        sesion.hooks["response"].append(_capturador.registrar)
+    return sesion
+
+def resumen(directorio):
+    from descarga_concurrente import extraer_items
+    paginas = Counter()
+    items = Counter()
+    for ruta in archivos_captura(directorio):
+        hora = os.path.relpath(ruta, directorio)[:-len(".jsonl.gz")]
+        try:
+            with gzip.open(ruta, "rb") as f:
+                for linea in f:
+                    paginas[hora] += 1
+                    items[hora] += len(extraer_items(json.loads(linea)))
+        except (OSError, EOFError, ValueError) as e:
+            print(f"[!] {ruta}: {e}")
+    for hora in sorted(paginas):
+        print(f"    {hora}  {paginas[hora]:>6} páginas  {items[hora]:>8} items")
+    print(f"[*] Total: {sum(paginas.values())} páginas, {sum(items.values())} items")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumen de capturas de la API de búsqueda")
+    parser.add_argument("directorio")
+    args = parser.parse_args()
+    resumen(args.directorio)
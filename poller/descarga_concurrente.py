@@ -0,0 +1,129 @@
+import requests
+import threading
+import time
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import metricas
+import capturas
+
+# --- CONFIGURACIÓN ---
+CONCURRENCIA = 4               # Páginas en vuelo a la vez
+PETICIONES_POR_SEGUNDO = 4.0   # Ritmo sostenido permitido contra la API
+RAFAGA = 4                     # Tokens acumulables (picos cortos)
+MAX_REINTENTOS = 4
+BACKOFF_BASE = 0.5             # segundos
+BACKOFF_MAX = 8.0
+TIMEOUT = 10
+ITEMS_POR_PAGINA = 40
+# Fracción de IDs de una página ya vistos en el ciclo anterior a partir de la cual paramos
+UMBRAL_SOLAPAMIENTO = 0.25
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+PAGINAS = metricas.contador("paginas_total", "Páginas de búsqueda descargadas", ("resultado",))
+REINTENTOS = metricas.contador("http_reintentos_total", "Reintentos contra la API de Wallapop", ("motivo",))
+PARADAS = metricas.contador("descarga_paradas_total", "Motivo de parada de la descarga paginada", ("motivo",))
+ESPERA_LIMITADOR = metricas.histograma("limitador_espera_segundos", "Espera en el token bucket antes de cada petición")
+
+class ErrorReintentable(Exception):
+    pass
+
+class LimitadorTokens:
+    # Token bucket compartido entre hilos: 'tasa' tokens/s con capacidad 'capacidad'
+    def __init__(self, tasa=PETICIONES_POR_SEGUNDO, capacidad=RAFAGA):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.ultimo = time.monotonic()
+        self.lock = threading.Lock()
+        # Reproduciendo capturas el ritmo lo marcan los tiempos originales (y la velocidad)
+        self.sin_limite = capturas.reproduciendo()
+
+    def adquirir(self):
+        if self.sin_limite: return
+        while True:
+            with self.lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.tasa
+            time.sleep(espera)
+
+def crear_sesion_wallapop(headers, pool=CONCURRENCIA):
+    # Sesión keep-alive compartida por todos los hilos de descarga
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+    sesion.mount("https://", adaptador)
+    sesion.mount("http://", adaptador)
+    sesion.headers.update(headers)
+    return capturas.preparar_sesion(sesion)
+
+def extraer_items(respuesta_json):
+    return respuesta_json.get("data", {}).get("section", {}).get("payload", {}).get("items", [])
+
+def descargar_pagina(sesion, url, params, limitador):
+    # Reintenta con backoff exponencial y jitter completo; lanza la última excepción si se agotan
+    for intento in range(MAX_REINTENTOS + 1):
+        with ESPERA_LIMITADOR.medir():
+            limitador.adquirir()
+        try:
+            with metricas.LATENCIA_HTTP.medir(destino="wallapop"):
+                r = sesion.get(url, params=params, timeout=TIMEOUT)
+            metricas.RESPUESTAS_HTTP.inc(destino="wallapop", codigo=r.status_code)
+            if r.status_code in ESTADOS_REINTENTABLES:
+                raise ErrorReintentable(f"HTTP {r.status_code}")
+            r.raise_for_status()
+            items = extraer_items(r.json())
+            PAGINAS.inc(resultado="ok" if items else "vacia")
+            return items
+        except (requests.RequestException, ValueError, ErrorReintentable) as e:
+            REINTENTOS.inc(motivo=str(e) if isinstance(e, ErrorReintentable) else type(e).__name__)
+            if intento == MAX_REINTENTOS:
+                PAGINAS.inc(resultado="error")
+                raise
+            espera = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** intento)))
+            print(f"[!] Página start={params.get('start')} falló ({e}). Reintento en {espera:.1f}s")
+            time.sleep(espera)
+
+def buscar_items_concurrente(construir_params, num_paginas, url, sesion, limitador,
+                             concurrencia=CONCURRENCIA, ids_previos=None):
+    # Mantiene hasta 'concurrencia' páginas en vuelo y las consume en orden.
+    # Devuelve (items, motivo_parada). Motivos: "limite", "pagina_vacia", "solapamiento", "error".
+    ids_previos = ids_previos or set()
+    items = []
+    motivo = "limite"
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        en_vuelo = deque()
+        siguiente = 0
+        while siguiente < num_paginas and len(en_vuelo) < concurrencia:
+            en_vuelo.append((siguiente, pool.submit(descargar_pagina, sesion, url, construir_params(siguiente), limitador)))
+            siguiente += 1
+
+        while en_vuelo:
+            i, futuro = en_vuelo.popleft()
+            try:
+                pagina = futuro.result()
+            except Exception as e:
+                print(f"[!] Página {i} descartada tras {MAX_REINTENTOS} reintentos: {e}")
+                motivo = "error"
+                break
+            if not pagina:
+                motivo = "pagina_vacia"
+                break
+            items.extend(pagina)
+            # Orden 'newest': en cuanto reaparecen IDs del ciclo anterior, lo demás ya lo tenemos
+            repetidos = sum(1 for it in pagina if it.get("id") in ids_previos)
+            if repetidos / len(pagina) >= UMBRAL_SOLAPAMIENTO:
+                motivo = "solapamiento"
+                break
+            if siguiente < num_paginas:
+                en_vuelo.append((siguiente, pool.submit(descargar_pagina, sesion, url, construir_params(siguiente), limitador)))
+                siguiente += 1
+
+        for _, futuro in en_vuelo: futuro.cancel()
+    PARADAS.inc(motivo=motivo)
+    return items, motivo
@@ -0,0 +1,109 @@
+import argparse
+import re
+import unicodedata
+
+# Detector de keywords en una sola pasada por documento.
+# Todas las listas (excluidas, críticas, sospechosas...) se compilan en una única
+# expresión regular construida a partir de un trie, con límites de palabra y sin
+# tildes, así que el coste por texto no crece linealmente con el número de keywords.
+# Las categorías en 'con_plural' aceptan además el plural ("funda" -> "fundas",
+# "cargador" -> "cargadores"), como hacía la búsqueda por subcadena que sustituyó.
+
+def normalizar(texto):
+    # Minúsculas y sin tildes/diacríticos ("Envío" -> "envio", "réplica" -> "replica")
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def _regex_trie(palabras):
+    # Convierte una lista de palabras en una regex con prefijos compartidos:
+    # ["bizum", "bloqueo"] -> "b(?:izum|loqueo)"
+    trie = {}
+    for palabra in palabras:
+        nodo = trie
+        for c in palabra:
+            nodo = nodo.setdefault(c, {})
+        nodo[""] = {}
+
+    def construir(nodo):
+        fin = "" in nodo
+        ramas = [re.escape(c) + construir(hijo) for c, hijo in sorted(nodo.items()) if c != ""]
+        if not ramas: return ""
+        if len(ramas) == 1 and not fin: return ramas[0]
+        # Las ramas largas van antes que el "fin de palabra" para quedarnos con la coincidencia más larga
+        return "(?:" + "|".join(ramas) + ")" + ("?" if fin else "")
+
+    return construir(trie)
+
+class DetectorKeywords:
+    def __init__(self, categorias, con_plural=()):
+        # categorias: {"criticas": ["bizum", ...], "sospechosas": [...], ...}
+        # Si una keyword aparece en varias listas cuenta para la primera.
+        self.forma_a_keyword = {}
+        for categoria, keywords in categorias.items():
+            for kw in keywords:
+                self.forma_a_keyword.setdefault(normalizar(kw), (categoria, kw))
+        self.categorias = list(categorias)
+        exactas = [f for f, (cat, _) in self.forma_a_keyword.items() if cat not in con_plural]
+        plurales = [f for f, (cat, _) in self.forma_a_keyword.items() if cat in con_plural]
+        alternativas = []
+        if exactas: alternativas.append("(" + _regex_trie(exactas) + r")(?!\w)")
+        if plurales: alternativas.append("(" + _regex_trie(plurales) + r")(?:e?s)?(?!\w)")
+        # Lookahead para que keywords solapadas ("solo envío" / "envío incluido") se detecten todas
+        self.regex = re.compile(r"(?=(?<!\w)(?:" + "|".join(alternativas) + "))")
+
+    def coincidencias(self, texto):
+        # Lista de (posición, categoría, keyword original) sobre el texto normalizado
+        resultado = []
+        for m in self.regex.finditer(texto):
+            categoria, kw = self.forma_a_keyword[m.group(m.lastindex)]
+            resultado.append((m.start(), categoria, kw))
+        return resultado
+
+    def buscar(self, texto):
+        # {categoria: [keywords sin repetir, en orden de aparición]}
+        return self._agrupar(self.coincidencias(normalizar(texto)))
+
+    def analizar(self, titulo, descripcion=""):
+        # Una sola pasada sobre "título descripción".
+        # Devuelve ({categoria: [keywords]}, {categorias que aparecen en el título})
+        titulo_n = normalizar(titulo)
+        hits = self.coincidencias(titulo_n + " " + normalizar(descripcion))
+        en_titulo = {cat for pos, cat, _ in hits if pos < len(titulo_n)}
+        return self._agrupar(hits), en_titulo
+
+    def _agrupar(self, hits):
+        agrupadas = {}
+        for _, categoria, kw in hits:
+            lista = agrupadas.setdefault(categoria, [])
+            if kw not in lista: lista.append(kw)
+        return agrupadas
+
+def verificar():
+    # Casos que deben seguir funcionando: plurales de exclusiones y keywords exactas
+    detector = DetectorKeywords({"excluidas": ["funda", "cable", "cargador", "caja vacía"],
+                                 "criticas": ["bizum", "envío incluido"]}, con_plural=("excluidas",))
+    casos = [
+        ("Fundas para iPhone 13", {"excluidas": ["funda"]}),
+        ("pack 2 cables usb-c", {"excluidas": ["cable"]}),
+        ("Cargadores originales", {"excluidas": ["cargador"]}),
+        ("Caja vacía iPhone", {"excluidas": ["caja vacía"]}),
+        ("iPhone 12, pago por Bizum, envío incluido", {"criticas": ["bizum", "envío incluido"]}),
+        ("bizumes y cablear", {}),
+        ("fundador de la tienda", {}),
+    ]
+    fallos = 0
+    for texto, esperado in casos:
+        obtenido = detector.buscar(texto)
+        if obtenido != esperado:
+            fallos += 1
+            print(f"[!] '{texto}': {obtenido} (esperado {esperado})")
+    print(f"[*] {len(casos) - fallos}/{len(casos)} casos correctos")
+    return fallos == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detector de keywords en una pasada")
+    parser.add_argument("--verificar", action="store_true", help="Comprueba los casos de exclusión y keywords exactas")
+    args = parser.parse_args()
+    if args.verificar:
+        raise SystemExit(0 if verificar() else 1)
+    parser.print_help()
@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import zlib
+
+import numpy as np
+
+# Detección de anuncios casi duplicados (reposts con ID nuevo y texto retocado, o la misma
+# plantilla copiada entre vendedores) con MinHash + LSH:
+#  - Firma MinHash de NUM_PERMUTACIONES valores sobre shingles de palabras de título + descripción.
+#  - LSH: la firma se parte en BANDAS de FILAS valores; dos anuncios son candidatos si coinciden
+#    en alguna banda entera. Las claves de banda viven en SQLite ordenadas por clave (WITHOUT ROWID),
+#    así que cada cubeta se lee seguida, sin saltos a la tabla. Una cubeta admite como mucho
+#    MAX_POR_CUBETA anuncios (las plantillas muy repetidas no la hacen crecer sin límite) y de los
+#    candidatos solo se comparan los MAX_CANDIDATOS que coinciden en más bandas.
+#  - Los candidatos se confirman comparando firmas (estimación de Jaccard) y el anuncio se une
+#    al cluster del más parecido.
+# El trabajo por anuncio está acotado (BANDAS x MAX_POR_CUBETA filas, MAX_CANDIDATOS firmas), pero
+# no es constante: cada consulta baja por un B-tree que crece con el histórico y, cuando el índice
+# ya no cabe en CACHE_SQLITE_MB, paga lecturas fuera de la caché (etapa 'duplicados' de
+# benchmarks/bench_pipeline.py: ~8.7k items/s con 10k y ~4.4k/s con 1M).
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_DUPLICADOS = "duplicados.db"
+TAM_SHINGLE = 3                 # palabras por shingle
+MIN_SHINGLES = 8                # textos más cortos no se comparan (demasiados falsos positivos)
+NUM_PERMUTACIONES = 64
+BANDAS = 16
+FILAS = NUM_PERMUTACIONES // BANDAS     # umbral LSH aprox. (1/BANDAS)^(1/FILAS) = 0.5
+UMBRAL_SIMILITUD = 0.7          # Jaccard estimado mínimo para considerarlo el mismo anuncio
+MAX_CANDIDATOS = 8              # firmas comparadas por anuncio (las que más bandas comparten)
+MAX_POR_CUBETA = 16             # anuncios por clave de banda; una cubeta llena no admite más
+PRIMO = 4294967291              # mayor primo de 32 bits
+CACHE_SQLITE_MB = 64            # con la caché por defecto (2 MB) el coste por anuncio crece con el índice
+
+_rng = np.random.RandomState(20240601)     # semilla fija: las firmas tienen que ser estables
+_A = _rng.randint(1, PRIMO, NUM_PERMUTACIONES).astype(np.uint64)
+_B = _rng.randint(0, PRIMO, NUM_PERMUTACIONES).astype(np.uint64)
+_PALABRA = re.compile(r"\w+")
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def shingles(titulo, descripcion):
+    palabras = _PALABRA.findall(normalizar(f"{titulo or ''} {descripcion or ''}"))
+    return {" ".join(palabras[i:i + TAM_SHINGLE]) for i in range(len(palabras) - TAM_SHINGLE + 1)}
+
+def firma_minhash(conjunto):
+    # min_s (a*h(s) + b) mod PRIMO para cada permutación; h = crc32 (estable entre ejecuciones)
+    h = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in conjunto), dtype=np.uint64, count=len(conjunto))
+    return ((np.outer(h, _A) + _B) % PRIMO).min(axis=0).astype(np.uint32)
+
+def claves_banda(firma):
+    # Una clave entera por banda (incluye el nº de banda para no mezclar bandas distintas)
+    claves = []
+    for b in range(BANDAS):
+        datos = bytes([b]) + firma[b * FILAS:(b + 1) * FILAS].tobytes()
+        claves.append(int.from_bytes(hashlib.blake2b(datos, digest_size=8).digest(), "big", signed=True))
+    return claves
+
+class IndiceDuplicados:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(ruta, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute(f"PRAGMA cache_size=-{CACHE_SQLITE_MB * 1024}")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS firmas (
+            id TEXT PRIMARY KEY, firma BLOB, user_id TEXT, cluster TEXT) WITHOUT ROWID""")
+        fila = self.con.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bandas'").fetchone()
+        antigua = fila is not None and "WITHOUT ROWID" not in fila[0]
+        if antigua:
+            # Índices de versiones anteriores (tabla con rowid + índice por clave): se reordenan por clave
+            self.con.execute("ALTER TABLE bandas RENAME TO bandas_antigua")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS bandas (
+            clave INTEGER, id TEXT, PRIMARY KEY (clave, id)) WITHOUT ROWID""")
+        if antigua:
+            self.con.execute("INSERT OR IGNORE INTO bandas SELECT clave, id FROM bandas_antigua")
+            self.con.execute("DROP TABLE bandas_antigua")
+        # Tamaño y vendedores por cluster, mantenidos al insertar (contarlos sería O(tamaño del cluster))
+        self.con.execute("""CREATE TABLE IF NOT EXISTS clusters (
+            cluster TEXT PRIMARY KEY, tamano INTEGER, vendedores INTEGER) WITHOUT ROWID""")
+        self.con.execute("""CREATE TABLE IF NOT EXISTS cluster_vendedores (
+            cluster TEXT, user_id TEXT, PRIMARY KEY (cluster, user_id)) WITHOUT ROWID""")
+        self.con.commit()
+
+    def analizar(self, item):
+        # Indexa el anuncio (si no lo estaba) y devuelve su cluster de casi duplicados:
+        # {"cluster_id", "cluster_size", "sellers", "similarity"} o None si no se parece a nada.
+        id_item = item.get("id")
+        conjunto = shingles(item.get("title"), item.get("description"))
+        if id_item is None or len(conjunto) < MIN_SHINGLES: return None
+        firma = firma_minhash(conjunto)
+        claves = claves_banda(firma)
+
+        with self.lock:
+            fila = self.con.execute("SELECT cluster FROM firmas WHERE id = ?", (id_item,)).fetchone()
+            if fila:
+                cluster = fila[0]
+                mejor = None
+            else:
+                marcas = ",".join("?" * len(claves))
+                llenas = {c for (c,) in self.con.execute(f"""SELECT clave FROM bandas WHERE clave IN ({marcas})
+                    GROUP BY clave HAVING COUNT(*) >= ?""", claves + [MAX_POR_CUBETA])}
+                # Los candidatos que comparten más bandas son los más parecidos (P(banda) = J^FILAS)
+                candidatos = self.con.execute(f"""SELECT firma, cluster FROM firmas JOIN
+                    (SELECT id, COUNT(*) AS n FROM bandas WHERE clave IN ({marcas}) GROUP BY id ORDER BY n DESC LIMIT ?)
+                    USING (id)""", claves + [MAX_CANDIDATOS]).fetchall()
+                mejor, cluster = 0.0, id_item
+                if candidatos:
+                    # Todas las firmas candidatas de una vez: matriz (candidatos x NUM_PERMUTACIONES)
+                    firmas = np.frombuffer(b"".join(c[0] for c in candidatos), dtype=np.uint32).reshape(len(candidatos), -1)
+                    similitudes = (firmas == firma).mean(axis=1)
+                    i = int(similitudes.argmax())
+                    if similitudes[i] >= UMBRAL_SIMILITUD:
+                        mejor, cluster = float(similitudes[i]), candidatos[i][1]
+                self.con.execute("INSERT INTO firmas (id, firma, user_id, cluster) VALUES (?, ?, ?, ?)",
+                                 (id_item, firma.tobytes(), item.get("user_id"), cluster))
+                self.con.executemany("INSERT OR IGNORE INTO bandas (clave, id) VALUES (?, ?)",
+                                     [(c, id_item) for c in claves if c not in llenas])
+                vendedor_nuevo = self.con.execute("INSERT OR IGNORE INTO cluster_vendedores VALUES (?, ?)",
+                                                  (cluster, item.get("user_id") or "")).rowcount
+                self.con.execute("""INSERT INTO clusters (cluster, tamano, vendedores) VALUES (?, 1, 1)
+                    ON CONFLICT (cluster) DO UPDATE SET tamano = tamano + 1, vendedores = vendedores + ?""",
+                                 (cluster, vendedor_nuevo))
+            tamano, vendedores = self.con.execute(
+                "SELECT tamano, vendedores FROM clusters WHERE cluster = ?", (cluster,)).fetchone()
+
+        if tamano < 2: return None
+        resultado = {"cluster_id": cluster, "cluster_size": tamano, "sellers": vendedores}
+        if mejor: resultado["similarity"] = round(mejor, 2)
+        return resultado
+
+    def clusters(self, n=20):
+        with self.lock:
+            return self.con.execute("""SELECT cluster, tamano, vendedores FROM clusters
+                WHERE tamano > 1 ORDER BY tamano DESC LIMIT ?""", (n,)).fetchall()
+
+    def commit(self):
+        with self.lock:
+            self.con.commit()
+
+    def cerrar(self):
+        with self.lock:
+            self.con.commit()
+            self.con.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice MinHash/LSH de anuncios casi duplicados")
+    parser.add_argument("--maestro", default=os.path.join("..", "ingestion", "wallapop_master.json"))
+    parser.add_argument("--indexar", action="store_true", help="Añade al índice todos los anuncios del maestro")
+    parser.add_argument("-n", type=int, default=10, help="Clusters a mostrar")
+    args = parser.parse_args()
+
+    ruta = os.path.join(os.path.dirname(os.path.abspath(args.maestro)), ARCHIVO_DUPLICADOS)
+    indice = IndiceDuplicados(ruta)
+    if args.indexar:
+        total = 0
+        with open(args.maestro, "r", encoding="utf-8") as f:
+            for linea in f:
+                if not linea.strip(): continue
+                try:
+                    doc = json.loads(linea)
+                except ValueError:
+                    continue
+                indice.analizar(doc)
+                total += 1
+        indice.commit()
+        print(f"[*] {total} anuncios indexados en {ruta}")
+    for cluster, tamano, vendedores in indice.clusters(args.n):
+        print(f"    {tamano:>4} anuncios | {vendedores:>3} vendedores | cluster {cluster}")
+    indice.cerrar()
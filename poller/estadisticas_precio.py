@@ -0,0 +1,167 @@
+import json
+import math
+import os
+import threading
+import time
+
+# Estadísticas de precio por modelo, actualizadas de forma incremental (O(1) por item)
+# y con memoria acotada:
+#  - Cuantiles con un sketch logarítmico (tipo DDSketch): error relativo fijo y fusionable.
+#  - Ventanas deslizantes: un sketch por bucket de tiempo; solo se guardan los de la ventana más larga.
+#  - Medias EWMA con semivida en tiempo real (no en nº de muestras).
+
+# --- CONFIGURACIÓN ---
+ARCHIVO_ESTADISTICAS = "estadisticas_precios.json"
+PRECISION_RELATIVA = 0.02        # error relativo máximo de los cuantiles
+DURACION_BUCKET = 6 * 3600       # segundos por bucket de tiempo
+VENTANAS = {"24h": 24 * 3600, "7d": 7 * 24 * 3600}
+SEMIVIDAS_EWMA = {"24h": 24 * 3600, "7d": 7 * 24 * 3600}
+PRECIO_MINIMO = 10               # por debajo es ruido ("0€", "1€ y hablamos")
+MIN_MUESTRAS = 20                # muestras mínimas en la ventana para usarla como referencia
+
+_GAMMA = (1 + PRECISION_RELATIVA) / (1 - PRECISION_RELATIVA)
+_LOG_GAMMA = math.log(_GAMMA)
+
+class SketchCuantiles:
+    def __init__(self, bins=None):
+        self.bins = bins or {}   # índice logarítmico -> nº de observaciones
+        self.n = sum(self.bins.values())
+
+    def anadir(self, valor):
+        i = math.ceil(math.log(valor) / _LOG_GAMMA)
+        self.bins[i] = self.bins.get(i, 0) + 1
+        self.n += 1
+
+    def fusionar(self, otro):
+        for i, c in otro.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + c
+        self.n += otro.n
+
+    def cuantil(self, q):
+        if self.n == 0: return None
+        objetivo = q * (self.n - 1)
+        acumulado = 0
+        for i in sorted(self.bins):
+            acumulado += self.bins[i]
+            if acumulado > objetivo:
+                # Centro del bin: garantiza el error relativo PRECISION_RELATIVA
+                return 2 * _GAMMA ** i / (_GAMMA + 1)
+        return 2 * _GAMMA ** max(self.bins) / (_GAMMA + 1)
+
+class EstadisticasModelo:
+    def __init__(self):
+        self.buckets = {}   # inicio del bucket (epoch) -> SketchCuantiles
+        self.ewma = {}      # nombre -> [valor, ts de la última actualización]
+
+    def actualizar(self, precio, ts):
+        inicio = int(ts // DURACION_BUCKET * DURACION_BUCKET)
+        self.buckets.setdefault(inicio, SketchCuantiles()).anadir(precio)
+        # Descartar buckets fuera de la ventana más larga
+        limite = ts - max(VENTANAS.values()) - DURACION_BUCKET
+        for b in [b for b in self.buckets if b < limite]:
+            del self.buckets[b]
+
+        for nombre, semivida in SEMIVIDAS_EWMA.items():
+            if nombre not in self.ewma:
+                self.ewma[nombre] = [precio, ts]
+                continue
+            valor, ultimo = self.ewma[nombre]
+            peso = 0.5 ** (max(0.0, ts - ultimo) / semivida)
+            self.ewma[nombre] = [peso * valor + (1 - peso) * precio, max(ts, ultimo)]
+
+    def sketch_ventana(self, ventana, ahora):
+        desde = ahora - VENTANAS[ventana]
+        total = SketchCuantiles()
+        for inicio, sketch in self.buckets.items():
+            if inicio + DURACION_BUCKET > desde:
+                total.fusionar(sketch)
+        return total
+
+class ConsultaMercado:
+    def __init__(self, estadisticas, ventana, ahora):
+        self.estadisticas = estadisticas
+        self.ventana = ventana
+        self.ahora = ahora
+        self.cache = {}
+
+    def get(self, modelo, defecto=None):
+        if modelo not in self.cache:
+            self.cache[modelo] = self.estadisticas.referencia_mercado(modelo, self.ventana, self.ahora)
+        valor = self.cache[modelo]
+        return defecto if valor is None else valor
+
+class EstadisticasPrecios:
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.modelos = {}
+        self.lock = threading.Lock()
+
+    def actualizar(self, modelo, precio, ts=None):
+        if not modelo or not precio or precio < PRECIO_MINIMO: return
+        with self.lock:
+            self.modelos.setdefault(modelo, EstadisticasModelo()).actualizar(float(precio), ts or time.time())
+
+    def cuantil(self, modelo, q, ventana="7d", ahora=None):
+        with self.lock:
+            est = self.modelos.get(modelo)
+            if est is None: return None
+            return est.sketch_ventana(ventana, ahora or time.time()).cuantil(q)
+
+    def mediana(self, modelo, ventana="7d", ahora=None):
+        return self.cuantil(modelo, 0.5, ventana, ahora)
+
+    def muestras(self, modelo, ventana="7d", ahora=None):
+        with self.lock:
+            est = self.modelos.get(modelo)
+            return est.sketch_ventana(ventana, ahora or time.time()).n if est else 0
+
+    def media_ewma(self, modelo, nombre="7d"):
+        with self.lock:
+            est = self.modelos.get(modelo)
+            return est.ewma[nombre][0] if est and nombre in est.ewma else None
+
+    def referencia_mercado(self, modelo, ventana="7d", ahora=None):
+        # Mediana de mercado del modelo, solo si la ventana tiene suficientes muestras
+        with self.lock:
+            est = self.modelos.get(modelo)
+            if est is None: return None
+            sketch = est.sketch_ventana(ventana, ahora or time.time())
+            return sketch.cuantil(0.5) if sketch.n >= MIN_MUESTRAS else None
+
+    def consulta(self, ventana="7d", ahora=None):
+        # Vista para el scorer: .get(modelo) -> mediana de mercado o None (memoizada por modelo)
+        return ConsultaMercado(self, ventana, ahora or time.time())
+
+    # --- Persistencia ---
+    def guardar(self, ruta=None):
+        ruta = ruta or self.ruta
+        with self.lock:
+            datos = {
+                modelo: {
+                    "buckets": {str(b): {str(i): c for i, c in s.bins.items()} for b, s in est.buckets.items()},
+                    "ewma": est.ewma
+                }
+                for modelo, est in self.modelos.items()
+            }
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        estadisticas = cls(ruta)
+        if not os.path.exists(ruta): return estadisticas
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            print(f"[!] No se pudo leer {ruta}. Se empieza con estadísticas vacías.")
+            return estadisticas
+        for modelo, d in datos.items():
+            est = EstadisticasModelo()
+            est.buckets = {int(b): SketchCuantiles({int(i): c for i, c in bins.items()})
+                           for b, bins in d.get("buckets", {}).items()}
+            est.ewma = d.get("ewma", {})
+            estadisticas.modelos[modelo] = est
+        return estadisticas
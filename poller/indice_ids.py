@@ -0,0 +1,190 @@
+import sqlite3
+import json
+import os
+import threading
+import argparse
+import archivo_columnar
+
+# --- CONFIGURACIÓN ---
+# Índice persistente de IDs ya guardados en el maestro (SQLite, sin cargar nada en memoria).
+# Se actualiza en cada append y se pone al día leyendo solo la cola nueva del maestro.
+ARCHIVO_INDICE = "wallapop_ids.db"
+TAM_LOTE_INSERT = 5000
+
+class IndiceIds:
+    def __init__(self, ruta_maestro, ruta_indice=None, solo_lectura=False):
+        self.ruta_maestro = ruta_maestro
+        if ruta_indice is None:
+            ruta_indice = os.path.join(os.path.dirname(os.path.abspath(ruta_maestro)), ARCHIVO_INDICE)
+        self.ruta_indice = ruta_indice
+        self.lock = threading.Lock()
+        if solo_lectura:
+            # Para consultar desde otros procesos (p.ej. el pool de backfill.py) sin sincronizar ni escribir
+            self.con = sqlite3.connect(f"file:{os.path.abspath(ruta_indice)}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.con = sqlite3.connect(ruta_indice, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        # Todos los IDs que ha visto el poller, también los descartados por filtro o umbral
+        self.con.execute("CREATE TABLE IF NOT EXISTS vistos (id TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)")
+        self.con.commit()
+        self.sincronizar()
+
+    # --- Interfaz tipo set (para usarlo donde antes había un set de IDs) ---
+    def __contains__(self, id_item):
+        if id_item is None: return False
+        with self.lock:
+            return self.con.execute("SELECT 1 FROM ids WHERE id = ?", (id_item,)).fetchone() is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.con.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def add(self, id_item):
+        if id_item is None: return
+        with self.lock:
+            self.con.execute("INSERT OR IGNORE INTO ids (id) VALUES (?)", (id_item,))
+
+    def filtrar_nuevos(self, ids):
+        # Devuelve los IDs que aún no están en el índice (una consulta por bloque)
+        ids = [i for i in dict.fromkeys(ids) if i is not None]
+        vistos = set()
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                bloque = ids[i:i + 500]
+                marcas = ",".join("?" * len(bloque))
+                vistos.update(r[0] for r in self.con.execute(f"SELECT id FROM ids WHERE id IN ({marcas})", bloque))
+        return [i for i in ids if i not in vistos]
+
+    def registrar_vistos(self, ids):
+        # Marca los IDs como vistos y devuelve los que se ven por primera vez
+        # (para alimentar estadísticas sin contar dos veces el mismo anuncio)
+        ids = [i for i in dict.fromkeys(ids) if i is not None]
+        nuevos = []
+        with self.lock:
+            for id_item in ids:
+                cur = self.con.execute("INSERT OR IGNORE INTO vistos (id) VALUES (?)", (id_item,))
+                if cur.rowcount: nuevos.append(id_item)
+        return nuevos
+
+    def commit(self):
+        with self.lock:
+            self.con.commit()
+
+    def rollback(self):
+        # Descarta lo añadido desde el último commit
+        with self.lock:
+            self.con.rollback()
+
+    def cerrar(self):
+        with self.lock:
+            self.con.commit()
+            self.con.close()
+
+    # --- Sincronización con el archivo maestro ---
+    def _leer_meta(self):
+        filas = dict(self.con.execute("SELECT clave, valor FROM meta"))
+        return {k: json.loads(v) for k, v in filas.items()}
+
+    def _guardar_meta(self, offset):
+        st = os.stat(self.ruta_maestro)
+        valores = {"offset": offset, "inode": st.st_ino, "dispositivo": st.st_dev}
+        self.con.executemany("INSERT OR REPLACE INTO meta (clave, valor) VALUES (?, ?)",
+                             [(k, json.dumps(v)) for k, v in valores.items()])
+
+    def _indexar_desde(self, desde):
+        # Lee el maestro desde 'desde' y añade sus IDs. Devuelve el offset final (solo líneas completas).
+        offset = desde
+        lote = []
+        with open(self.ruta_maestro, "rb") as f:
+            f.seek(desde)
+            for linea in f:
+                if not linea.endswith(b"\n"): break
+                offset += len(linea)
+                if not linea.strip(): continue
+                try:
+                    doc = json.loads(linea)
+                except ValueError:
+                    continue
+                if "id" in doc: lote.append((doc["id"],))
+                if len(lote) >= TAM_LOTE_INSERT:
+                    self.con.executemany("INSERT OR IGNORE INTO ids (id) VALUES (?)", lote)
+                    lote = []
+        if lote:
+            self.con.executemany("INSERT OR IGNORE INTO ids (id) VALUES (?)", lote)
+        return offset
+
+    def sincronizar(self):
+        # Pone el índice al día con lo que se haya escrito en el maestro desde la última vez.
+        # Si el maestro ha rotado o se ha truncado se relee entero (los IDs antiguos se conservan).
+        if not os.path.exists(self.ruta_maestro): return 0
+        with self.lock:
+            meta = self._leer_meta()
+            st = os.stat(self.ruta_maestro)
+            desde = meta.get("offset", 0)
+            if meta.get("inode") != st.st_ino or meta.get("dispositivo") != st.st_dev or st.st_size < desde:
+                desde = 0
+            if desde == st.st_size: return 0
+            offset = self._indexar_desde(desde)
+            self._guardar_meta(offset)
+            self.con.commit()
+            return offset - desde
+
+    def marcar_sincronizado(self, offset):
+        # Llamar tras añadir al índice todo lo que se ha escrito en el maestro hasta 'offset'
+        with self.lock:
+            self._guardar_meta(offset)
+            self.con.commit()
+
+    def reconstruir(self):
+        # Borra el índice y lo regenera desde cero a partir del maestro
+        with self.lock:
+            self.con.execute("DELETE FROM ids")
+            self.con.execute("DELETE FROM meta")
+            offset = self._indexar_desde(0) if os.path.exists(self.ruta_maestro) else 0
+            if offset: self._guardar_meta(offset)
+            # Los días ya enrollados en el archivo columnar (solo se lee la columna id)
+            directorio = archivo_columnar.directorio_archivo(self.ruta_maestro)
+            ids = ((doc["id"],) for doc in archivo_columnar.escanear(directorio, ["id"]) if "id" in doc)
+            self.con.executemany("INSERT OR IGNORE INTO ids (id) VALUES (?)", ids)
+            self.con.commit()
+
+    def verificar(self):
+        # Cuenta los IDs del maestro que faltan en el índice (deriva entre ambos)
+        faltan = 0
+        if not os.path.exists(self.ruta_maestro): return 0
+        with open(self.ruta_maestro, "rb") as f:
+            for linea in f:
+                if not linea.strip(): continue
+                try:
+                    doc = json.loads(linea)
+                except ValueError:
+                    continue
+                if "id" in doc and doc["id"] not in self: faltan += 1
+        return faltan
+
+if __name__ == "__main__":
+    from poller import ruta_archivo_maestro
+
+    parser = argparse.ArgumentParser(description="Índice persistente de IDs del archivo maestro")
+    parser.add_argument("--reconstruir", action="store_true", help="Regenera el índice desde el maestro")
+    parser.add_argument("--verificar", action="store_true", help="Comprueba si índice y maestro están desalineados")
+    parser.add_argument("--maestro", default=None, help="Ruta del archivo maestro")
+    args = parser.parse_args()
+
+    ruta = args.maestro or ruta_archivo_maestro()
+    indice = IndiceIds(ruta)
+    if args.reconstruir:
+        indice.reconstruir()
+        print(f"[*] Índice reconstruido: {len(indice)} IDs")
+    if args.verificar:
+        faltan = indice.verificar()
+        if faltan:
+            print(f"[!] Faltan {faltan} IDs en el índice. Ejecuta con --reconstruir.")
+        else:
+            print(f"[*] Índice sincronizado ({len(indice)} IDs).")
+    if not args.reconstruir and not args.verificar:
+        print(f"[*] {len(indice)} IDs en {indice.ruta_indice}")
+    indice.cerrar()
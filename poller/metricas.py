@@ -0,0 +1,324 @@
+import atexit
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Métricas del pipeline en formato de texto de Prometheus.
+#  - Contadores, indicadores e histogramas con etiquetas, en un registro global por proceso.
+#  - Exportación a textfile (WALLAPOP_METRICAS_DIR/<proceso>.prom, lo recoge el textfile
+#    collector de node_exporter) y/o a un endpoint HTTP local (WALLAPOP_METRICAS_PUERTO).
+#    Los procesos cortos (poller.py, bulk_ingest.py lanzados por monitor.py) acumulan sus
+#    contadores entre ejecuciones en <proceso>.json para que sigan siendo monótonos.
+#  - Profiler de muestreo opcional (WALLAPOP_PERFIL=1): pilas plegadas en <proceso>-<ts>.perfil,
+#    compatibles con flamegraph.pl / speedscope.
+
+# --- CONFIGURACIÓN ---
+DIRECTORIO = os.environ.get("WALLAPOP_METRICAS_DIR")
+PUERTO = int(os.environ.get("WALLAPOP_METRICAS_PUERTO", "0") or 0)
+PERFIL = os.environ.get("WALLAPOP_PERFIL", "0") == "1"
+INTERVALO_PERFIL = 0.005      # segundos entre muestras del profiler
+PREFIJO = "wallapop_"
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_ETAPA = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+BUCKETS_LOTE = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _etiquetas(nombres, valores, extra=None):
+    pares = list(zip(nombres, valores)) + (extra or [])
+    if not pares: return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+def _series(desc, nombre, valores, proceso):
+    # Líneas de exposición de una métrica; cada serie lleva además la etiqueta 'proceso'
+    etiquetas = tuple(desc["etiquetas"]) + ("proceso",)
+    lineas = []
+    for clave, valor in sorted(valores, key=lambda kv: list(kv[0])):
+        clave = tuple(clave) + (proceso,)
+        if desc["tipo"] != "histogram":
+            lineas.append(f"{nombre}{_etiquetas(etiquetas, clave)} {valor}")
+            continue
+        cuentas, suma, n = valor
+        for limite, c in zip(desc["buckets"], cuentas):
+            lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, clave, [('le', limite)])} {c}")
+        lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas, clave, [('le', '+Inf')])} {n}")
+        lineas.append(f"{nombre}_sum{_etiquetas(etiquetas, clave)} {suma}")
+        lineas.append(f"{nombre}_count{_etiquetas(etiquetas, clave)} {n}")
+    return lineas
+
+class Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores = {}
+        self.lock = threading.Lock()
+
+    def _clave(self, etiquetas):
+        return tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+
+    def descripcion(self):
+        return {"tipo": self.tipo, "ayuda": self.ayuda, "etiquetas": list(self.etiquetas)}
+
+class Contador(Metrica):
+    tipo = "counter"
+
+    def inc(self, n=1, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self.lock:
+            self.valores[clave] = self.valores.get(clave, 0) + n
+
+class Indicador(Metrica):
+    tipo = "gauge"
+
+    def set(self, valor, **etiquetas):
+        with self.lock:
+            self.valores[self._clave(etiquetas)] = valor
+
+class Histograma(Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.buckets = tuple(buckets)
+
+    def descripcion(self):
+        return dict(super().descripcion(), buckets=list(self.buckets))
+
+    def observar(self, valor, **etiquetas):
+        clave = self._clave(etiquetas)
+        with self.lock:
+            cuentas, suma, n = self.valores.get(clave) or ([0] * len(self.buckets), 0.0, 0)
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite: cuentas[i] += 1
+            self.valores[clave] = (cuentas, suma + valor, n + 1)
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+class RegistroMetricas:
+    def __init__(self):
+        self.metricas = {}
+        self.previo = {}    # estado acumulado de ejecuciones anteriores (ver iniciar)
+        self.lock = threading.Lock()
+
+    def obtener(self, clase, nombre, ayuda, etiquetas=(), **kwargs):
+        # Devuelve la métrica ya registrada con ese nombre o la crea
+        with self.lock:
+            nueva = nombre not in self.metricas
+            if nueva:
+                self.metricas[nombre] = clase(nombre, ayuda, etiquetas, **kwargs)
+            metrica = self.metricas[nombre]
+        if nueva: self._aplicar_previo(metrica)
+        return metrica
+
+    def estado(self):
+        # {nombre: descripción + valores}, serializable a JSON
+        with self.lock:
+            metricas = list(self.metricas.values())
+        estado = {}
+        for m in metricas:
+            with m.lock:
+                estado[m.nombre] = dict(m.descripcion(), valores=[[list(k), v] for k, v in m.valores.items()])
+        return estado
+
+    def exportar(self, proceso, otros=None):
+        # Texto Prometheus con las métricas propias y, opcionalmente, las de otros procesos
+        # ({proceso: estado}); cada nombre aparece una sola vez con HELP/TYPE.
+        fuentes = [(proceso, self.estado())] + sorted((otros or {}).items())
+        lineas = []
+        for nombre in sorted({n for _, estado in fuentes for n in estado}):
+            desc = next(e[nombre] for _, e in fuentes if nombre in e)
+            series = []
+            for p, estado in fuentes:
+                if nombre in estado: series += _series(estado[nombre], PREFIJO + nombre, estado[nombre]["valores"], p)
+            if not series: continue
+            lineas.append(f"# HELP {PREFIJO + nombre} {desc['ayuda']}")
+            lineas.append(f"# TYPE {PREFIJO + nombre} {desc['tipo']}")
+            lineas.extend(series)
+        return "\n".join(lineas) + "\n"
+
+    # --- Estado acumulado entre ejecuciones (procesos cortos) ---
+    def restaurar(self, estado):
+        self.previo = estado
+        with self.lock:
+            metricas = list(self.metricas.values())
+        for metrica in metricas:
+            self._aplicar_previo(metrica)
+
+    def _aplicar_previo(self, metrica):
+        previo = self.previo.get(metrica.nombre)
+        if not previo or previo.get("tipo") != metrica.tipo: return
+        with metrica.lock:
+            for clave, valor in previo["valores"]:
+                clave = tuple(clave)
+                if metrica.tipo == "counter":
+                    metrica.valores[clave] = metrica.valores.get(clave, 0) + valor
+                elif metrica.tipo == "histogram" and len(valor[0]) == len(metrica.buckets):
+                    cuentas, suma, n = metrica.valores.get(clave) or ([0] * len(metrica.buckets), 0.0, 0)
+                    metrica.valores[clave] = ([a + b for a, b in zip(cuentas, valor[0])], suma + valor[1], n + valor[2])
+
+REGISTRO = RegistroMetricas()
+
+def contador(nombre, ayuda, etiquetas=()):
+    return REGISTRO.obtener(Contador, nombre, ayuda, etiquetas)
+
+def indicador(nombre, ayuda, etiquetas=()):
+    return REGISTRO.obtener(Indicador, nombre, ayuda, etiquetas)
+
+def histograma(nombre, ayuda, etiquetas=(), buckets=BUCKETS_LATENCIA):
+    return REGISTRO.obtener(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+# Métricas comunes a todo el pipeline
+ETAPAS = histograma("etapa_segundos", "Duración de cada etapa del pipeline", ("etapa",), BUCKETS_ETAPA)
+LATENCIA_HTTP = histograma("http_latencia_segundos", "Latencia de las peticiones HTTP", ("destino",))
+RESPUESTAS_HTTP = contador("http_respuestas_total", "Respuestas HTTP por destino y código", ("destino", "codigo"))
+ERRORES = contador("errores_total", "Errores capturados por componente y tipo", ("componente", "tipo"))
+
+def cronometro(etapa):
+    return ETAPAS.medir(etapa=etapa)
+
+def registrar_error(componente, error):
+    ERRORES.inc(componente=componente, tipo=type(error).__name__)
+
+# ==============================================================================
+# EXPORTACIÓN
+# ==============================================================================
+
+_proceso = None
+_profiler = None
+
+def _ruta(extension):
+    return os.path.join(DIRECTORIO, f"{_proceso}.{extension}")
+
+def volcar():
+    # Escribe el textfile (atómico) y el estado acumulado del proceso
+    if not DIRECTORIO or not _proceso: return
+    os.makedirs(DIRECTORIO, exist_ok=True)
+    for ruta, contenido in ((_ruta("prom"), REGISTRO.exportar(_proceso)), (_ruta("json"), json.dumps(REGISTRO.estado()))):
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        os.replace(tmp, ruta)
+
+def exportar_todo():
+    # Métricas propias + las de los otros procesos (poller/bulk_ingest lanzados por monitor)
+    otros = {}
+    if DIRECTORIO and os.path.isdir(DIRECTORIO):
+        for ruta in sorted(glob.glob(os.path.join(DIRECTORIO, "*.json"))):
+            proceso = os.path.basename(ruta)[:-len(".json")]
+            if proceso == _proceso: continue
+            try:
+                with open(ruta, "r", encoding="utf-8") as f:
+                    otros[proceso] = json.load(f)
+            except (OSError, ValueError):
+                continue
+    return REGISTRO.exportar(_proceso or "local", otros)
+
+class _Endpoint(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = exportar_todo().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args): pass
+
+def servir_http(puerto):
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Endpoint)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    print(f"[*] Métricas en http://127.0.0.1:{servidor.server_port}/metrics")
+    return servidor
+
+def iniciar(proceso, http=False):
+    # Llamar una vez desde el __main__ de cada script. 'http' solo en procesos de larga duración.
+    global _proceso, _profiler
+    _proceso = proceso
+    if DIRECTORIO and os.path.exists(_ruta("json")):
+        try:
+            with open(_ruta("json"), "r", encoding="utf-8") as f:
+                REGISTRO.restaurar(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"[!] Estado de métricas ilegible ({e}). Se empieza de cero.")
+    if http and PUERTO: servir_http(PUERTO)
+    if PERFIL:
+        _profiler = ProfilerMuestreo()
+        _profiler.iniciar()
+    atexit.register(finalizar)
+
+def finalizar():
+    global _profiler
+    if _profiler:
+        _profiler.parar()
+        _profiler.guardar(os.path.join(DIRECTORIO or ".", f"{_proceso}-{int(time.time())}.perfil"))
+        _profiler = None
+    volcar()
+
+# ==============================================================================
+# PROFILER DE MUESTREO
+# ==============================================================================
+
+class ProfilerMuestreo:
+    # Cada INTERVALO_PERFIL toma la pila de todos los hilos (salvo el suyo) y cuenta pilas plegadas.
+    # Sin instrumentar nada: el coste es proporcional a la frecuencia de muestreo, no al código.
+    def __init__(self, intervalo=INTERVALO_PERFIL):
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self.parar_evento = threading.Event()
+        self.hilo = None
+
+    def _muestrear(self):
+        propio = threading.get_ident()
+        while not self.parar_evento.wait(self.intervalo):
+            for ident, frame in sys._current_frames().items():
+                if ident == propio: continue
+                pila = []
+                while frame is not None:
+                    codigo = frame.f_code
+                    pila.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+                    frame = frame.f_back
+                self.pilas[";".join(reversed(pila))] += 1
+
+    def iniciar(self):
+        self.hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self.hilo.start()
+
+    def parar(self):
+        self.parar_evento.set()
+        if self.hilo: self.hilo.join()
+
+    def funciones_calientes(self, n=15):
+        # Tiempo propio (la función en lo alto de la pila) por función
+        propias = Counter()
+        for pila, c in self.pilas.items():
+            propias[pila.rsplit(";", 1)[-1]] += c
+        return propias.most_common(n)
+
+    def guardar(self, ruta):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pila, c in self.pilas.most_common():
+                f.write(f"{pila} {c}\n")
+        total = sum(self.pilas.values())
+        print(f"[*] Perfil ({total} muestras) en {ruta}. Funciones más calientes:")
+        for funcion, c in self.funciones_calientes(10):
+            print(f"    {100.0 * c / max(total, 1):5.1f}%  {funcion}")
@@ -0,0 +1,87 @@
+import json
+import os
+import re
+
+from detector_keywords import normalizar
+
+# Detección de modelo y capacidad en una sola pasada sobre los tokens del título.
+# Los modelos se guardan en un trie de tokens normalizados y se elige la coincidencia
+# más larga ("iphone 13 mini" gana a "iphone 13", "iphone x" no casa con "iphone xr").
+
+CAPACIDADES_VALIDAS = {16, 32, 64, 128, 256, 512, 1024, 2048}
+_TOKEN = re.compile(r"\d+|[a-z]+")
+
+def tokenizar(texto):
+    # "iPhone13 Pro 128GB" -> ["iphone", "13", "pro", "128", "gb"]
+    return _TOKEN.findall(normalizar(texto))
+
+class IndiceModelos:
+    def __init__(self):
+        self.trie = {}
+        self.modelos = []   # id -> {"id", "modelo", "marca", "precio_min", "precio_por_capacidad"}
+
+    def anadir(self, modelo, precio_min, marca=None, alias=(), precio_por_capacidad=None):
+        entrada = {
+            "id": len(self.modelos),
+            "modelo": modelo,
+            "marca": marca,
+            "precio_min": precio_min,
+            "precio_por_capacidad": {int(k): v for k, v in (precio_por_capacidad or {}).items()}
+        }
+        self.modelos.append(entrada)
+        for nombre in [modelo, *alias]:
+            nodo = self.trie
+            for token in tokenizar(nombre):
+                nodo = nodo.setdefault(token, {})
+            # Si dos entradas comparten alias manda la primera
+            nodo.setdefault(None, entrada["id"])
+        return entrada
+
+    @classmethod
+    def desde_diccionario(cls, precios):
+        indice = cls()
+        for modelo, precio in precios.items():
+            indice.anadir(modelo, precio)
+        return indice
+
+    def cargar_archivo(self, ruta):
+        # Lista JSON de {"modelo", "precio_min", "marca"?, "alias"?, "precio_por_capacidad"?}
+        with open(ruta, "r", encoding="utf-8") as f:
+            for e in json.load(f):
+                self.anadir(e["modelo"], e["precio_min"], e.get("marca"), e.get("alias", []),
+                            e.get("precio_por_capacidad"))
+
+    def detectar(self, titulo):
+        # Devuelve (entrada del modelo o None, capacidad en GB o None)
+        tokens = tokenizar(titulo)
+        mejor = None   # (num_tokens, fin, id)
+        capacidad = None
+        for i, token in enumerate(tokens):
+            # Capacidad: número seguido de gb/tb
+            if capacidad is None and token.isdigit() and i + 1 < len(tokens) and tokens[i + 1] in ("gb", "tb"):
+                gb = int(token) * (1024 if tokens[i + 1] == "tb" else 1)
+                if gb in CAPACIDADES_VALIDAS: capacidad = gb
+
+            nodo = self.trie
+            j = i
+            while j < len(tokens) and tokens[j] in nodo:
+                nodo = nodo[tokens[j]]
+                j += 1
+                if None in nodo:
+                    candidato = (j - i, j, nodo[None])
+                    # Más tokens gana; a igualdad, la que termina más a la derecha ("13 mini" > "iphone 13")
+                    if mejor is None or candidato[:2] > mejor[:2]:
+                        mejor = candidato
+        return (self.modelos[mejor[2]] if mejor else None), capacidad
+
+    def precio_referencia(self, entrada, capacidad=None):
+        if capacidad and capacidad in entrada["precio_por_capacidad"]:
+            return entrada["precio_por_capacidad"][capacidad]
+        return entrada["precio_min"]
+
+def construir_indice(precios, ruta_extra=None):
+    # Tabla base (PRECIOS_REFERENCIA) + modelos adicionales del archivo de datos, si existe
+    indice = IndiceModelos.desde_diccionario(precios)
+    if ruta_extra and os.path.exists(ruta_extra):
+        indice.cargar_archivo(ruta_extra)
+    return indice
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import poller
+import metricas
+from descarga_concurrente import LimitadorTokens, crear_sesion_wallapop, buscar_items_concurrente, CONCURRENCIA
+
+# --- CONFIGURACIÓN ---
+# Lista de búsquedas (keywords + zona). Si no existe se usa la búsqueda por defecto del poller.
+ARCHIVO_BUSQUEDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "busquedas.json")
+MAX_TRABAJOS_SIMULTANEOS = 4
+INTERVALO_INICIAL = 300
+INTERVALO_MIN = 60
+INTERVALO_MAX = 1800
+# Intervalo adaptativo: con muchas novedades se acelera, sin novedades se relaja
+NUEVOS_CALIENTE = 5
+FACTOR_ACELERAR = 0.5
+FACTOR_RELAJAR = 1.5
+
+class TrabajoBusqueda:
+    def __init__(self, nombre, keywords, latitud, longitud, radio_km=None, intervalo=INTERVALO_INICIAL):
+        self.nombre = nombre
+        self.keywords = keywords
+        self.latitud = str(latitud)
+        self.longitud = str(longitud)
+        self.radio_km = radio_km
+        self.intervalo = intervalo
+        self.ids_previos = set()
+        self.ultimos_nuevos = 0
+
+    def construir_params(self, pagina):
+        params = poller.parametros_busqueda(pagina, self.keywords, self.latitud, self.longitud)
+        if self.radio_km: params["distance"] = int(self.radio_km * 1000)
+        return params
+
+    def ajustar_intervalo(self, nuevos):
+        self.ultimos_nuevos = nuevos
+        if nuevos >= NUEVOS_CALIENTE:
+            self.intervalo = max(INTERVALO_MIN, self.intervalo * FACTOR_ACELERAR)
+        elif nuevos == 0:
+            self.intervalo = min(INTERVALO_MAX, self.intervalo * FACTOR_RELAJAR)
+
+def cargar_trabajos(ruta=ARCHIVO_BUSQUEDAS):
+    if not os.path.exists(ruta):
+        return [TrabajoBusqueda("defecto", poller.SEARCH_KEYWORDS, "40.4168", "-3.7038")]
+    with open(ruta, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    trabajos = []
+    for b in config:
+        trabajos.append(TrabajoBusqueda(
+            b.get("nombre", f"{b['keywords']}@{b['latitud']},{b['longitud']}"),
+            b["keywords"], b["latitud"], b["longitud"],
+            b.get("radio_km"), b.get("intervalo", INTERVALO_INICIAL)
+        ))
+    return trabajos
+
+class Planificador:
+    # Ejecuta muchos TrabajoBusqueda en el mismo proceso con un único limitador
+    # de peticiones, una única sesión HTTP y un único contexto (índice de IDs, estadísticas...).
+    def __init__(self, trabajos, contexto=None):
+        self.trabajos = trabajos
+        self.contexto = contexto or poller.ContextoPoller()
+        self.limitador = LimitadorTokens()
+        self.sesion = crear_sesion_wallapop(poller.HEADERS, pool=MAX_TRABAJOS_SIMULTANEOS * CONCURRENCIA)
+        # Solo un trabajo escribe en el maestro a la vez
+        self.lock_guardado = threading.Lock()
+
+    def ejecutar_trabajo(self, trabajo):
+        inicio = time.monotonic()
+        items, motivo = buscar_items_concurrente(trabajo.construir_params, poller.NUM_PAGINAS_CONCURRENTE,
+                                                 poller.URL_API, self.sesion, self.limitador,
+                                                 ids_previos=trabajo.ids_previos)
+        with self.lock_guardado:
+            nuevos = poller.guardar_datos_incrementales(items, self.contexto, keywords=trabajo.keywords)
+        if items: trabajo.ids_previos = {i.get("id") for i in items}
+        trabajo.ajustar_intervalo(nuevos)
+        print(f"[*] [{trabajo.nombre}] {len(items)} items ({motivo}), {nuevos} nuevos en "
+              f"{time.monotonic() - inicio:.1f}s. Próxima en {trabajo.intervalo:.0f}s")
+
+    def ejecutar(self, parar=None):
+        parar = parar or threading.Event()
+        # Cola de prioridad (instante de ejecución, orden, trabajo)
+        cola = [(time.monotonic(), n, t) for n, t in enumerate(self.trabajos)]
+        heapq.heapify(cola)
+        en_curso = {}
+
+        with ThreadPoolExecutor(max_workers=MAX_TRABAJOS_SIMULTANEOS) as pool:
+            while not parar.is_set():
+                # Reprogramar los trabajos que han terminado
+                for futuro in [f for f in en_curso if f.done()]:
+                    n, trabajo = en_curso.pop(futuro)
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        print(f"[!] [{trabajo.nombre}] Falló el ciclo: {e}")
+                    heapq.heappush(cola, (time.monotonic() + trabajo.intervalo, n, trabajo))
+
+                ahora = time.monotonic()
+                while cola and cola[0][0] <= ahora and len(en_curso) < MAX_TRABAJOS_SIMULTANEOS:
+                    _, n, trabajo = heapq.heappop(cola)
+                    en_curso[pool.submit(self.ejecutar_trabajo, trabajo)] = (n, trabajo)
+
+                espera = max(0.0, cola[0][0] - time.monotonic()) if cola else 1.0
+                parar.wait(min(espera, 1.0))
+
+            print("[*] Parando planificador, esperando a los trabajos en curso...")
+        self.contexto.persistir()
+        self.sesion.close()
+
+if __name__ == "__main__":
+    metricas.iniciar("planificador", http=True)
+    trabajos = cargar_trabajos()
+    print(f"[*] --- PLANIFICADOR WALLAPOP --- {len(trabajos)} búsquedas")
+    parar = threading.Event()
+    planificador = Planificador(trabajos)
+    hilo = threading.Thread(target=planificador.ejecutar, args=(parar,))
+    hilo.start()
+    try:
+        while hilo.is_alive(): hilo.join(1)
+    except KeyboardInterrupt:
+        parar.set()
+        hilo.join()
+    planificador.contexto.cerrar()
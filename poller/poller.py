@@ -1,4 +1,5 @@
 import requests
+import argparse
 import json
 import os
 import time
@@ -6,6 +7,18 @@ from datetime import datetime, timezone
 from collections import Counter
 import statistics
 import re
+from indice_ids import IndiceIds
+from detector_keywords import DetectorKeywords
+from modelos import construir_indice
+from estadisticas_precio import EstadisticasPrecios, ARCHIVO_ESTADISTICAS
+from actividad_vendedores import ActividadVendedores, ARCHIVO_ACTIVIDAD
+from descarga_concurrente import LimitadorTokens, crear_sesion_wallapop, buscar_items_concurrente
+from alertas import crear_motor
+from duplicados import IndiceDuplicados, ARCHIVO_DUPLICADOS
+from huellas_imagen import IndiceHuellas, ARCHIVO_HUELLAS
+from almacenamiento import AlmacenNdjson
+import metricas
+import capturas
 
 # --- CONFIGURACIÓN ---
 SEARCH_KEYWORDS = "iphone"
@@ -14,17 +27,21 @@ UMBRAL_RIESGO_MINIMO = 40
 
 # --- 1. DICCIONARIO DE PRECIOS MÍNIMOS DE REFERENCIA ---
 # (Precios orientativos de segunda mano. Si baja mucho de aquí, es estafa).
-# IMPORTANTE: Ordenar de más específico a menos (15 Pro Max antes que 15).
+# El orden da igual: la detección se queda con la coincidencia más larga del título.
+# Otras líneas (Samsung, Pixel...) se añaden en modelos_referencia.json.
 PRECIOS_REFERENCIA = {
     "16 pro max": 1100, "16 pro": 950, "iphone 16": 800,
     "15 pro max": 850, "15 pro": 750, "15 plus": 650, "iphone 15": 550,
     "14 pro max": 700, "14 pro": 600, "14 plus": 500, "iphone 14": 450,
-    "13 pro max": 550, "13 pro": 480, "iphone 13": 350,
-    "12 pro max": 400, "12 pro": 350, "iphone 12": 250,
+    "13 pro max": 550, "13 pro": 480, "13 mini": 300, "iphone 13": 350,
+    "12 pro max": 400, "12 pro": 350, "12 mini": 200, "iphone 12": 250,
     "11 pro max": 300, "11 pro": 280, "iphone 11": 200,
     "iphone x": 150, "iphone xr": 150, "iphone xs": 160
 }
 
+ARCHIVO_MODELOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelos_referencia.json")
+INDICE_MODELOS = construir_indice(PRECIOS_REFERENCIA, ARCHIVO_MODELOS)
+
 # --- 2. FILTROS Y KEYWORDS ---
 PALABRAS_EXCLUIDAS = [
     "funda", "cargador", "case", "cristal", "tempered", "protector", "cable",
@@ -43,10 +60,38 @@ KEYWORDS_SOSPECHOSAS = [
     "leer bien", "no mareantes", "piezas", "sin face id", "tara"
 ]
 
+# Todas las listas compiladas en un único detector (una pasada por documento)
+DETECTOR = DetectorKeywords({
+    "excluidas": PALABRAS_EXCLUIDAS,
+    "criticas": KEYWORDS_CRITICAS,
+    "sospechosas": KEYWORDS_SOSPECHOSAS
+}, con_plural=("excluidas",))     # "fundas", "cables", "cargadores"... también excluyen
+
+# Teléfonos móviles camuflados en el texto (6xx xxx xxx / 7xx xxx xxx)
+PATRON_TELEFONO = re.compile(r'\b[67]\d{2}[\s.-]?\d{3}[\s.-]?\d{3}\b')
+
 NUM_PAGINAS = 5 
-URL_API = "https://api.wallapop.com/api/v3/search"
+URL_API = os.environ.get("WALLAPOP_API_URL", "https://api.wallapop.com/api/v3/search")
 HEADERS = {"Host": "api.wallapop.com", "X-DeviceOS": "0", "User-Agent": "Mozilla/5.0"}
 
+# --- DESCARGA ---
+# "secuencial": una página tras otra (modo original) | "concurrente": pool de hilos + token bucket
+MODO_DESCARGA = "concurrente"
+NUM_PAGINAS_CONCURRENTE = 25
+# IDs vistos en el ciclo anterior (para parar al solaparnos con lo ya descargado)
+ARCHIVO_ULTIMO_CICLO = ".ultimo_ciclo_ids.json"
+
+# --- ALERTAS ---
+# Evalúa las reglas de ElastAlert en el propio poller (latencia de segundos, sin consultar ES).
+# Desactivado por defecto: con ElastAlert desplegado cada coincidencia se notificaría dos veces.
+ALERTAS_EN_PROCESO = os.environ.get("WALLAPOP_ALERTAS", "0") == "1"
+# Huellas perceptuales de las fotos (descarga cada imagen nueva: desactivado por defecto)
+HUELLAS_IMAGEN = os.environ.get("WALLAPOP_HUELLAS", "0") == "1"
+
+# --- MÉTRICAS ---
+ITEMS = metricas.contador("items_total", "Items procesados por el poller según su destino", ("resultado",))
+RIESGO = metricas.histograma("riesgo_score", "Score de riesgo de los anuncios guardados", buckets=(40, 50, 60, 70, 80, 90, 100))
+
 def obtener_ids_existentes(ruta_archivo):
     ids = set()
     if not os.path.exists(ruta_archivo): return ids
@@ -57,11 +102,19 @@ def obtener_ids_existentes(ruta_archivo):
                     try:
                         doc = json.loads(linea)
                         if "id" in doc: ids.add(doc["id"])
-                    except: continue
-    except: pass
+                    except ValueError as e:
+                        metricas.registrar_error("maestro", e)
+                        continue
+    except OSError as e:
+        print(f"[!] No se pudo leer {ruta_archivo}: {e}")
+        metricas.registrar_error("maestro", e)
     return ids
 
-def calcular_riesgo_inteligente(item, stats_lote):
+def calcular_riesgo_inteligente(item, stats_lote, coincidencias=None, duplicado=None, imagen=None):
+    # coincidencias: resultado de DETECTOR.analizar() si ya se calculó fuera
+    # duplicado: cluster de casi duplicados de IndiceDuplicados.analizar() (o None)
+    # imagen: reutilización de la foto según IndiceHuellas.analizar_lote() (o None)
+    # Devuelve (score, razones, modelo detectado o None); el modelo va al documento tal cual
     score = 0
     razones = []
     
@@ -77,12 +130,11 @@ def calcular_riesgo_inteligente(item, stats_lote):
     modelo_detectado = None
     precio_ref = 0
 
-    # Buscamos qué modelo es en el título
-    for modelo, precio_min in PRECIOS_REFERENCIA.items():
-        if modelo in titulo:
-            modelo_detectado = modelo
-            precio_ref = precio_min
-            break # Paramos en la primera coincidencia (la más específica)
+    # Buscamos qué modelo es en el título (coincidencia más larga + capacidad)
+    entrada, capacidad = INDICE_MODELOS.detectar(titulo)
+    if entrada:
+        modelo_detectado = entrada["modelo"]
+        precio_ref = INDICE_MODELOS.precio_referencia(entrada, capacidad)
 
     if modelo_detectado:
         # Tenemos referencia específica (ej: iPhone 15 Pro)
@@ -92,6 +144,12 @@ def calcular_riesgo_inteligente(item, stats_lote):
         elif precio < (precio_ref * 0.6): # Menos del 60%
             score += 60
             razones.append(f"Precio muy bajo para {modelo_detectado}")
+        else:
+            # Mediana móvil del mercado para este modelo (si hay muestras suficientes)
+            mercado = stats_lote.get("referencia_mercado", {}).get(modelo_detectado)
+            if mercado and precio < (mercado * 0.5):
+                score += 40
+                razones.append(f"Precio bajo vs mercado de {modelo_detectado} ({precio}€ vs mediana {mercado:.0f}€)")
     else:
         # NO detectamos modelo exacto -> Usamos la media del lote (Plan B)
         precio_medio = stats_lote['precio_medio']
@@ -104,21 +162,24 @@ def calcular_riesgo_inteligente(item, stats_lote):
     # ==============================================================================
     
     # Detección de teléfonos en texto (6xx xxx xxx)
-    if re.search(r'\b[67]\d{2}[\s.-]?\d{3}[\s.-]?\d{3}\b', texto_completo):
+    if PATRON_TELEFONO.search(texto_completo):
         score += 50
         razones.append("Teléfono camuflado en descripción")
 
+    if coincidencias is None:
+        coincidencias, _ = DETECTOR.analizar(titulo, descripcion)
+
     # Keywords Críticas
-    criticas = [kw for kw in KEYWORDS_CRITICAS if kw in texto_completo]
+    criticas = coincidencias.get("criticas", [])
     if criticas:
         score += 50
-        razones.append(f"ALERTA: {', '.join(set(criticas))}")
+        razones.append(f"ALERTA: {', '.join(dict.fromkeys(criticas))}")
 
     # Keywords Sospechosas
-    sospechosas = [kw for kw in KEYWORDS_SOSPECHOSAS if kw in texto_completo]
+    sospechosas = coincidencias.get("sospechosas", [])
     if sospechosas:
         score += 15 * len(sospechosas)
-        razones.append(f"Sospechoso: {', '.join(set(sospechosas))}")
+        razones.append(f"Sospechoso: {', '.join(dict.fromkeys(sospechosas))}")
 
     # Vendedor Masivo
     num_anuncios = stats_lote['conteo_vendedores'].get(user_id, 0)
@@ -126,46 +187,115 @@ def calcular_riesgo_inteligente(item, stats_lote):
         score += 25
         razones.append(f"Vendedor masivo ({num_anuncios} items)")
 
+    # Casi duplicados: el mismo texto con otro ID (repost) o copiado entre vendedores
+    if duplicado:
+        if duplicado["sellers"] > 1:
+            score += 30
+            razones.append(f"Texto copiado entre {duplicado['sellers']} vendedores")
+        elif duplicado["cluster_size"] >= 3:
+            score += 15
+            razones.append(f"Anuncio repetido ({duplicado['cluster_size']} versiones)")
+
+    # Foto casi idéntica en anuncios de otros vendedores (foto robada / de stock)
+    if imagen and imagen["other_sellers"] > 0:
+        score += 35
+        razones.append(f"Foto reutilizada por {imagen['other_sellers']} vendedores más")
+
     # Descripción Corta
     if len(descripcion) < 15:
         score += 10
         razones.append("Descripción insuficiente")
 
-    return min(score, 100), razones
+    return min(score, 100), razones, modelo_detectado
+
+def parametros_busqueda(pagina, keywords=SEARCH_KEYWORDS, latitud="40.4168", longitud="-3.7038"):
+    return {
+        "keywords": keywords,
+        "order_by": "newest",
+        "time_filter": "today",
+        "latitude": latitud, "longitude": longitud,
+        "source": "search_box",
+        "start": pagina * 40
+    }
+
+def cargar_ids_ultimo_ciclo():
+    ruta = os.path.join(os.path.dirname(os.path.abspath(ruta_archivo_maestro())), ARCHIVO_ULTIMO_CICLO)
+    if not os.path.exists(ruta): return set()
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return set(json.load(f))
+    except (OSError, ValueError):
+        return set()
+
+def guardar_ids_ultimo_ciclo(items):
+    ruta = os.path.join(os.path.dirname(os.path.abspath(ruta_archivo_maestro())), ARCHIVO_ULTIMO_CICLO)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump([i.get("id") for i in items if i.get("id")], f)
+
+def documento_a_item(doc):
+    # Inversa (aproximada) del documento que guarda guardar_datos_incrementales:
+    # devuelve un item con la forma de la API para volver a puntuarlo
+    location = doc.get("location") or {}
+    geo = location.get("geo") or {}
+    return {
+        "id": doc.get("id"),
+        "title": doc.get("title"),
+        "description": doc.get("description"),
+        "price": {"amount": doc.get("price"), "currency": doc.get("currency")},
+        "category_id": doc.get("category_id"),
+        "user_id": doc.get("user_id"),
+        "images": [{"urls": {"medium": doc["image_url"]}}] if doc.get("image_url") else [],
+        "location": {"latitude": geo.get("lat"), "longitude": geo.get("lon"), "city": location.get("city")}
+    }
+
+def buscar_items_paginados(ids_previos=None, sesion=None, limitador=None):
+    # 'sesion' y 'limitador' permiten reutilizar conexiones y ritmo entre ciclos (monitor en proceso)
+    sesion_propia = sesion is None
+    if MODO_DESCARGA == "concurrente":
+        print(f"[*] Buscando '{SEARCH_KEYWORDS}' (concurrente, hasta {NUM_PAGINAS_CONCURRENTE} páginas)...")
+        if sesion_propia: sesion = crear_sesion_wallapop(HEADERS)
+        with metricas.cronometro("descarga"):
+            items, motivo = buscar_items_concurrente(parametros_busqueda, NUM_PAGINAS_CONCURRENTE, URL_API,
+                                                     sesion, limitador or LimitadorTokens(), ids_previos=ids_previos)
+        if sesion_propia: sesion.close()
+        print(f"[*] {len(items)} items descargados (parada: {motivo})")
+        return items
 
-def buscar_items_paginados():
     all_items = []
     print(f"[*] Buscando '{SEARCH_KEYWORDS}'...")
+    # Capturando o reproduciendo hace falta la sesión (lleva el hook o sirve las capturas)
+    if sesion_propia and (capturas.DIRECTORIO_CAPTURA or capturas.reproduciendo()):
+        sesion = crear_sesion_wallapop(HEADERS)
     
     for i in range(NUM_PAGINAS):
-        params = {
-            "keywords": SEARCH_KEYWORDS,
-            "order_by": "newest",
-            "time_filter": "today", 
-            "latitude": "40.4168", "longitude": "-3.7038",
-            "source": "search_box",
-            "start": i * 40
-        }
+        params = parametros_busqueda(i)
         try:
-            r = requests.get(URL_API, headers=HEADERS, params=params, timeout=10)
+            with metricas.LATENCIA_HTTP.medir(destino="wallapop"):
+                r = (sesion or requests).get(URL_API, headers=HEADERS, params=params, timeout=10)
+            metricas.RESPUESTAS_HTTP.inc(destino="wallapop", codigo=r.status_code)
             items = r.json().get("data", {}).get("section", {}).get("payload", {}).get("items", [])
             if not items: break
             all_items.extend(items)
             time.sleep(0.5) 
-        except: break
+        except (requests.RequestException, ValueError) as e:
+            print(f"[!] Página {i} falló: {e}")
+            metricas.registrar_error("descarga", e)
+            break
+    if sesion_propia and sesion: sesion.close()
     return all_items
 
-def guardar_datos_incrementales(items):
+def ruta_archivo_maestro():
+    # Con WALLAPOP_DATOS (--datos, o el directorio temporal de una reproducción) todo el estado va allí
+    datos = capturas.directorio_datos()
+    if datos:
+        return os.path.join(datos, ARCHIVO_MAESTRO)
     if os.path.exists("../ingestion"):
-        ruta_completa = os.path.join("..", "ingestion", ARCHIVO_MAESTRO)
+        return os.path.join("..", "ingestion", ARCHIVO_MAESTRO)
     elif os.path.exists("ingestion"):
-        ruta_completa = os.path.join("ingestion", ARCHIVO_MAESTRO)
-    else:
-        ruta_completa = ARCHIVO_MAESTRO
-
-    ids_existentes = obtener_ids_existentes(ruta_completa)
+        return os.path.join("ingestion", ARCHIVO_MAESTRO)
+    return ARCHIVO_MAESTRO
 
-    # Calculamos stats generales por si acaso
+def calcular_stats_lote(items):
     if items:
         precios = [i.get("price", {}).get("amount", 0) for i in items if i.get("price", {}).get("amount", 0) > 50]
         precio_medio_lote = statistics.median(precios) if precios else 400
@@ -175,68 +305,217 @@ def guardar_datos_incrementales(items):
         precio_medio_lote = 400
         conteo_vendedores = {}
 
-    stats_lote = {"precio_medio": precio_medio_lote, "conteo_vendedores": conteo_vendedores}
+    return {"precio_medio": precio_medio_lote, "conteo_vendedores": conteo_vendedores}
+
+def construir_documento(item, risk_score, risk_factors, found_kw, duplicado=None, imagen=None, modelo=None):
+    # Documento del maestro / Elastic a partir de un item de la API ya puntuado
+    # (modelo: el que detectó calcular_riesgo_inteligente, para no volver a buscarlo en el título)
+    ts_millis = item.get("created_at")
+    fecha_pub = datetime.fromtimestamp(ts_millis/1000.0, timezone.utc).isoformat() if ts_millis else datetime.now(timezone.utc).isoformat()
+    
+    imagenes = item.get("images", [])
+    img_url = imagenes[0].get("urls", {}).get("medium") if imagenes else None
+
+    doc = {
+        "id": item.get("id"),
+        "title": item.get("title"),
+        "description": item.get("description"),
+        "price": item.get("price", {}).get("amount"),
+        "currency": item.get("price", {}).get("currency"),
+        "category_id": item.get("category_id"),
+        "user_id": item.get("user_id"),
+        "image_url": img_url,
+        "location": {
+            "geo": { "lat": item.get("location", {}).get("latitude"), "lon": item.get("location", {}).get("longitude") },
+            "city": item.get("location", {}).get("city")
+        },
+        "timestamps": {
+            "crawled_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": fecha_pub
+        },
+        "enrichment": {
+            "risk_score": risk_score,
+            "risk_factors": risk_factors,
+            "suspicious_keywords": found_kw,
+            "model": modelo
+        }
+    }
+    if duplicado: doc["enrichment"]["near_duplicate"] = duplicado
+    if imagen: doc["enrichment"]["image"] = imagen
+    return doc
+
+class ContextoPoller:
+    # Estado que se conserva entre ciclos: índice de IDs, estadísticas de mercado y actividad de vendedores
+    def __init__(self, ruta_maestro=None):
+        self.ruta_maestro = ruta_maestro or ruta_archivo_maestro()
+        directorio = os.path.dirname(os.path.abspath(self.ruta_maestro))
+        self.indice = IndiceIds(self.ruta_maestro)
+        # Escritura por lotes en el maestro (la ingesta lo lleva después a Elastic / SQLite)
+        self.almacen = AlmacenNdjson(self.ruta_maestro)
+        self.estadisticas = EstadisticasPrecios.cargar(os.path.join(directorio, ARCHIVO_ESTADISTICAS))
+        self.actividad = ActividadVendedores.cargar(os.path.join(directorio, ARCHIVO_ACTIVIDAD))
+        # Reglas de elastalert/rules evaluadas en proceso sobre cada documento guardado
+        self.alertas = crear_motor(directorio) if ALERTAS_EN_PROCESO else None
+        # Firmas MinHash/LSH para detectar reposts y textos copiados
+        self.duplicados = IndiceDuplicados(os.path.join(directorio, ARCHIVO_DUPLICADOS))
+        self.huellas = IndiceHuellas(os.path.join(directorio, ARCHIVO_HUELLAS)) if HUELLAS_IMAGEN else None
+
+    def persistir(self):
+        self.indice.commit()
+        self.duplicados.commit()
+        if self.huellas: self.huellas.commit()
+        self.estadisticas.guardar()
+        self.actividad.guardar()
+        if self.alertas: self.alertas.guardar_estado()
+
+    def cerrar(self):
+        self.persistir()
+        self.indice.cerrar()
+        self.duplicados.cerrar()
+        if self.alertas: self.alertas.cerrar()
+        if self.huellas: self.huellas.cerrar()
+
+def guardar_datos_incrementales(items, contexto=None, keywords=SEARCH_KEYWORDS):
+    inicio_guardado = time.perf_counter()
+    contexto_propio = contexto is None
+    if contexto_propio: contexto = ContextoPoller()
+    else: contexto.indice.sincronizar()
+
+    # Índice persistente de IDs (antes: obtener_ids_existentes releía todo el maestro).
+    # Los IDs guardados en este ciclo solo entran en él cuando el append al maestro ha ido bien.
+    indice = contexto.indice
+    ids_existentes = indice
+    ids_lote = set()
+
+    # Calculamos stats generales por si acaso
+    stats_lote = calcular_stats_lote(items)
+    # Referencia de mercado según lo visto en ciclos anteriores (no se mezcla con este lote)
+    stats_lote["referencia_mercado"] = contexto.estadisticas.consulta()
+    vistos_por_primera_vez = set(indice.registrar_vistos([i.get("id") for i in items]))
+    muestras_precio = []
+
+    # Vendedor masivo entre ciclos: cada anuncio nuevo cuenta en la actividad del vendedor
+    # y el conteo usado es el mayor entre el del lote y el de las últimas 24h.
+    for item in items:
+        if item.get("id") in vistos_por_primera_vez:
+            ts = (item.get("created_at") or time.time() * 1000) / 1000.0
+            contexto.actividad.registrar(item.get("user_id"), ts)
+    conteo_vendedores = stats_lote["conteo_vendedores"]
+    for user_id in list(conteo_vendedores):
+        conteo_vendedores[user_id] = max(conteo_vendedores[user_id], contexto.actividad.contar(user_id, "24h"))
     
     nuevos = 0
     omitidos = 0
+    resultados = Counter()
+    tiempos = Counter()   # segundos acumulados por etapa (se observan una vez por ciclo)
+
+    # Huellas de las fotos de los candidatos: se descargan en paralelo antes de puntuar
+    imagenes = {}
+    if contexto.huellas:
+        t = time.perf_counter()
+        candidatos = [i for i in items if i.get("id") not in ids_existentes
+                      and keywords.lower() in (i.get("title") or "").lower()]
+        imagenes = contexto.huellas.analizar_lote(candidatos)
+        tiempos["huellas"] += time.perf_counter() - t
 
     print(f"[*] Procesando {len(items)} items...")
     
-    with open(ruta_completa, "a", encoding="utf-8") as f:
-        for item in items:
-            titulo = item.get("title", "").lower()
-            
-            # Filtros básicos
-            if any(p in titulo for p in PALABRAS_EXCLUIDAS): continue
-            if SEARCH_KEYWORDS.lower() not in titulo: continue 
-            if item.get("id") in ids_existentes: continue
-
-            # --- RIESGO INTELIGENTE ---
-            risk_score, risk_factors = calcular_riesgo_inteligente(item, stats_lote)
-
-            if risk_score < UMBRAL_RIESGO_MINIMO:
-                omitidos += 1
-                continue 
-            
-            # Preparar documento
-            ts_millis = item.get("created_at")
-            fecha_pub = datetime.fromtimestamp(ts_millis/1000.0, timezone.utc).isoformat() if ts_millis else datetime.now(timezone.utc).isoformat()
-            
-            imagenes = item.get("images", [])
-            img_url = imagenes[0].get("urls", {}).get("medium") if imagenes else None
-
-            all_kw = KEYWORDS_CRITICAS + KEYWORDS_SOSPECHOSAS
-            found_kw = [kw for kw in all_kw if kw in (titulo + " " + (item.get("description") or "").lower())]
-
-            doc = {
-                "id": item.get("id"),
-                "title": item.get("title"),
-                "description": item.get("description"),
-                "price": item.get("price", {}).get("amount"),
-                "currency": item.get("price", {}).get("currency"),
-                "category_id": item.get("category_id"),
-                "user_id": item.get("user_id"),
-                "image_url": img_url,
-                "location": {
-                    "geo": { "lat": item.get("location", {}).get("latitude"), "lon": item.get("location", {}).get("longitude") },
-                    "city": item.get("location", {}).get("city")
-                },
-                "timestamps": {
-                    "crawled_at": datetime.now(timezone.utc).isoformat(),
-                    "created_at": fecha_pub
-                },
-                "enrichment": {
-                    "risk_score": risk_score,
-                    "risk_factors": risk_factors,
-                    "suspicious_keywords": found_kw
-                }
-            }
-            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
-            ids_existentes.add(item.get("id"))
-            nuevos += 1
+    lote = []
+    guardados = []
+    for item in items:
+        titulo = item.get("title", "").lower()
+        
+        # Filtros básicos
+        if item.get("id") in ids_lote or item.get("id") in ids_existentes:
+            resultados["duplicado"] += 1
+            continue
+        if keywords.lower() not in titulo:
+            resultados["sin_keyword"] += 1
+            continue 
+        t = time.perf_counter()
+        coincidencias, categorias_titulo = DETECTOR.analizar(titulo, item.get("description") or "")
+        tiempos["keywords"] += time.perf_counter() - t
+        if "excluidas" in categorias_titulo:
+            resultados["excluido"] += 1
+            continue
+
+        t = time.perf_counter()
+        duplicado = contexto.duplicados.analizar(item)
+        tiempos["duplicados"] += time.perf_counter() - t
+        imagen = imagenes.get(item.get("id"))
+
+        # --- RIESGO INTELIGENTE ---
+        t = time.perf_counter()
+        risk_score, risk_factors, modelo = calcular_riesgo_inteligente(item, stats_lote, coincidencias, duplicado, imagen)
+        tiempos["scoring"] += time.perf_counter() - t
+
+        if modelo and item.get("id") in vistos_por_primera_vez:
+            ts = (item.get("created_at") or time.time() * 1000) / 1000.0
+            muestras_precio.append((modelo, item.get("price", {}).get("amount"), ts))
+
+        if risk_score < UMBRAL_RIESGO_MINIMO:
+            omitidos += 1
+            resultados["bajo_umbral"] += 1
+            continue 
+        
+        # Preparar documento
+        found_kw = coincidencias.get("criticas", []) + coincidencias.get("sospechosas", [])
+        t = time.perf_counter()
+        doc = construir_documento(item, risk_score, risk_factors, found_kw, duplicado, imagen, modelo)
+        lote.append(contexto.almacen.preparar(doc))
+        tiempos["persistencia"] += time.perf_counter() - t
+        guardados.append(doc)
+        ids_lote.add(item.get("id"))
+        RIESGO.observar(risk_score)
+        nuevos += 1
+
+    # Todo el ciclo en una escritura (también sin docs: deja la posición actual del maestro)
+    # Si el append falla (disco lleno, permisos) los IDs no se marcan: el siguiente ciclo los reintenta
+    t = time.perf_counter()
+    indice.commit()
+    try:
+        _, pendientes, _ = contexto.almacen.enviar(lote)
+    except OSError:
+        indice.rollback()
+        raise
+    tiempos["persistencia"] += time.perf_counter() - t
+    if not pendientes:
+        for id_item in ids_lote: indice.add(id_item)
+    indice.marcar_sincronizado(contexto.almacen.posicion)
+
+    # Solo se alerta de lo que ya está guardado (la entrega va en el hilo del motor)
+    if contexto.alertas and not pendientes:
+        t = time.perf_counter()
+        for doc in guardados:
+            contexto.alertas.evaluar(doc)
+        tiempos["alertas"] += time.perf_counter() - t
+
+    for modelo, precio, ts in muestras_precio:
+        contexto.estadisticas.actualizar(modelo, precio, ts)
 
+    if contexto_propio: contexto.cerrar()
+    else: contexto.persistir()
+    resultados["guardado"] = nuevos
+    for resultado, n in resultados.items():
+        ITEMS.inc(n, resultado=resultado)
+    for etapa, segundos in tiempos.items():
+        metricas.ETAPAS.observar(segundos, etapa=etapa)
+    metricas.ETAPAS.observar(time.perf_counter() - inicio_guardado, etapa="guardado")
     print(f"[*] Guardados: {nuevos} | Omitidos: {omitidos}")
+    return nuevos
 
 if __name__ == "__main__":
-    items = buscar_items_paginados()
-    guardar_datos_incrementales(items)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Poller de anuncios de Wallapop")
+    parser.add_argument("--capturar", metavar="DIR", help="Guarda las respuestas crudas de la API en DIR")
+    parser.add_argument("--reproducir", metavar="DIR", help="Sirve las búsquedas desde capturas de DIR, sin red")
+    parser.add_argument("--velocidad", type=float, help="Factor de aceleración al reproducir (0 = sin esperas)")
+    parser.add_argument("--datos", metavar="DIR",
+                        help="Directorio del maestro y su estado (al reproducir, por defecto uno temporal)")
+    args = parser.parse_args()
+    capturas.configurar(args.capturar, args.reproducir, args.velocidad, args.datos)
+    metricas.iniciar("poller")
+    contexto = ContextoPoller()
+    items = buscar_items_paginados(cargar_ids_ultimo_ciclo())
+    guardar_datos_incrementales(items, contexto)
+    contexto.cerrar()
+    if items: guardar_ids_ultimo_ciclo(items)
\ No newline at end of file
@@ -0,0 +1,261 @@
+import json
+import os
+import argparse
+import numpy as np
+
+import poller
+from duplicados import IndiceDuplicados
+from estadisticas_precio import EstadisticasPrecios, ARCHIVO_ESTADISTICAS
+
+# Motor de scoring por lotes: las reglas de calcular_riesgo_inteligente expresadas
+# como operaciones NumPy sobre columnas. calcular_riesgo_inteligente sigue siendo la
+# implementación de referencia; --verificar comprueba que ambas dan lo mismo.
+
+# --- CONFIGURACIÓN (mismos valores que la referencia) ---
+UMBRALES = {
+    "ratio_imposible": 0.4,   # precio < 40% de la referencia del modelo
+    "ratio_muy_bajo": 0.6,    # precio < 60% de la referencia del modelo
+    "ratio_media": 0.4,       # sin modelo: precio < 40% de la mediana del lote
+    "ratio_mercado": 0.5,     # precio < 50% de la mediana móvil del modelo
+    "min_anuncios_masivo": 3,
+    "min_longitud_desc": 15,
+    "min_cluster_repetido": 3,  # versiones del mismo anuncio (un solo vendedor) para contar como repost
+}
+PESOS = {
+    "precio_imposible": 95, "precio_muy_bajo": 60, "precio_bajo_media": 40, "precio_bajo_mercado": 40,
+    "telefono": 50, "criticas": 50, "sospechosa": 15, "masivo": 25, "desc_corta": 10,
+    "texto_copiado": 30, "repetido": 15, "foto_reutilizada": 35,
+}
+
+# --- CÓDIGOS DE RAZÓN (bitmask por item) ---
+RAZON_PRECIO_IMPOSIBLE = 1 << 0
+RAZON_PRECIO_MUY_BAJO = 1 << 1
+RAZON_PRECIO_BAJO_MEDIA = 1 << 2
+RAZON_TELEFONO = 1 << 3
+RAZON_CRITICAS = 1 << 4
+RAZON_SOSPECHOSAS = 1 << 5
+RAZON_MASIVO = 1 << 6
+RAZON_DESC_CORTA = 1 << 7
+RAZON_PRECIO_BAJO_MERCADO = 1 << 8
+RAZON_TEXTO_COPIADO = 1 << 9
+RAZON_REPETIDO = 1 << 10
+RAZON_FOTO_REUTILIZADA = 1 << 11
+
+def extraer_columnas(items, coincidencias=None, duplicados=None, imagenes=None):
+    # Convierte la lista de items de la API en columnas. Las features de texto
+    # (regex, keywords, modelo) se calculan una vez por item; el resto es vectorial.
+    # duplicados: resultado de IndiceDuplicados.analizar() por item (o None), en el mismo orden.
+    # imagenes: {id: reutilización} de IndiceHuellas.analizar_lote() (o None).
+    n = len(items)
+    precio = np.zeros(n, dtype=np.float64)
+    precio_ref = np.zeros(n, dtype=np.float64)
+    modelo_id = np.full(n, -1, dtype=np.int32)
+    telefono = np.zeros(n, dtype=bool)
+    num_criticas = np.zeros(n, dtype=np.int32)
+    num_sospechosas = np.zeros(n, dtype=np.int32)
+    long_desc = np.zeros(n, dtype=np.int32)
+    dup_vendedores = np.zeros(n, dtype=np.int32)
+    dup_tamano = np.zeros(n, dtype=np.int32)
+    foto_vendedores = np.zeros(n, dtype=np.int32)
+    vendedores = []
+    precios_py = []
+    refs_py = []
+    criticas = []
+    sospechosas = []
+
+    for i, item in enumerate(items):
+        precios_py.append(item.get("price", {}).get("amount", 0))
+        precio[i] = precios_py[-1]
+        titulo = (item.get("title") or "").lower()
+        descripcion = (item.get("description") or "").lower()
+        entrada, capacidad = poller.INDICE_MODELOS.detectar(titulo)
+        if entrada:
+            modelo_id[i] = entrada["id"]
+            refs_py.append(poller.INDICE_MODELOS.precio_referencia(entrada, capacidad))
+            precio_ref[i] = refs_py[-1]
+        else:
+            refs_py.append(0)
+        telefono[i] = poller.PATRON_TELEFONO.search(titulo + " " + descripcion) is not None
+        hits = coincidencias[i] if coincidencias is not None else poller.DETECTOR.analizar(titulo, descripcion)[0]
+        criticas.append(hits.get("criticas", []))
+        sospechosas.append(hits.get("sospechosas", []))
+        num_criticas[i] = len(criticas[-1])
+        num_sospechosas[i] = len(sospechosas[-1])
+        long_desc[i] = len(descripcion)
+        vendedores.append(item.get("user_id"))
+        duplicado = duplicados[i] if duplicados is not None else None
+        if duplicado:
+            dup_vendedores[i] = duplicado["sellers"]
+            dup_tamano[i] = duplicado["cluster_size"]
+        imagen = imagenes.get(item.get("id")) if imagenes is not None else None
+        if imagen:
+            foto_vendedores[i] = imagen["other_sellers"]
+
+    return {
+        "precio": precio, "precio_ref": precio_ref, "modelo_id": modelo_id,
+        "vendedor": np.array(vendedores, dtype=object),
+        "telefono": telefono, "num_criticas": num_criticas, "num_sospechosas": num_sospechosas,
+        "long_desc": long_desc, "dup_vendedores": dup_vendedores, "dup_tamano": dup_tamano,
+        "foto_vendedores": foto_vendedores,
+        # Solo para componer los textos de las razones (valores Python originales)
+        "criticas": criticas, "sospechosas": sospechosas, "precios_py": precios_py, "refs_py": refs_py,
+    }
+
+def conteos_vendedor(columnas, conteo_vendedores=None):
+    # Nº de anuncios por vendedor para cada fila: del dict externo o contando en el propio lote
+    vendedores = columnas["vendedor"]
+    if conteo_vendedores is not None:
+        return np.array([conteo_vendedores.get(v, 0) for v in vendedores], dtype=np.int64)
+    claves = np.array([str(v) for v in vendedores])
+    _, inversa, cuentas = np.unique(claves, return_inverse=True, return_counts=True)
+    return cuentas[inversa]
+
+def mediana_mercado(columnas, referencia_mercado=None):
+    # Mediana móvil del modelo de cada fila (0 si no hay modelo o no hay muestras suficientes)
+    mercado = np.zeros(len(columnas["precio"]), dtype=np.float64)
+    if referencia_mercado is None: return mercado
+    ids, inversa = np.unique(columnas["modelo_id"], return_inverse=True)
+    valores = np.array([
+        (referencia_mercado.get(poller.INDICE_MODELOS.modelos[m]["modelo"]) or 0) if m >= 0 else 0
+        for m in ids
+    ], dtype=np.float64)
+    return valores[inversa] if len(ids) else mercado
+
+def puntuar_lote(columnas, precio_medio, conteo_vendedores=None, referencia_mercado=None,
+                 umbrales=UMBRALES, pesos=PESOS):
+    # Devuelve (scores int64, códigos de razón uint16, nº anuncios por vendedor)
+    precio = columnas["precio"]
+    ref = columnas["precio_ref"]
+    con_modelo = ref > 0
+
+    imposible = con_modelo & (precio < ref * umbrales["ratio_imposible"])
+    muy_bajo = con_modelo & ~imposible & (precio < ref * umbrales["ratio_muy_bajo"])
+    mercado = mediana_mercado(columnas, referencia_mercado)
+    columnas["mercado"] = mercado
+    bajo_mercado = (con_modelo & ~imposible & ~muy_bajo & (mercado > 0)
+                    & (precio < mercado * umbrales["ratio_mercado"]))
+    bajo_media = ~con_modelo & (precio_medio > 0) & (precio < precio_medio * umbrales["ratio_media"])
+    criticas = columnas["num_criticas"] > 0
+    sospechosas = columnas["num_sospechosas"] > 0
+    anuncios = conteos_vendedor(columnas, conteo_vendedores)
+    masivo = anuncios >= umbrales["min_anuncios_masivo"]
+    desc_corta = columnas["long_desc"] < umbrales["min_longitud_desc"]
+    telefono = columnas["telefono"]
+    texto_copiado = columnas["dup_vendedores"] > 1
+    repetido = ~texto_copiado & (columnas["dup_tamano"] >= umbrales["min_cluster_repetido"])
+    foto_reutilizada = columnas["foto_vendedores"] > 0
+
+    score = (pesos["precio_imposible"] * imposible
+             + pesos["precio_muy_bajo"] * muy_bajo
+             + pesos["precio_bajo_media"] * bajo_media
+             + pesos["precio_bajo_mercado"] * bajo_mercado
+             + pesos["telefono"] * telefono
+             + pesos["criticas"] * criticas
+             + pesos["sospechosa"] * columnas["num_sospechosas"]
+             + pesos["masivo"] * masivo
+             + pesos["texto_copiado"] * texto_copiado
+             + pesos["repetido"] * repetido
+             + pesos["foto_reutilizada"] * foto_reutilizada
+             + pesos["desc_corta"] * desc_corta).astype(np.int64)
+    score = np.minimum(score, 100)
+
+    codigos = (imposible * RAZON_PRECIO_IMPOSIBLE
+               | muy_bajo * RAZON_PRECIO_MUY_BAJO
+               | bajo_media * RAZON_PRECIO_BAJO_MEDIA
+               | bajo_mercado * RAZON_PRECIO_BAJO_MERCADO
+               | telefono * RAZON_TELEFONO
+               | criticas * RAZON_CRITICAS
+               | sospechosas * RAZON_SOSPECHOSAS
+               | masivo * RAZON_MASIVO
+               | texto_copiado * RAZON_TEXTO_COPIADO
+               | repetido * RAZON_REPETIDO
+               | foto_reutilizada * RAZON_FOTO_REUTILIZADA
+               | desc_corta * RAZON_DESC_CORTA).astype(np.uint16)
+    return score, codigos, anuncios
+
+def textos_razones(columnas, codigos, anuncios, precio_medio, i):
+    # Reconstruye la lista risk_factors de la fila i con los mismos textos que la referencia
+    c = int(codigos[i])
+    precio = columnas["precios_py"][i]
+    razones = []
+    if c & (RAZON_PRECIO_IMPOSIBLE | RAZON_PRECIO_MUY_BAJO | RAZON_PRECIO_BAJO_MERCADO):
+        entrada = poller.INDICE_MODELOS.modelos[columnas["modelo_id"][i]]
+        ref = columnas["refs_py"][i]
+        if c & RAZON_PRECIO_IMPOSIBLE:
+            razones.append(f"PRECIO IMPOSIBLE para {entrada['modelo']} ({precio}€ vs Ref {ref}€)")
+        elif c & RAZON_PRECIO_MUY_BAJO:
+            razones.append(f"Precio muy bajo para {entrada['modelo']}")
+        else:
+            razones.append(f"Precio bajo vs mercado de {entrada['modelo']} "
+                           f"({precio}€ vs mediana {columnas['mercado'][i]:.0f}€)")
+    if c & RAZON_PRECIO_BAJO_MEDIA:
+        razones.append(f"Precio bajo vs Media general ({precio}€ vs {precio_medio:.0f}€)")
+    if c & RAZON_TELEFONO:
+        razones.append("Teléfono camuflado en descripción")
+    if c & RAZON_CRITICAS:
+        razones.append(f"ALERTA: {', '.join(dict.fromkeys(columnas['criticas'][i]))}")
+    if c & RAZON_SOSPECHOSAS:
+        razones.append(f"Sospechoso: {', '.join(dict.fromkeys(columnas['sospechosas'][i]))}")
+    if c & RAZON_MASIVO:
+        razones.append(f"Vendedor masivo ({anuncios[i]} items)")
+    if c & RAZON_TEXTO_COPIADO:
+        razones.append(f"Texto copiado entre {columnas['dup_vendedores'][i]} vendedores")
+    if c & RAZON_REPETIDO:
+        razones.append(f"Anuncio repetido ({columnas['dup_tamano'][i]} versiones)")
+    if c & RAZON_FOTO_REUTILIZADA:
+        razones.append(f"Foto reutilizada por {columnas['foto_vendedores'][i]} vendedores más")
+    if c & RAZON_DESC_CORTA:
+        razones.append("Descripción insuficiente")
+    return razones
+
+def verificar_equivalencia(items, stats_lote, duplicados=None, imagenes=None):
+    # Compara motor por lotes y referencia item a item. Devuelve la lista de discrepancias.
+    duplicados = duplicados if duplicados is not None else [None] * len(items)
+    imagenes = imagenes or {}
+    columnas = extraer_columnas(items, duplicados=duplicados, imagenes=imagenes)
+    scores, codigos, anuncios = puntuar_lote(columnas, stats_lote["precio_medio"], stats_lote["conteo_vendedores"],
+                                             stats_lote.get("referencia_mercado"))
+    diferencias = []
+    for i, item in enumerate(items):
+        ref_score, ref_razones, _ = poller.calcular_riesgo_inteligente(item, stats_lote, duplicado=duplicados[i],
+                                                                   imagen=imagenes.get(item.get("id")))
+        razones = textos_razones(columnas, codigos, anuncios, stats_lote["precio_medio"], i)
+        if ref_score != scores[i] or ref_razones != razones:
+            diferencias.append((item.get("id"), ref_score, int(scores[i]), ref_razones, razones))
+    return diferencias
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scoring vectorizado por lotes")
+    parser.add_argument("--verificar", action="store_true", help="Compara contra calcular_riesgo_inteligente")
+    parser.add_argument("--maestro", default=None, help="Archivo NDJSON con documentos a puntuar")
+    args = parser.parse_args()
+
+    ruta = args.maestro or poller.ruta_archivo_maestro()
+    with open(ruta, "r", encoding="utf-8") as f:
+        docs = [json.loads(l) for l in f if l.strip()]
+    items = [poller.documento_a_item(doc) for doc in docs]
+    stats_lote = poller.calcular_stats_lote(items)
+    ruta_estadisticas = os.path.join(os.path.dirname(os.path.abspath(ruta)), ARCHIVO_ESTADISTICAS)
+    stats_lote["referencia_mercado"] = EstadisticasPrecios.cargar(ruta_estadisticas).consulta()
+
+    if args.verificar:
+        # Clusters de casi duplicados calculados al vuelo (índice en memoria) para cubrir esas reglas
+        indice_duplicados = IndiceDuplicados(":memory:")
+        duplicados = [indice_duplicados.analizar(item) for item in items]
+        indice_duplicados.cerrar()
+        # Reutilización de foto: la guardada en el documento; si el maestro no trae ninguna (hace falta
+        # descargar las fotos), una sintética en uno de cada 5 items para que la regla también se compare
+        imagenes = {d.get("id"): d["enrichment"]["image"] for d in docs if (d.get("enrichment") or {}).get("image")}
+        if not imagenes:
+            imagenes = {item.get("id"): {"other_sellers": 1 + i % 3} for i, item in enumerate(items) if i % 5 == 0}
+        diferencias = verificar_equivalencia(items, stats_lote, duplicados, imagenes)
+        for d in diferencias[:20]:
+            print(f"[!] {d[0]}: referencia={d[1]} lote={d[2]}\n    {d[3]}\n    {d[4]}")
+        print(f"[*] {len(items)} items comparados ({sum(1 for d in duplicados if d)} en clusters de duplicados, "
+              f"{len(imagenes)} con foto reutilizada) | Discrepancias: {len(diferencias)}")
+    else:
+        columnas = extraer_columnas(items)
+        scores, _, _ = puntuar_lote(columnas, stats_lote["precio_medio"], stats_lote["conteo_vendedores"],
+                                    stats_lote["referencia_mercado"])
+        print(f"[*] {len(items)} items puntuados | Riesgo >= {poller.UMBRAL_RIESGO_MINIMO}: "
+              f"{int((scores >= poller.UMBRAL_RIESGO_MINIMO).sum())}")